@@ -0,0 +1,265 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        fake_ia
+# Purpose: Local stand-in for the archive.org metadata, download and search APIs, for benchmarking.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import sys
+import logging
+import argparse
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.parse
+import http.server
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+
+
+
+BLOCK_SIZE = 64 * 1024 # Synthetic file bodies are one block repeated, so they never need to be held in memory.
+SEARCH_PAGE_SIZE = 100 # Results per scrape API page.
+UPLOADER = 'bench@example.com'
+
+
+class SyntheticFile():
+    """A file whose body is generated on demand from its name."""
+    def __init__(self, identifier:str, name:str, size:int):
+        self.name = name
+        self.size = size
+        seed = hashlib.sha256('{0}/{1}'.format(identifier, name).encode('utf8')).digest()
+        self.block = (seed * ((BLOCK_SIZE // len(seed)) + 1))[:BLOCK_SIZE]
+        self.md5 = self._md5()
+
+    def _md5(self) -> str:
+        h = hashlib.md5()
+        for chunk in self.read(0, self.size):
+            h.update(chunk)
+        return h.hexdigest()
+
+    def read(self, start:int, end:int, chunk_size:int=BLOCK_SIZE):
+        """Yield the bytes from start up to (Not including) end."""
+        pos = start
+        while pos < end:
+            offset = pos % BLOCK_SIZE
+            n = min(chunk_size, BLOCK_SIZE - offset, end - pos)
+            yield self.block[offset:offset+n]
+            pos += n
+
+
+class FakeArchive():
+    """Synthetic items plus the knobs that shape how they're served.
+    latency : float - seconds to wait before answering each request.
+    bandwidth : int - bytes/s cap for each download connection, 0 for no cap.
+    error_rate : float - chance (0-1) that a download fails, half as a 503 and half as a connection dropped mid-body.
+    retry_after : int - seconds to put in the Retry-After header of injected 503s, None for no header.
+    ranges : bool - honour Range requests; If False every download is a 200 with the whole file, like some mirrors."""
+    def __init__(self, latency:float=0.0, bandwidth:int=0, error_rate:float=0.0, retry_after:int=None, seed:int=0, ranges:bool=True):
+        self.items = {} # {identifier: (metadata, {name: SyntheticFile})}
+        self.latency = latency
+        self.ranges = ranges
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes_sent': 0, 'errors_injected': 0}
+
+    def add_item(self, identifier:str, files_count:int, file_size:int) -> None:
+        files = {}
+        for i in range(files_count):
+            name = 'file{0:05d}.bin'.format(i)
+            files[name] = SyntheticFile(identifier=identifier, name=name, size=file_size)
+        metadata = {
+            'metadata': {'identifier': identifier, 'mediatype': 'data', 'uploader': UPLOADER},
+            'files': [
+                {'name': f.name, 'source': 'original', 'size': str(f.size), 'md5': f.md5, 'format': 'Data'}
+                for f in files.values()
+            ],
+            'files_count': files_count,
+            'item_last_updated': int(time.time()),
+        }
+        self.items[identifier] = (metadata, files)
+
+    def roll_error(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def count(self, key:str, n:int=1) -> None:
+        with self.lock:
+            self.stats[key] += n
+
+
+class FakeArchiveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    archive = None # FakeArchive, set by make_server()
+
+    def log_message(self, format, *args):
+        logging.debug('fake_ia: ' + (format % args))
+
+    def _send_json(self, obj, status:int=200) -> None:
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_status(self, status:int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        archive = self.archive
+        archive.count('requests')
+        if archive.latency:
+            time.sleep(archive.latency)
+        url = urllib.parse.urlsplit(self.path)
+        parts = urllib.parse.unquote(url.path).strip('/').split('/')
+        if parts[0] == 'metadata' and len(parts) >= 2:
+            return self._metadata(parts)
+        if parts[0] == 'download' and len(parts) >= 3:
+            return self._download(parts[1], '/'.join(parts[2:]))
+        if parts[:2] == ['services', 'search']:
+            return self._search(urllib.parse.parse_qs(url.query))
+        self._send_status(404)
+    do_POST = do_GET # The scrape API is POSTed to by the internetarchive library.
+
+    def _metadata(self, parts:list) -> None:
+        """/metadata/<identifier>[/<field>] https://archive.org/developers/md-read.html"""
+        if parts[1] not in self.archive.items:
+            return self._send_json({})
+        metadata = self.archive.items[parts[1]][0]
+        if len(parts) > 2:
+            return self._send_json({'result': metadata.get(parts[2])})
+        return self._send_json(metadata)
+
+    def _download(self, identifier:str, name:str) -> None:
+        """/download/<identifier>/<name> with Range support."""
+        archive = self.archive
+        try:
+            synthetic = archive.items[identifier][1][name]
+        except KeyError:
+            return self._send_status(404)
+        inject = archive.roll_error()
+        if inject and archive.random.random() < 0.5:
+            archive.count('errors_injected')
+            self.send_response(503)
+            if archive.retry_after is not None:
+                self.send_header('Retry-After', str(archive.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, synthetic.size # end is exclusive
+        range_header = self.headers.get('Range')
+        if archive.ranges and range_header and range_header.startswith('bytes='):
+            first, _, last = range_header[len('bytes='):].partition('-')
+            start = int(first)
+            end = (int(last) + 1) if last else synthetic.size
+            if start >= synthetic.size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(synthetic.size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end - 1, synthetic.size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        drop_at = (start + (end - start) // 2) if inject else None
+        began = time.monotonic()
+        sent = 0
+        for chunk in synthetic.read(start, end):
+            if (drop_at is not None) and (start + sent + len(chunk) > drop_at):
+                archive.count('errors_injected')
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if archive.bandwidth:# Sleep off any lead over the bandwidth cap.
+                ahead = (sent / archive.bandwidth) - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+        archive.count('bytes_sent', sent)
+
+    def _search(self, query:dict) -> None:
+        """Scrape API with cursor pagination. https://archive.org/help/aboutsearch.htm"""
+        identifiers = sorted(self.archive.items)
+        cursor = int(query.get('cursor', ['0'])[0] or 0)
+        page = identifiers[cursor:cursor+SEARCH_PAGE_SIZE]
+        result = {'items': [{'identifier': i} for i in page], 'count': len(page), 'total': len(identifiers)}
+        if cursor + SEARCH_PAGE_SIZE < len(identifiers):
+            result['cursor'] = str(cursor + SEARCH_PAGE_SIZE)
+        self._send_json(result)
+
+
+def make_server(archive:FakeArchive, port:int=0) -> http.server.ThreadingHTTPServer:
+    """Create (But don't start) a threaded server for archive on localhost."""
+    handler = type('Handler', (FakeArchiveHandler,), {'archive': archive})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(archive:FakeArchive, port:int=0) -> http.server.ThreadingHTTPServer:
+    """Serve archive from a daemon thread."""
+    server = make_server(archive=archive, port=port)
+    thread = threading.Thread(target=server.serve_forever, name='fake-ia', daemon=True)
+    thread.start()
+    return server
+
+
+def command_line():
+    # Handle command line args
+    parser = argparse.ArgumentParser(description='Serve synthetic items. Point ia2rc at it with http_proxy=http://127.0.0.1:PORT')
+    parser.add_argument('--port', help='Port to listen on, 0 for any.',
+        type=int, default=0)
+    parser.add_argument('--items', help='Number of items.',
+        type=int, default=4)
+    parser.add_argument('--files', help='Files per item.',
+        type=int, default=10)
+    parser.add_argument('--file_size', help='Bytes per file.',
+        type=int, default=1024*1024)
+    parser.add_argument('--latency', help='Seconds to wait before answering each request.',
+        type=float, default=0.0)
+    parser.add_argument('--bandwidth', help='Bytes/s cap for each download connection, 0 for none.',
+        type=int, default=0)
+    parser.add_argument('--error_rate', help='Chance (0-1) that a download fails.',
+        type=float, default=0.0)
+    parser.add_argument('--retry_after', help='Retry-After seconds sent with injected 503s.',
+        type=int, default=None)
+    args = parser.parse_args()
+    archive = FakeArchive(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate, retry_after=args.retry_after)
+    for i in range(args.items):
+        archive.add_item(identifier='bench{0:05d}'.format(i), files_count=args.files, file_size=args.file_size)
+    server = make_server(archive=archive, port=args.port)
+    print('Serving on http://127.0.0.1:{0}'.format(server.server_address[1]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return
+
+
+def main():
+    command_line()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        run_bench
+# Purpose: End-to-end throughput benchmark of by_identifier / multi_by_identifier against local stand-ins for IA and rclone.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import sys
+import logging
+import argparse
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import resource
+import queue
+import multiprocessing
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import fake_ia
+
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+REMOTE_NAME = 'benchremote:bench'
+
+
+def _rss_bytes(ru_maxrss:int) -> int:
+    """ru_maxrss is KiB on Linux but bytes on macOS."""
+    if sys.platform == 'darwin':
+        return ru_maxrss
+    return ru_maxrss * 1024
+
+
+def run_scenario(conf:dict, results) -> None:
+    """Child process: Run the CLI under test against the stand-ins and report timings through the results queue.
+    Runs in its own process so peak RSS only covers ia2rc (And its own children), not the fake server."""
+    sys.path.insert(0, REPO_DIR)
+    os.environ['http_proxy'] = conf['proxy']
+    os.environ['PATH'] = os.path.join(BENCH_DIR, 'bin') + os.pathsep + os.environ.get('PATH', '')
+    os.environ['IA2RC_BENCH_REMOTE'] = conf['remote_root']
+    os.environ['IA2RC_BENCH_RCLONE_DELAY'] = str(conf['rclone_delay'])
+    os.environ['IA2RC_BENCH_RCLONE_CORRUPT'] = str(conf['rclone_corrupt'])
+    os.environ['no_proxy'] = '127.0.0.1,localhost'# rclone rcd is local.
+    multiprocessing.set_start_method(None, force=True)# Item workers should start the way they normally would, not inherit our spawn.
+    os.chdir(conf['workdir'])
+    logging.basicConfig(level=conf['log_level'])
+    import metacache
+    import metrics
+    import by_identifier
+    import multi_by_identifier
+    metacache.IA_CONFIG = {'general': {'secure': False}}# The fake server only speaks plain HTTP.
+    exit_status = 0
+    error = None
+    start = time.perf_counter()
+    try:
+        if conf['mode'] == 'multi':
+            list_path = os.path.join(conf['workdir'], 'bench_identifiers.txt')
+            with open(list_path, 'w') as f:
+                f.write('\n'.join(conf['identifiers']) + '\n')
+            sys.argv = ['multi_by_identifier.py', list_path, 'stage', REMOTE_NAME] + conf['extra_args']
+            exit_status = multi_by_identifier.command_line() or 0
+        else:
+            for identifier in conf['identifiers']:
+                sys.argv = ['by_identifier.py', identifier, 'stage', REMOTE_NAME] + conf['extra_args']
+                by_identifier.command_line()
+    except Exception as err:# Still report how far it got.
+        logging.exception(err)
+        exit_status = 1
+        error = repr(err)
+    elapsed = time.perf_counter() - start
+    results.put({
+        'elapsed_s': elapsed,
+        'exit_status': exit_status,
+        'error': error,
+        'peak_rss_bytes': _rss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+        'peak_rss_children_bytes': _rss_bytes(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+        'metrics': {name: value for name, labels, value in metrics.REGISTRY.samples() if not labels},
+    })
+    return
+
+
+def count_remote_files(remote_root:str) -> int:
+    n = 0
+    for dirpath, dirnames, filenames in os.walk(remote_root):
+        n += len(filenames)
+    return n
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf8').stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_bench(mode:str='item', items:int=1, files:int=20, file_size:int=1024*1024,
+    latency:float=0.0, bandwidth:int=0, error_rate:float=0.0, retry_after:int=None, rclone_delay:float=0.0, rclone_corrupt:float=0.0,
+    extra_args:list=None, label:str=None, keep:bool=False, log_level:int=logging.WARNING) -> dict:
+    """Run one benchmark and return its result record.
+    mode : str - 'item' runs by_identifier.py once per item, 'multi' runs multi_by_identifier.py over all of them.
+    extra_args : list - passed through to the CLI under test, e.g. ['--dl_workers', '4', '--dl_stream']"""
+    extra_args = list(extra_args or [])
+    archive = fake_ia.FakeArchive(latency=latency, bandwidth=bandwidth, error_rate=error_rate, retry_after=retry_after)
+    identifiers = ['bench{0:05d}'.format(i) for i in range(items)]
+    for identifier in identifiers:
+        archive.add_item(identifier=identifier, files_count=files, file_size=file_size)
+    server = fake_ia.start_server(archive)
+    workdir = tempfile.mkdtemp(prefix='ia2rc_bench.')
+    remote_root = os.path.join(workdir, 'remote')
+    conf = {
+        'mode': mode,
+        'identifiers': identifiers,
+        'extra_args': extra_args,
+        'proxy': 'http://127.0.0.1:{0}'.format(server.server_address[1]),
+        'workdir': workdir,
+        'remote_root': remote_root,
+        'rclone_delay': rclone_delay,
+        'rclone_corrupt': rclone_corrupt,
+        'log_level': log_level,
+    }
+    logging.info('Benchmark workdir={0!r}'.format(workdir))
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        child = ctx.Process(target=run_scenario, args=(conf, results), name='ia2rc-bench')
+        child.start()
+        outcome = None
+        while outcome is None:
+            try:
+                outcome = results.get(timeout=1)
+            except queue.Empty:
+                if not child.is_alive():
+                    raise RuntimeError('Benchmark process died with exitcode={0!r}'.format(child.exitcode))
+        child.join()
+        files_total = items * files
+        bytes_total = files_total * file_size
+        elapsed = outcome['elapsed_s']
+        seconds_per_file = elapsed / files_total if files_total else 0.0
+        transfer_s = (file_size / bandwidth) if bandwidth else 0.0
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'label': label,
+            'git_revision': git_revision(),
+            'params': {
+                'mode': mode, 'items': items, 'files': files, 'file_size': file_size,
+                'latency': latency, 'bandwidth': bandwidth, 'error_rate': error_rate, 'retry_after': retry_after,
+                'rclone_delay': rclone_delay, 'rclone_corrupt': rclone_corrupt, 'extra_args': extra_args,
+            },
+            'elapsed_s': elapsed,
+            'items_per_s': items / elapsed if elapsed else None,
+            'mb_per_s': (bytes_total / 1000000.0) / elapsed if elapsed else None,
+            'seconds_per_file': seconds_per_file,
+            'overhead_per_file_s': seconds_per_file - transfer_s,# Time per file beyond transferring it once at the bandwidth cap.
+            'peak_rss_bytes': outcome['peak_rss_bytes'],
+            'peak_rss_children_bytes': outcome['peak_rss_children_bytes'],
+            'exit_status': outcome['exit_status'],
+            'error': outcome['error'],
+            'remote_files': count_remote_files(remote_root),
+            'expected_files': files_total,
+            'server': dict(archive.stats),
+            'metrics': outcome['metrics'],
+        }
+    finally:
+        server.shutdown()
+        if keep:
+            logging.info('Kept workdir={0!r}'.format(workdir))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return record
+
+
+def command_line():
+    # Handle command line args
+    parser = argparse.ArgumentParser(
+        description='Benchmark ia2rc end to end against a local fake IA server and a stand-in rclone.',
+        epilog='Arguments after "--" go to the CLI under test, e.g. -- --dl_workers 4 --dl_stream')
+    parser.add_argument('--mode', help='"item" runs by_identifier.py once per item, "multi" runs multi_by_identifier.py over all items.',
+        choices=['item', 'multi'], default='item')
+    parser.add_argument('--items', help='Number of synthetic items.',
+        type=int, default=1)
+    parser.add_argument('--files', help='Files per item.',
+        type=int, default=20)
+    parser.add_argument('--file_size', help='Bytes per file.',
+        type=int, default=1024*1024)
+    parser.add_argument('--latency', help='Seconds the fake server waits before answering each request.',
+        type=float, default=0.0)
+    parser.add_argument('--bandwidth', help='Bytes/s cap for each download connection, 0 for none.',
+        type=int, default=0)
+    parser.add_argument('--error_rate', help='Chance (0-1) that a download fails with a 503 or a dropped connection.',
+        type=float, default=0.0)
+    parser.add_argument('--retry_after', help='Retry-After seconds the fake server sends with injected 503s.',
+        type=int, default=None)
+    parser.add_argument('--rclone_delay', help='Seconds the stand-in rclone takes per invocation / rc job.',
+        type=float, default=0.0)
+    parser.add_argument('--rclone_corrupt', help='Chance (0-1) that the stand-in rclone silently stores a file with a flipped byte, to exercise --rc_verify.',
+        type=float, default=0.0)
+    parser.add_argument('--label', help='Free text saved with the result, to tell runs apart.',
+        type=str, default=None)
+    parser.add_argument('--output', help='Append the result as one JSON line to this file.',
+        type=str, default=os.path.join('debug', 'bench_results.jsonl'))
+    parser.add_argument('--keep', help='Keep the temporary work dir.',
+        default=False, action='store_true')
+    parser.add_argument('--verbose', help='Show ia2rc INFO logging.',
+        default=False, action='store_true')
+    parser.add_argument('extra_args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    extra_args = args.extra_args[1:] if args.extra_args[:1] == ['--'] else args.extra_args
+    logging.basicConfig(level=(logging.INFO if args.verbose else logging.WARNING))
+    record = run_bench(
+        mode=args.mode,
+        items=args.items,
+        files=args.files,
+        file_size=args.file_size,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        rclone_delay=args.rclone_delay,
+        rclone_corrupt=args.rclone_corrupt,
+        extra_args=extra_args,
+        label=args.label,
+        keep=args.keep,
+        log_level=(logging.INFO if args.verbose else logging.WARNING),
+    )
+    line = json.dumps(record, sort_keys=True)
+    if args.output:
+        parent = os.path.dirname(args.output)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(args.output, 'a') as f:
+            f.write(line + '\n')
+    print(json.dumps(record, sort_keys=True, indent=2))
+    return 0 if (record['exit_status'] == 0 and record['remote_files'] == record['expected_files']) else 1
+
+
+def main():
+    return command_line()
+
+if __name__ == '__main__':
+    sys.exit(main())
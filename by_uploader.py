@@ -26,24 +26,18 @@ import psutil
 # Local
 import ia2rc
 import common # General-purpose functions.
+import metrics # Instrumentation.
 
 
 
-def byuploader(args):
+def byuploader(args) -> int:
     """Shim to turn turn CLI args class into function argument objects"""
-    ia2rc.dl_ia_uploader(
+    metrics.start(metrics_port=args.metrics_port, metrics_file=args.metrics_file, metrics_interval=args.metrics_interval)
+    return ia2rc.dl_ia_uploader(
         uploader=args.byuploader,
-        local_path=args.local_path,
-        rc_remote_path=args.rc_remote_path,
-        upload_every=args.upload_every,
         ia_item_glob_pattern=args.ia_item_glob_pattern,
-        ia_file_glob_pattern=args.ia_file_glob_pattern,
-        ia_dry_run=args.ia_dry_run,
-        rc_bwlimit=args.rc_bwlimit,
-        rc_logfile=args.rc_logfile,
-        rc_dry_run=args.rc_dry_run
+        **ia2rc.transfer_kwargs(args)
     )
-    return
 
 
 def command_line():
@@ -54,42 +48,32 @@ def command_line():
         type=str)
     parser.add_argument('local_path', help='path to store things temporarily. (Normal format) (Used by script & fed into rclone so dont be too clever.)',
         type=str)
-    parser.add_argument('rc_remote_path', help='path for rclone to push to. (Rclone format)',
-        type=str)
+    parser.add_argument('rc_remote_path', help='path for rclone to push to. (Rclone format) Give several to download once and send every file to each of them.',
+        type=str, nargs='+')
     # 'byuploader' command optional args
-    parser.upload_every('--upload_every', help='Upload after  every N files',
-        type=int, default=None)
-    parser.add_argument('--ia_item_glob_pattern', help='only download items with identifiers matching this glob pattern',
+    parser.add_argument('--ia_item_glob_pattern', help='only download items with identifiers matching this glob pattern. (Separate several patterns with |)',
         type=str, default=None)
     # Common optional args
-    parser.add_argument('--rc_bwlimit', help='Rclone bwlimit argument, if unset will not tell rclone any bwlimit.',
-        type=str, default=None)
-    parser.add_argument('--rc_logfile', help='Rclone logfile argument, if unset will not tell rclone to verbosely log to a file.',
-        type=str, default=None)
-    parser.add_argument('--ia_file_glob_pattern', help='only download files matching this glob pattern',
-        type=str, default=None)
-    parser.add_argument('--upload_every', help='Upload after  every N files',
-        type=int, default=None)
-    parser.add_argument('--rc_dry_run', help='Only simulate rclone actions.',
-        default=False, action='store_true')
-    parser.add_argument('--ia_dry_run', help='Only simulate InternetArchive actions.',
-        default=False, action='store_true')
+    ia2rc.add_transfer_args(parser)
     parser.set_defaults(func=byuploader)
+    common.add_logging_args(parser)# Consumed by setup_logging_from_argv()
     args = parser.parse_args()
     logging.debug('args={args!r}'.format(args=args))# Record CLI arguments
-    args.func(args)
+    exit_status = args.func(args)
     logging.info('Finished command-line invocation')
-    return
+    return exit_status
 
 
 def main():
-    command_line()
+    return command_line()
 
 if __name__ == '__main__':
-    logger = common.setup_logging(os.path.join("debug", "by_uploader.log.ts{ts}.txt"))# Setup logging
+    logger = common.setup_logging_from_argv(os.path.join("debug", "by_uploader.log.ts{ts}.txt"))# Setup logging, --log_mode etc.
+    exit_status = 1
     try:
-        main()
+        exit_status = main()
     except Exception as e:# Log unhandled exceptions.
         logging.critical("Unhandled exception!")
         logging.exception(e)
-    logging.info('Finshed. sys.argv={0}'.format(sys.argv))
\ No newline at end of file
+    logging.info('Finshed. sys.argv={0}'.format(sys.argv))
+    sys.exit(1 if exit_status else 0)
\ No newline at end of file
@@ -20,6 +20,10 @@ import logging.handlers
 import datetime
 import re
 import hashlib
+import threading
+import queue
+import atexit
+import multiprocessing.util
 ##import modulefinder
 # Py3-specific stdlib
 import http.cookiejar as cj
@@ -30,6 +34,8 @@ import requests
 import requests.exceptions
 import psutil
 # Local
+import metrics # Instrumentation.
+import retrycontrol # Shared per-host backoff.
 
 
 
@@ -37,6 +43,9 @@ import psutil
 CUSTOM_DELAY =1# config.delay_request# Use delay value from config file
 
 
+_appendlist_lock = threading.Lock()# Serialize appends from worker threads so lines do not interleave.
+
+
 
 
 # Constants
@@ -48,14 +57,47 @@ ONE_HUNDRED_MEGABYTES = 104857600# 100*2^23
 
 
 
+LOG_MODES = {# Presets for --log_mode
+    'debug': {'console_level': logging.DEBUG, 'file_level': logging.DEBUG, 'use_queue': False, 'hold_filename_time': 5},# Everything, everywhere, written inline.
+    'production': {'console_level': logging.INFO, 'file_level': logging.INFO, 'use_queue': True, 'hold_filename_time': 0},# Less noise, writing off the worker threads.
+}
+
+
+_log_listener = None # QueueListener when setup_logging(use_queue=True), one per process.
+
+
+def _start_log_listener(queue_handler, handlers):
+    """Give queue_handler a fresh queue and a QueueListener writing its records to handlers."""
+    global _log_listener
+    queue_handler.queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
+
+
+def _stop_log_listener():
+    """Write out anything still queued."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+    return
+
+
 def setup_logging(
     log_filepath_template='log.{ts}.txt',
     maxBytes=TEN_MEGABYTES, backupCount=10000,
-    hold_filename_time=5, ):
+    hold_filename_time=5, console_level=logging.DEBUG,
+    file_level=logging.DEBUG, use_queue=False, ):
     """Setup logging (Before running any other code)
     http://inventwithpython.com/blog/2012/04/06/stop-using-print-for-debugging-a-5-minute-quickstart-guide-to-pythons-logging-module/
     filename format:
         'myscript.log.{ts}.txt
+    console_level, file_level : int - minimum level for each output.
+    use_queue : bool - hand records to a background thread to format and write,
+        so threads doing the actual work never wait on the console or disk.
+        https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+    hold_filename_time : int - seconds to pause after starting, to copy down the log filename.
     """
     global logger# Persist logger even if we leave current scope
     started_time = datetime.datetime.utcnow()
@@ -68,13 +110,12 @@ def setup_logging(
     ensure_parent_dir_exists(filepath=log_file_path)
     # Instantiate global logger
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(min(console_level, file_level))# Drop records nobody wants before any formatting happens.
     formatter = logging.Formatter("%(asctime)s - %(levelname)s - f.%(filename)s - ln.%(lineno)d - %(message)s")
     # Console output
     ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
+    ch.setLevel(console_level)
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
     # File 1, log everything
     # https://docs.python.org/2/library/logging.handlers.html
     # Rollover occurs whenever the current log file is nearly maxBytes in length; if either of maxBytes or backupCount is zero, rollover never occurs.
@@ -85,17 +126,62 @@ def setup_logging(
         maxBytes=maxBytes,# Above about 10MiB many text editors start to choke.
         backupCount=backupCount,
         )
-    fh.setLevel(logging.DEBUG)
+    fh.setLevel(file_level)
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    if use_queue:
+        qh = logging.handlers.QueueHandler(queue.SimpleQueue())
+        logger.addHandler(qh)
+        _start_log_listener(queue_handler=qh, handlers=(ch, fh))
+        atexit.register(_stop_log_listener)
+        def restart_in_child():# The listener thread does not survive a fork.
+            _start_log_listener(queue_handler=qh, handlers=(ch, fh))
+            multiprocessing.util.Finalize(None, _stop_log_listener, exitpriority=10)# Process pool workers skip atexit handlers.
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=restart_in_child)
+    else:
+        logger.addHandler(ch)
+        logger.addHandler(fh)
     # Place info into start of logfile
-    logging.debug('log_file_path={0}'.format(log_file_path))
-    logging.info('sys.argv={0}'.format(sys.argv))
+    logging.debug('log_file_path=%s', log_file_path)
+    logging.info('sys.argv=%s', sys.argv)
     if hold_filename_time:
         time.sleep(hold_filename_time)# Make sure we can copy down the filename
     return logger
 
 
+def _log_level(value):
+    """argparse type for log levels: 'INFO', 'info' or 20"""
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise argparse.ArgumentTypeError('Unknown log level {0!r}'.format(value))
+    return level
+
+
+def add_logging_args(parser):
+    """Add the logging options every CLI accepts. They are read by setup_logging_from_argv() before the rest of the args."""
+    parser.add_argument('--log_mode', help='"debug": everything to console and file, 5s pause to note the log filename. "production": INFO and up, written by a background thread, no pause.',
+        choices=sorted(LOG_MODES), default='debug')
+    parser.add_argument('--log_console_level', help='Override the console log level of --log_mode, e.g. WARNING',
+        type=_log_level, default=None)
+    parser.add_argument('--log_file_level', help='Override the logfile log level of --log_mode, e.g. DEBUG',
+        type=_log_level, default=None)
+    return parser
+
+
+def setup_logging_from_argv(log_filepath_template, argv=None):
+    """setup_logging() with the options from add_logging_args() found in argv (Default sys.argv), ignoring all other args."""
+    parser = add_logging_args(argparse.ArgumentParser(add_help=False))
+    args, unknown = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    options = dict(LOG_MODES[args.log_mode])
+    if args.log_console_level is not None:
+        options['console_level'] = args.log_console_level
+    if args.log_file_level is not None:
+        options['file_level'] = args.log_file_level
+    return setup_logging(log_filepath_template, **options)
+
+
 
 class FetchGot404(Exception):
     def __init__(self, url, response):
@@ -113,12 +199,14 @@ def fetch(requests_session, url, method='get', data=None, expect_status=200, hea
         elif 'user-agent' not in headers.keys():
             headers['user-agent'] = user_agent
 
+    controller = retrycontrol.get_controller(url)
     for try_num in range(20): # Retry on failure.
-        logging.debug('Fetch {0!r}'.format(url))
-        if try_num > 1:
-            backoff_time = 20*try_num
-            logging.debug('Backing off for backoff_time={0!r}'.format(backoff_time))
+        logging.debug('Fetch %r', url)
+        if try_num > 0:
+            backoff_time = controller.backoff_delay(try_num)
+            logging.debug('Backing off for backoff_time=%r', backoff_time)
             time.sleep(backoff_time)
+        controller.wait()# Host-wide pause if the server asked us to slow down or is down.
         try: # Try to fetch the URL.
             if method == 'get':
                 response = requests_session.get(url, headers=headers, timeout=300)
@@ -130,28 +218,34 @@ def fetch(requests_session, url, method='get', data=None, expect_status=200, hea
                 file_path=os.path.join('debug', 'common.fetch.last_response.html'),# Saved in this location to avoid IO operations colliding
                 data=response.content
             )
-            logging.debug('response.headers={0!r}'.format(response.headers))# Response headers
-            logging.debug('response.request.headers={0!r}'.format(response.request.headers))# Outgoing (request) headers
+            logging.debug('response.headers=%r', response.headers)# Response headers
+            logging.debug('response.request.headers=%r', response.request.headers)# Outgoing (request) headers
         # requests exception catching
         except requests.exceptions.Timeout as err:
             logging.exception(err)
+            controller.report_error(err)
             logging.error('Caught requests.exceptions.Timeout')
             continue
         except requests.exceptions.ConnectionError as err:
             logging.exception(err)
+            controller.report_error(err)
             logging.error('Caught requests.exceptions.ConnectionError')
             continue
         except requests.exceptions.ChunkedEncodingError as err:
             logging.exception(err)
+            controller.report_error(err)
             logging.error('requests.exceptions.ChunkedEncodingError')
             continue
         # /requests exception catching
         # Allow certain error codes to be passed back out
+        if controller.report_response(response):# 429/5xx, honouring any Retry-After.
+            logging.error('Server error or throttling, status_code=%r', response.status_code)
+            continue
         if response.status_code == 404:# 404 not found
-            logging.error("fetch() 404 for url={0}".format(url))
+            logging.error('fetch() 404 for url=%s', url)
             raise FetchGot404(url=url, response=response)
         if response.status_code != expect_status:
-            logging.error('Problem detected. Status code mismatch. Sleeping. expect_status={es}; response.status_code={rsc}'.format(es=expect_status, rsc=response.status_code))
+            logging.error('Problem detected. Status code mismatch. Sleeping. expect_status=%s; response.status_code=%s', expect_status, response.status_code)
             write_file(# Save for debug
                 file_path=os.path.join('debug', 'common.fetch.last_status_code_mismatch.html'),# Saved in this location to avoid IO operations colliding
                 data=response.content
@@ -160,7 +254,7 @@ def fetch(requests_session, url, method='get', data=None, expect_status=200, hea
         if (minimum_resp_size):# Option for response size threshold
             response_size = len(response.content)
             if  (response_size< minimum_resp_size):
-                logging.error('Recieved data was too small! response_size={0}'.format(response_size))
+                logging.error('Recieved data was too small! response_size=%s', response_size)
                 continue
         if CUSTOM_DELAY:
             time.sleep(CUSTOM_DELAY)
@@ -168,7 +262,7 @@ def fetch(requests_session, url, method='get', data=None, expect_status=200, hea
             time.sleep(random.uniform(0.5, 1.5))
         return response
     # If we can't get thing
-    logging.error("fetch() giving up for url={0}".format(url))
+    logging.error('fetch() giving up for url=%s', url)
     raise Exception('Giving up!')
 
 
@@ -182,14 +276,14 @@ def setup_requests_session(cookie_path=None, import_cookies=False):
     ensure_parent_dir_exists(filepath=cookie_path)
     requests_session.cookies = cj.MozillaCookieJar(cookie_path)# Prepare cookiejar for later use
     if (import_cookies):
-        logging.debug('Loading cookies from cookie_path={0!r}'.format(cookie_path))
+        logging.debug('Loading cookies from cookie_path=%r', cookie_path)
         requests_session.cookies.load()
     return requests_session
 
 
 def save_requests_cookies(requests_session, cookie_path):
     """Record the current cookies of the session to file"""
-    logging.debug('Saving cookies to {0}'.format(cookie_path))
+    logging.debug('Saving cookies to %s', cookie_path)
     ensure_parent_dir_exists(filepath=cookie_path)
     requests_session.cookies.save()
     logging.debug('Cookies saved.')
@@ -226,15 +320,16 @@ def appendlist(lines, list_file_path, initial_text="# List of items.\n"):
     # Make sure we're saving a list of strings.
     if ( type(lines) is type("") ):# Convert str to list
         lines = [lines]
-    # Ensure file exists.
-    ensure_parent_dir_exists(filepath=list_file_path)
-    if not os.path.exists(list_file_path):
-        with open(list_file_path, "w") as nf:# Initialize with header
-            nf.write(initial_text)
-    # Write data to file.
-    with open(list_file_path, "a") as f:
-        for line in lines:
-            f.write('{0}\n'.format(line))
+    with _appendlist_lock:
+        # Ensure file exists.
+        ensure_parent_dir_exists(filepath=list_file_path)
+        if not os.path.exists(list_file_path):
+            with open(list_file_path, "w") as nf:# Initialize with header
+                nf.write(initial_text)
+        # Write data to file.
+        with open(list_file_path, "a") as f:
+            for line in lines:
+                f.write('{0}\n'.format(line))
     return
 
 
@@ -320,12 +415,12 @@ def md5(tohash):
 
 
 def range_iterator(f, low_num, high_num, *args, **kwargs):# UNTESTED
-    logging.debug('range_iterator().args={0!r}'.format(locals()))# Super-debug.
-    logging.info('Iterating over range from {0} through {1} (inclusive)'.format(low_num, high_num))
+    logging.debug('range_iterator().args=%r', locals())# Super-debug.
+    logging.info('Iterating over range from %s through %s (inclusive)', low_num, high_num)
     for num in range(low_num, high_num+1):# low_num -> high_num inclusive
-        logging.debug('Now doing {n} from range {l} -> {h}'.format(n=num, l=low_num, h=high_num))
+        logging.debug('Now doing %s from range %s -> %s', num, low_num, high_num)
         f(num, *args, **kwargs)
-    logging.info('Done iterating over range from {0} through {1} (inclusive)'.format(low_num, high_num))
+    logging.info('Done iterating over range from %s through %s (inclusive)', low_num, high_num)
 
 
 
@@ -403,7 +498,7 @@ def read_listfile(filepath, silent=False):
     If no file exists, return None.
     return a list of strings in order, where each sting is one line's text.
     """
-    logging.debug('Reading filepath={0} into a list'.format(filepath))
+    logging.debug('Reading filepath=%s into a list', filepath)
     if not os.path.exists(filepath):
         logging.debug('File does not exist, returning None')
         return None
@@ -416,7 +511,7 @@ def read_listfile(filepath, silent=False):
             if raw_line[0] in ['#', '\n', '\r']:# Skip empty lines and comments
                 continue
             if not silent:
-                logging.debug('line_counter={0!r}, raw_line={1!r}'.format(line_counter, raw_line))
+                logging.debug('line_counter=%r, raw_line=%r', line_counter, raw_line)
             cleaned_line = raw_line.strip()
             entries.append(cleaned_line)
     return entries
@@ -427,7 +522,7 @@ def read_listfile_unique(filepath):
     and ignoring comments, and lines without text.
     If no file exists, return None.
     return a list of strings where each sting is one unique line's text. """
-    logging.debug('Reading filepath={0} into a uniquified list'.format(filepath))
+    logging.debug('Reading filepath=%s into a uniquified list', filepath)
     lines = read_listfile(filepath)
     unique_lines = uniquify(lines)
     return unique_lines
@@ -438,7 +533,7 @@ def read_listfile_to_dict(filepath, silent=False):
     and ignoring comments, and lines without text.
     If no file exists, return None.
     return a dict with stripped line as the key and occurances as the value."""
-    logging.debug('Reading filepath={0} into a dict'.format(filepath))
+    logging.debug('Reading filepath=%s into a dict', filepath)
     if not os.path.exists(filepath):
         logging.debug('File does not exist, returning None')
         return None
@@ -451,7 +546,7 @@ def read_listfile_to_dict(filepath, silent=False):
             if raw_line[0] in ['#', '\n', '\r']:# Skip empty lines and comments
                 continue
             if not silent:
-                logging.debug('line_counter={0!r}, raw_line={1!r}'.format(line_counter, raw_line))
+                logging.debug('line_counter=%r, raw_line=%r', line_counter, raw_line)
             name = raw_line.strip()
             try:
                 itemsdict[name] += 1
@@ -460,19 +555,55 @@ def read_listfile_to_dict(filepath, silent=False):
     return itemsdict
 
 
-def check_disk_free(bytes_req, local_path):
-    """Raise an exception if there is not enough disk space"""
-    # https://stackoverflow.com/questions/51658/cross-platform-space-remaining-on-volume-using-python
-    # psutil.disk_usage(".").free
-    bytes_free = psutil.disk_usage(local_path).free
-    logging.debug('bytes_req={r!r}, bytes_free={f!r}'.format(r=bytes_req, f=bytes_free))
-    if ( int(bytes_free) < int(bytes_req) ): # If not enough space make a fuss.
-        logging.critical('Insufficient disk space remaining! bytes_req={r!r}, bytes_free={f!r}'.format(
-            r=bytes_req, f=bytes_free))
-        raise IOError('Insufficient disk space remaining! bytes_req={r!r}, bytes_free={f!r}'.format(
-            r=bytes_req, f=bytes_free) )
-    return # If Nothing is wrong.
-
+class DiskBudget():
+    """Reserve disk space before writing and release it once the data has left the disk again.
+    Unlike a point-in-time free space check this accounts for everything that has been promised but not written yet,
+    so it stays correct with several downloads in flight at once.
+    reserve() blocks (Or returns False on timeout) while the budget is used up, instead of raising.
+    local_path : str - the budget defaults to free space on the disk holding this path, less headroom.
+    budget_bytes : int - explicit budget in bytes.
+    """
+    def __init__(self, local_path, budget_bytes=None, headroom=ONE_HUNDRED_MEGABYTES):
+        if budget_bytes is None:
+            bytes_free = psutil.disk_usage(local_path).free
+            metrics.inc('ia2rc_disk_checks_total')
+            metrics.set_gauge('ia2rc_disk_free_bytes', bytes_free)
+            budget_bytes = bytes_free - headroom
+        self.capacity = int(budget_bytes)
+        self.reserved = 0
+        self.reservations = {} # {key: bytes}
+        self.cond = threading.Condition()
+        logging.debug('DiskBudget for local_path=%r capacity=%r', local_path, self.capacity)
+
+    def reserve(self, key, nbytes, timeout=None):
+        """Reserve nbytes under key, waiting up to timeout seconds (None for forever) for space to be released.
+        return True if reserved, False if timed out.
+        Raise IOError if nbytes could never fit."""
+        nbytes = int(nbytes)
+        if nbytes > self.capacity:
+            logging.critical('Insufficient disk space for a single file! bytes_req=%r, capacity=%r', nbytes, self.capacity)
+            raise IOError('Insufficient disk space for a single file! bytes_req={r!r}, capacity={c!r}'.format(
+                r=nbytes, c=self.capacity))
+        with self.cond:
+            start = time.monotonic()
+            fits = self.cond.wait_for(lambda: (self.reserved + nbytes) <= self.capacity, timeout=timeout)
+            metrics.observe('ia2rc_disk_wait_seconds', time.monotonic() - start)
+            if not fits:
+                metrics.inc('ia2rc_disk_check_failures_total')
+                return False
+            self.reserved += nbytes
+            self.reservations[key] = self.reservations.get(key, 0) + nbytes
+            metrics.add_gauge('ia2rc_disk_reserved_bytes', nbytes)
+            return True
+
+    def release(self, key):
+        """Give back whatever is reserved under key. Unknown keys are ignored."""
+        with self.cond:
+            nbytes = self.reservations.pop(key, 0)
+            self.reserved -= nbytes
+            metrics.add_gauge('ia2rc_disk_reserved_bytes', -nbytes)
+            self.cond.notify_all()
+        return
 
 
 def get_file_md5(filepath):
@@ -18,8 +18,12 @@ import re
 import argparse
 import time
 import glob
-import subprocess
+import fnmatch
+import contextlib
 # Py3-specific stdlib
+import concurrent.futures
+import queue
+import threading
 # Py2-specific stdlib
 # Remote libraries
 import internetarchive # https://github.com/jjjake/internetarchive
@@ -27,23 +31,49 @@ import psutil
 import requests
 # Local
 import common # General-purpose functions.
+import ia_stream # Streaming downloader.
+import statestore # Resume state.
+import rclone_rc # Long-lived rclone rcd backend.
+import metacache # Item metadata cache.
+import metrics # Instrumentation.
+import rclone_cli # rclone commands with their output parsed.
+import retrycontrol # Shared per-host backoff.
+import ratelimit # Download bandwidth limit.
 
 
 
+PARTIAL_DIRNAME = '.ia2rc_partial' # Subdir of local_path holding in-progress downloads while pipelining.
+VERIFY_PASSES = 2 # Times files failing remote verification are transferred again before giving up on the item.
+RCLONE_DIR_NOT_FOUND = 3 # rclone exit code for a missing directory. https://rclone.org/docs/#exit-code
+RCLONE_RC_DIR_NOT_FOUND = 'directory not found' # rclone rc error text for a missing directory.
 
-def rclone_list_children(rc_remote_path:str, rc_max_depth:int, rc_logfile:str=None) -> list:
+
+
+
+def rclone_list_children(rc_remote_path:str, rc_max_depth:int, rc_logfile:str=None, rc_rcd:bool=False, rc_url:str=None) -> list:
     """
     List the children of some location through rclone.
     rc_remote_path : str - rclone-style path of rclone a remote dir.
     rc_max_depth : str - rclone --max-depth numeric value.
     rc_logfile : str - rclone --log-file=foo path value.
+    rc_rcd : bool - go through the shared rclone rcd instead of running rclone lsjson.
+    rc_url : str - URL of an already-running rclone rc server to use. (Implies rc_rcd)
     return a list of remote filepaths ['file1.ext', 'subdir/anotherfile.ext', 'otherdir/otherfile2.ext', 'file_no_ext',...]
     Empty dir is to be represented by an empty list.
     Return None if no data can be obtained.
     To convert output to rclone paths, prepend each child with the rclone remote path i guess.
     """
-    logging.debug('rclone_upload() args={0!r}'.format(locals()))# SUPER DEBUG
-    logging.info('Getting info about contents of rclone remote {0!r}'.format(rc_remote_path))
+    logging.debug('rclone_upload() args=%r', locals())# SUPER DEBUG
+    logging.info('Getting info about contents of rclone remote %r', rc_remote_path)
+    if rc_rcd or rc_url:
+        try:
+            ls_data = rclone_rc.get_daemon(rc_url=rc_url, rc_logfile=rc_logfile).list(rc_remote_path=rc_remote_path, rc_max_depth=rc_max_depth)
+        except rclone_rc.RcloneRCError as err:
+            logging.exception(err)
+            return None # Could not get data.
+        children = [res['Path'] for res in ls_data]
+        logging.info('Found %s child paths of remote path %s', len(children), rc_remote_path)
+        return children
     # command - prepare args
     # https://rclone.org/commands/rclone_ls/
     cmd = [
@@ -51,79 +81,554 @@ def rclone_list_children(rc_remote_path:str, rc_max_depth:int, rc_logfile:str=No
         '-R',
         "--max-depth", '{0}'.format(rc_max_depth)
     ]
-    if rc_logfile:# Verbose debugging info. https://rclone.org/docs/#log-level-level
-        cmd.append('--log-file={0}'.format(rc_logfile))
-        cmd.append('--log-level')
-        cmd.append('DEBUG')
-    logging.debug('cmd={0!r}'.format(cmd))
     # command - execute
-    common.ensure_dir_exists(dir_path=os.path.join('debug'))# Protect against missing dir for stdout/stderr temp files.
-    stdout_path = os.path.join('debug', 'ia2rc.rclone_list_children.stdout.txt')
-    stderr_path = os.path.join('debug', 'ia2rc.rclone_list_children.stderr.txt')
-    with open(stdout_path, 'w') as f_stdout: # File objects required to capture stdout and stderr.
-        with open(stderr_path, 'w') as f_stderr:
-            cmd_res = subprocess.run(
-                args=cmd, encoding='utf8',
-                stdout=f_stdout, stderr=f_stderr,
-            )
-    # command - capture and tolerate result
-    logging.debug('cmd_res={0!r}'.format(cmd_res))
-    if (cmd_res.returncode != 0): # Handle rclone errors.
-        logging.error('Bad return code from rclone, check rc_logfile: {0}'.format(rc_logfile))
-        logging.debug('cmd_res.returncode={0!r}'.format(cmd_res.returncode))
+    try:
+        stdout = rclone_cli.run(cmd=cmd, rc_logfile=rc_logfile)
+    except rclone_cli.RcloneError as err: # Handle rclone errors.
+        logging.error('rclone could not list %r: %s', rc_remote_path, err)
         return None # Could not get data.
     # command - interpret result
-    with open(stdout_path, 'r') as res_f:# Read back from temp file
-        ls_data = json.load(res_f)
-    logging.debug('ls_data={0!r}'.format(ls_data)) # rclone json output for empty dir = []
+    ls_data = json.loads(stdout or '[]')
+    logging.debug('ls_data=%r', ls_data) # rclone json output for empty dir = []
     children = []
     for res in ls_data:
         children.append(res['Path'])# e.g. 'Path': 'TheAdventuresOfTomSawyer_201303/TheAdventuresOfTomSawyer_201303_meta.xml',
-    logging.info('Found {c} child paths of remote path {p}'.format(c=len(children), p=rc_remote_path))
-    logging.debug('children={0!r}'.format(children))
+    logging.info('Found %s child paths of remote path %s', len(children), rc_remote_path)
+    logging.debug('children=%r', children)
     return children
 
 
 
-def rclone_upload(local_path:str, rc_remote_path:str, rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False) -> None:
-    """Use rclone to move something.
-    https://rclone.org/docs/ """
-    logging.debug('rclone_upload() args={0!r}'.format(locals()))# SUPER DEBUG
-    logging.info('Using rclone to move local_path={l!r} to rc_remote_path={r!r}'.format(
-        l=local_path, r=rc_remote_path))
-    # command - prepare args
-    # https://rclone.org/commands/rclone_move/
-    cmd = [ 'rclone', 'move', local_path, rc_remote_path, ]
+class RemoteVerifyFailed(Exception):
+    """Signals that remote copies still did not match InternetArchive's metadata after being transferred again"""
+
+
+def rclone_list_hashes(rc_remote_path:str, rc_logfile:str=None, rc_rcd:bool=False, rc_url:str=None) -> dict:
+    """List every file under a remote dir with its size and md5, in one call.
+    Remotes that can't provide md5s (e.g. some crypt setups) give None for md5.
+    return {path: {'size': int, 'md5': str}} with paths relative to rc_remote_path, or None if no data can be obtained.
+    https://rclone.org/commands/rclone_lsjson/"""
+    logging.info('Getting hashes of files in rclone remote %r', rc_remote_path)
+    controller = rclone_controller(rc_remote_path)
+    controller.wait()
+    if rc_rcd or rc_url:
+        try:
+            ls_data = rclone_rc.get_daemon(rc_url=rc_url, rc_logfile=rc_logfile).list(rc_remote_path=rc_remote_path, show_hash=True)
+        except rclone_rc.RcloneRCError as err:
+            if RCLONE_RC_DIR_NOT_FOUND in str(err).lower():# Nothing uploaded there yet.
+                logging.debug('Remote dir %r does not exist yet', rc_remote_path)
+                controller.success()
+                return {}
+            logging.exception(err)
+            controller.report_message(str(err))
+            return None # Could not get data.
+    else:
+        cmd = ['rclone', 'lsjson', rc_remote_path, '-R', '--files-only', '--hash', '--hash-type', 'md5']
+        try:
+            ls_data = json.loads(rclone_cli.run(cmd=cmd, rc_logfile=rc_logfile) or '[]')
+        except rclone_cli.RcloneError as err:
+            if err.returncode == RCLONE_DIR_NOT_FOUND:# Nothing uploaded there yet.
+                logging.debug('Remote dir %r does not exist yet', rc_remote_path)
+                controller.success()
+                return {}
+            logging.error('rclone could not list %r: %s', rc_remote_path, err)
+            controller.report_message(str(err))
+            return None # Could not get data.
+    controller.success()
+    entries = {}
+    for res in ls_data:
+        if res.get('IsDir'):
+            continue
+        entries[res['Path']] = {'size': res.get('Size'), 'md5': (res.get('Hashes') or {}).get('md5')}
+    logging.debug('Found %s files with hashes under %r', len(entries), rc_remote_path)
+    return entries
+
+
+def verify_remote(files:list, remote_entries:dict) -> list:
+    """Check remote copies against the size and md5 InternetArchive has for each file.
+    files : list of IA.File() instances that should be on the remote.
+    remote_entries : dict - from rclone_list_hashes()
+    return [(file, reason), ...] for every file that is missing or doesn't match."""
+    bad = []
+    no_md5 = 0
+    for file in files:
+        entry = remote_entries.get(file.name)
+        if entry is None:
+            bad.append((file, 'missing'))
+            continue
+        if file.size and (entry['size'] is not None) and (entry['size'] >= 0) and (int(entry['size']) != int(file.size)):
+            bad.append((file, 'size {0} != {1}'.format(entry['size'], file.size)))
+            continue
+        want_md5 = ia_stream.expected_md5(file)
+        if want_md5 and not entry['md5']:
+            no_md5 += 1
+        elif want_md5 and (entry['md5'].lower() != want_md5.lower()):
+            bad.append((file, 'md5 {0} != {1}'.format(entry['md5'], want_md5)))
+    if no_md5:
+        logging.warning('Remote gave no md5 for %s files, only their sizes were checked', no_md5)
+    metrics.inc('ia2rc_verify_files_total', len(files))
+    return bad
+
+
+def reconcile_remote(files:list, remote_entries:dict) -> list:
+    """Find files whose remote copy already matches the name, size and md5 InternetArchive has for it.
+    Unlike verify_remote() the md5 must be there to compare; A remote copy that only matches by size is not trusted.
+    remote_entries : dict - from rclone_list_hashes()
+    return list of IA.File() instances that need not be downloaded."""
+    present = []
+    for file in files:
+        entry = remote_entries.get(file.name)
+        if entry is None:
+            continue
+        if file.size and (entry['size'] is not None) and (int(entry['size']) != int(file.size)):
+            continue
+        want_md5 = ia_stream.expected_md5(file)
+        if want_md5 and entry['md5'] and (entry['md5'].lower() == want_md5.lower()):
+            present.append(file)
+    return present
+
+
+def _reconcile_item(files:list, identifier:str, rc_remote_item_path:str, skip:dict,
+    rc_logfile:str=None, rc_rcd:bool=False, rc_url:str=None) -> list:
+    """Check the remote before downloading an item, so files already there are not fetched again
+    even if the state store has never heard of them (e.g. on a new host).
+    Lists the remote item dir with md5s once.
+    skip : dict - names of files not to look for.
+    return list of IA.File() instances found on the remote."""
+    candidates = [file for file in files if file.name not in skip]
+    if not candidates:
+        return []
+    remote_entries = rclone_list_hashes(rc_remote_path=rc_remote_item_path, rc_logfile=rc_logfile, rc_rcd=rc_rcd, rc_url=rc_url)
+    if remote_entries is None:
+        logging.warning('Could not list %r, downloading every file of identifier=%r', rc_remote_item_path, identifier)
+        return []
+    present = reconcile_remote(files=candidates, remote_entries=remote_entries)
+    for file in present:
+        metrics.inc('ia2rc_reconcile_bytes_total', int(file.size) if file.size else 0)
+    metrics.inc('ia2rc_reconcile_files_total', len(present))
+    logging.info('Found %s of %s files of identifier=%r already in %r', len(present), len(candidates), identifier, rc_remote_item_path)
+    return present
+
+
+def remote_name(rc_path:str) -> str:
+    """'gdrive:foo/bar' -> 'gdrive'; Local paths give ''."""
+    if (':' in rc_path) and not os.path.isabs(rc_path) and not (len(rc_path) > 1 and rc_path[1] == ':'):# Not a drive letter.
+        return rc_path.split(':', 1)[0]
+    return ''
+
+
+def rclone_controller(rc_path:str) -> retrycontrol.HostController:
+    """Backoff and circuit breaker shared by every rclone call to the remote rc_path is on, as retrycontrol does per IA host."""
+    return retrycontrol.get_controller('rclone:{0}'.format(remote_name(rc_path) or 'local'))
+
+
+@contextlib.contextmanager
+def rclone_guarded(rc_path:str):
+    """Wait until rc_path's remote may be used before running rclone against it, and report how it went.
+    While the remote keeps failing (Or complaining about rate limits) every worker using it pauses, instead of each failing on its own."""
+    controller = rclone_controller(rc_path)
+    controller.wait()
+    try:
+        yield controller
+    except (rclone_cli.RcloneError, rclone_rc.RcloneRCError) as err:
+        controller.report_message(str(err))
+        raise
+    controller.success()
+
+
+def rclone_server_copy(rc_src_path:str, rc_dst_path:str, rc_logfile:str=None, rc_dry_run:bool=False,
+    rc_rcd:bool=False, rc_url:str=None) -> bool:
+    """Copy one file within a remote, which the remote does server-side without the data passing through us.
+    return True if rclone succeeded.
+    https://rclone.org/commands/rclone_copyto/"""
+    logging.info('Copying %r to %r', rc_src_path, rc_dst_path)
+    try:
+        with rclone_guarded(rc_dst_path):
+            if rc_rcd or rc_url:
+                rclone_rc.get_daemon(rc_url=rc_url, rc_logfile=rc_logfile).copy_file(
+                    rc_src_path=rc_src_path, rc_dst_path=rc_dst_path, rc_dry_run=rc_dry_run)
+            else:
+                cmd = ['rclone', 'copyto', rc_src_path, rc_dst_path] + _rclone_common_args(rc_dry_run=rc_dry_run)
+                rclone_cli.run(cmd=cmd, rc_logfile=rc_logfile)
+    except (rclone_cli.RcloneError, rclone_rc.RcloneRCError) as err:
+        logging.warning('Could not copy %r to %r: %s', rc_src_path, rc_dst_path, err)
+        return False
+    return True
+
+
+def _dedupe_item(files:list, identifier:str, rc_remote_item_path:str, store:statestore.StateStore, skip:dict,
+    rc_logfile:str=None, rc_rcd:bool=False, rc_url:str=None) -> list:
+    """Place files whose md5 is already somewhere on the same remote with a server-side copy instead of downloading them.
+    Copies are found in the state store's content index (See _index_item()); One that has gone is forgotten and the file downloaded as usual.
+    skip : dict - names of files not to place.
+    return list of IA.File() instances placed."""
+    placed = []
+    for file in files:
+        want_md5 = ia_stream.expected_md5(file)
+        if (file.name in skip) or not want_md5:
+            continue
+        copy = store.find_content(want_md5)
+        rc_dst_path = '{0}/{1}'.format(rc_remote_item_path.rstrip('/'), file.name)
+        if (copy is None) or (copy['rc_path'] == rc_dst_path):
+            continue
+        if remote_name(copy['rc_path']) != remote_name(rc_dst_path):# Would go through us anyway.
+            continue
+        size = int(file.size) if file.size else None
+        if (size is not None) and (copy['size'] is not None) and (copy['size'] != size):
+            continue
+        if not rclone_server_copy(rc_src_path=copy['rc_path'], rc_dst_path=rc_dst_path, rc_logfile=rc_logfile, rc_rcd=rc_rcd, rc_url=rc_url):
+            store.forget_content(md5=want_md5, rc_path=copy['rc_path'])
+            continue
+        metrics.inc('ia2rc_dedupe_files_total')
+        metrics.inc('ia2rc_dedupe_bytes_saved_total', size or 0)
+        placed.append(file)
+    store.commit()
+    if placed:
+        logging.info('Placed %s files of identifier=%r in %r by copying identical files already there', len(placed), identifier, rc_remote_item_path)
+    return placed
+
+
+def _mark_transferred(files:list, identifier:str, store:statestore.StateStore, to_skip:dict) -> None:
+    """Record files as done without downloading them, and add them to to_skip."""
+    for file in files:
+        size = int(file.size) if file.size else None
+        store.set_file(identifier=identifier, name=file.name, status=statestore.FILE_DOWNLOADED, size=size, md5=file.md5)
+        to_skip[file.name] = {'status': statestore.FILE_DOWNLOADED, 'size': size, 'md5': file.md5, 'updated': None}
+    store.commit()
+    return
+
+
+def _find_on_remotes(files:list, identifier:str, rc_remote_item_paths:list, store:statestore.StateStore, to_skip:dict,
+    rc_reconcile:bool=False, rc_dedupe:bool=False, rc_logfile:str=None, rc_rcd:bool=False, rc_url:str=None) -> None:
+    """Before downloading an item, look for its files on each destination (rc_reconcile) and place copies of identical files (rc_dedupe).
+    With one destination, files found are marked done and added to to_skip.
+    With several, each find is recorded against its destination (See rclone_fanout());
+    Only files every destination has are skipped, the rest are downloaded and sent where they are missing."""
+    fanout = (len(rc_remote_item_paths) > 1)
+    uploads = store.get_uploads(identifier) if fanout else {}
+    for rc_remote_item_path in rc_remote_item_paths:
+        skip = dict(to_skip)
+        skip.update((name, None) for name, rc_paths in uploads.items() if rc_remote_item_path in rc_paths)
+        remote_args = dict(files=files, identifier=identifier, rc_remote_item_path=rc_remote_item_path, rc_logfile=rc_logfile, rc_rcd=rc_rcd, rc_url=rc_url)
+        found = []
+        if rc_reconcile:
+            found += _reconcile_item(skip=skip, **remote_args)
+            skip.update((file.name, None) for file in found)
+        if rc_dedupe:
+            found += _dedupe_item(store=store, skip=skip, **remote_args)
+        if not fanout:
+            _mark_transferred(files=found, identifier=identifier, store=store, to_skip=to_skip)
+            continue
+        for file in found:
+            store.set_upload(identifier=identifier, name=file.name, rc_path=rc_remote_item_path)
+            uploads.setdefault(file.name, set()).add(rc_remote_item_path)
+    if fanout:
+        everywhere = [file for file in files if (file.name not in to_skip) and uploads.get(file.name, set()).issuperset(rc_remote_item_paths)]
+        _mark_transferred(files=everywhere, identifier=identifier, store=store, to_skip=to_skip)
+    return
+
+
+def _index_item(files:list, rc_remote_item_path:str, store:statestore.StateStore) -> None:
+    """Add an item's files, all on the remote now, to the content index used by _dedupe_item()."""
+    for file in files:
+        want_md5 = ia_stream.expected_md5(file)
+        if want_md5:
+            store.add_content(md5=want_md5, rc_path='{0}/{1}'.format(rc_remote_item_path.rstrip('/'), file.name),
+                size=(int(file.size) if file.size else None))
+    return
+
+
+def _verify_item(files:list, identifier:str, rc_remote_item_path:str, store:statestore.StateStore, redo,
+    rc_logfile:str=None, rc_rcd:bool=False, rc_url:str=None, rc_quarantine_path:str=None, rc_dry_run:bool=False) -> None:
+    """Verify an item's remote copies with one listing, transferring files that don't match again (Up to VERIFY_PASSES times).
+    Mismatches are marked FILE_VERIFY_FAILED in the state store, so a later run redoes them even if this one gives up,
+    and logged to debug/verify_failed.txt.
+    Bad remote copies are quarantined or deleted (rclone_discard()) before transferring again.
+    redo : callable - redo(files) transfers a list of IA.File() instances again.
+    Raise RemoteVerifyFailed if files still don't match after the last pass."""
+    for verify_pass in range(0, VERIFY_PASSES+1):
+        remote_entries = rclone_list_hashes(rc_remote_path=rc_remote_item_path, rc_logfile=rc_logfile, rc_rcd=rc_rcd, rc_url=rc_url)
+        if remote_entries is None:
+            raise RemoteVerifyFailed('Could not list {0!r} to verify it'.format(rc_remote_item_path))
+        bad = verify_remote(files=files, remote_entries=remote_entries)
+        if not bad:
+            logging.info('Verified %s remote files for identifier=%r', len(files), identifier)
+            return
+        metrics.inc('ia2rc_verify_failures_total', len(bad))
+        for file, reason in bad:
+            logging.error('Remote copy of %s/%s failed verification: %s', identifier, file.name, reason)
+            store.set_file(identifier=identifier, name=file.name, status=statestore.FILE_VERIFY_FAILED)
+        store.commit()
+        common.appendlist(
+            lines=['{0}/{1}\t{2}'.format(identifier, file.name, reason) for file, reason in bad],
+            list_file_path=os.path.join('debug', 'verify_failed.txt'),
+            initial_text='# Files whose remote copy did not match InternetArchive metadata\n',
+        )
+        if verify_pass == VERIFY_PASSES:
+            break
+        logging.info('Transferring %s files again for identifier=%r', len(bad), identifier)
+        for file, reason in bad:
+            if file.name in remote_entries:# A fresh copy with the same size and modtime would otherwise be skipped by rclone.
+                rclone_discard(rc_remote_filepath='{0}/{1}'.format(rc_remote_item_path.rstrip('/'), file.name),
+                    rc_quarantine_path=rc_quarantine_path, rc_logfile=rc_logfile, rc_dry_run=rc_dry_run)
+        redo([file for file, reason in bad])
+    raise RemoteVerifyFailed('{n} files of identifier={i!r} failed remote verification'.format(n=len(bad), i=identifier))
+
+
+def _rclone_common_args(rc_bwlimit:str=None, rc_dry_run:bool=False) -> list:
+    """rclone flags shared by transfer commands. (rc_logfile is handled by rclone_cli)"""
+    args = []
     if rc_bwlimit:# Throttle/ratelimit
-        cmd.append('--bwlimit')
-        cmd.append('{0}'.format(rc_bwlimit))
-    if rc_logfile:# Verbose debugging info. https://rclone.org/docs/#log-level-level
-        cmd.append('--log-file={0}'.format(rc_logfile))
-        cmd.append('--log-level')
-        cmd.append('DEBUG')
+        args += ['--bwlimit', '{0}'.format(rc_bwlimit)]
     if rc_dry_run: # https://rclone.org/docs/#n-dry-run
-        cmd.append('--dry-run')
-    logging.debug('cmd={0!r}'.format(cmd))
-    # command - execute
-    common.ensure_dir_exists(dir_path=os.path.join('debug'))# Protect against missing dir for stdout/stderr temp files.
-    stdout_path = os.path.join('debug', 'ia2rc.rclone_upload.stdout.txt')
-    stderr_path = os.path.join('debug', 'ia2rc.rclone_upload.stderr.txt')
-    with open(stdout_path, 'w') as f_stdout: # File objects required to capture stdout and stderr.
-        with open(stderr_path, 'w') as f_stderr:
-            cmd_res = subprocess.run(
-                args=cmd, encoding='utf8',
-                stdout=f_stdout, stderr=f_stderr,
+        args.append('--dry-run')
+    return args
+
+
+def rclone_rcat(file, rc_remote_filepath:str, rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False) -> str:
+    """Pipe an IA file straight from its HTTP response into rclone rcat, never touching local disk.
+    The md5 is worked out as the data passes through.
+    On a hash mismatch rclone is still allowed to finish, so the bad copy can be found and dealt with (See rclone_discard()).
+    On any other failure rclone is killed before it can commit the upload.
+    file : IA.File() instance - the file to stream.
+    rc_remote_filepath : str - rclone-style destination path of the file.
+    return md5 hexdigest of the data.
+    Raise ia_stream.HashMismatch, a requests exception, or rclone_cli.RcloneError.
+    https://rclone.org/commands/rclone_rcat/"""
+    cmd = ['rclone', 'rcat', rc_remote_filepath]
+    if file.size:# Lets remotes that need to know the size up front take the normal upload path.
+        cmd += ['--size', '{0}'.format(int(file.size))]
+    cmd += _rclone_common_args(rc_bwlimit=rc_bwlimit, rc_dry_run=rc_dry_run)
+    proc = rclone_cli.RcloneProcess(cmd=cmd, stdin=True, rc_logfile=rc_logfile)
+    try:
+        local_md5 = ia_stream.pipe_file(file=file, sink=proc.stdin)
+        proc.stdin.close()
+    except ia_stream.HashMismatch:# Let rclone store it so it can be quarantined.
+        proc.stdin.close()
+        proc.wait(check=False)
+        raise
+    except BrokenPipeError:# rclone quit early, wait() raises with its reasons.
+        proc.wait()
+        raise
+    except BaseException:
+        proc.kill()# Abandon the upload rather than let rclone store a truncated file.
+        raise
+    proc.wait()
+    return local_md5
+
+
+def rclone_discard(rc_remote_filepath:str, rc_quarantine_path:str=None, rc_logfile:str=None, rc_dry_run:bool=False) -> bool:
+    """Get a bad remote file out of the way: move it under rc_quarantine_path (Keeping its name) if given, otherwise delete it.
+    return True if rclone succeeded."""
+    if rc_quarantine_path:# https://rclone.org/commands/rclone_moveto/
+        destination = '{0}/{1}'.format(rc_quarantine_path.rstrip('/'), rc_remote_filepath.split(':', 1)[-1].lstrip('/'))
+        logging.warning('Quarantining %r to %r', rc_remote_filepath, destination)
+        cmd = ['rclone', 'moveto', rc_remote_filepath, destination]
+    else:# https://rclone.org/commands/rclone_deletefile/
+        logging.warning('Deleting %r', rc_remote_filepath)
+        cmd = ['rclone', 'deletefile', rc_remote_filepath]
+    cmd += _rclone_common_args(rc_dry_run=rc_dry_run)
+    try:
+        rclone_cli.run(cmd=cmd, rc_logfile=rc_logfile)
+    except rclone_cli.RcloneError as err:
+        logging.error('Could not discard %r: %s', rc_remote_filepath, err)
+        return False
+    return True
+
+
+@metrics.tracked('ia2rc_upload')
+def rclone_upload(local_path:str, rc_remote_path:str, **kwargs) -> None:
+    """_rclone_upload() with the backoff and circuit breaker shared by everything using rc_remote_path's remote. (See rclone_guarded())"""
+    with rclone_guarded(rc_remote_path):
+        _rclone_upload(local_path=local_path, rc_remote_path=rc_remote_path, **kwargs)
+    return
+
+
+def _rclone_upload(local_path:str, rc_remote_path:str, files:list, rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False,
+    rc_rcd:bool=False, rc_url:str=None, rc_copy:bool=False) -> None:
+    """Use rclone to move files.
+    files : list - move only these paths (relative to local_path) using --files-from and --no-traverse,
+        so the cost scales with the number of files rather than with everything in local_path or on the remote.
+    rc_rcd : bool - submit the moves to the shared rclone rcd instead of spawning rclone.
+    rc_url : str - URL of an already-running rclone rc server to use. (Implies rc_rcd)
+    rc_copy : bool - copy instead of moving, leaving the local files in place.
+    https://rclone.org/docs/ """
+    logging.debug('rclone_upload() args=%r', locals())# SUPER DEBUG
+    verb = 'copy' if rc_copy else 'move'
+    logging.info('Using rclone to %s local_path=%r to rc_remote_path=%r', verb, local_path, rc_remote_path)
+    if not files:
+        logging.info('No files to %s', verb)
+        return
+    upload_bytes = 0
+    for name in files:# Measure before they're gone.
+        try:
+            upload_bytes += os.path.getsize(os.path.join(local_path, name))
+        except OSError:
+            pass
+    if rc_rcd or rc_url:
+        daemon = rclone_rc.get_daemon(rc_url=rc_url, rc_logfile=rc_logfile)
+        for name in files:
+            daemon.move_file(
+                local_path=local_path,
+                name=name,
+                rc_remote_path=rc_remote_path,
+                rc_bwlimit=rc_bwlimit,
+                rc_dry_run=rc_dry_run,
+                keep_source=rc_copy,
             )
-    # command - capture and tolerate result
-    logging.debug('cmd={0!r}'.format(cmd)) # Extra-detailed logging for dev only
-    logging.debug('cmd_res={0!r}'.format(cmd_res))
-    logging.debug('cmd_res.returncode={0!r}'.format(cmd_res.returncode))
-    assert(cmd_res.returncode == 0)# Nonzero means problems occured. TODO: Check return code better -2020-07-21.
-    logging.info('Finished rclone move local_path={l!r} to rc_remote_path={r!r}'.format(
-        l=local_path, r=rc_remote_path))
+        logging.info('Finished rclone rc %s local_path=%r to rc_remote_path=%r', verb, local_path, rc_remote_path)
+        metrics.inc('ia2rc_upload_files_total', len(files))
+        metrics.inc('ia2rc_upload_bytes_total', upload_bytes)
+        return
+    # command - prepare args
+    # https://rclone.org/commands/rclone_move/ https://rclone.org/commands/rclone_copy/
+    cmd = [ 'rclone', verb, local_path, rc_remote_path, ]
+    cmd += _rclone_common_args(rc_bwlimit=rc_bwlimit, rc_dry_run=rc_dry_run)
+    # https://rclone.org/filtering/#files-from-read-list-of-source-file-names
+    cmd.append('--files-from')
+    cmd.append('-')# Fed through stdin.
+    cmd.append('--no-traverse')# Don't list the destination, just check the files we name.
+    # command - execute
+    proc = rclone_cli.RcloneProcess(cmd=cmd, stdin=True, rc_logfile=rc_logfile)
+    try:
+        proc.stdin.write(''.join('{0}\n'.format(name) for name in files).encode('utf8'))
+        proc.stdin.close()
+    except BrokenPipeError:# rclone quit early, wait() raises with its reasons.
+        pass
+    proc.wait()# Raise rclone_cli.RcloneError if anything went wrong.
+    logging.debug('rclone stats=%r', proc.stats)
+    logging.info('Finished rclone %s local_path=%r to rc_remote_path=%r', verb, local_path, rc_remote_path)
+    metrics.inc('ia2rc_upload_files_total', len(files))
+    metrics.inc('ia2rc_upload_bytes_total', upload_bytes)
     return
 
 
+def rclone_fanout(local_path:str, rc_remote_paths:list, files:list, identifier:str, store:statestore.StateStore,
+    rc_dry_run:bool=False, **upload_kwargs) -> list:
+    """Copy files to several destinations at once, then delete the local copies every destination has.
+    Which destinations have each file is kept in the state store, so after a failure only the missing copies are sent again.
+    upload_kwargs - passed on to rclone_upload()
+    return names of files now on every destination.
+    Raise the first upload exception after the other destinations have finished."""
+    uploads = store.get_uploads(identifier)
+    def upload_to(rc_remote_path):
+        names = [name for name in files if rc_remote_path not in uploads.get(name, ())]
+        rclone_upload(local_path=local_path, rc_remote_path=rc_remote_path, files=names, rc_copy=True, rc_dry_run=rc_dry_run, **upload_kwargs)
+        if not rc_dry_run:
+            for name in names:
+                store.set_upload(identifier=identifier, name=name, rc_path=rc_remote_path)
+    first_error = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(rc_remote_paths)) as executor:
+        futures = {executor.submit(upload_to, rc_remote_path): rc_remote_path for rc_remote_path in rc_remote_paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as err:
+                logging.exception(err)
+                logging.error('Upload to %r failed, files stay in local_path=%r until it has them', futures[future], local_path)
+                if first_error is None:
+                    first_error = err
+    store.commit()
+    uploads = store.get_uploads(identifier)
+    done = [name for name in files if uploads.get(name, set()).issuperset(rc_remote_paths)]
+    if not rc_dry_run:
+        for name in done:
+            try:
+                os.remove(os.path.join(local_path, name))
+            except FileNotFoundError:
+                pass
+    if first_error is not None:
+        raise first_error
+    return done
+
+
+def upload_files(local_path:str, rc_remote_path, files:list, identifier:str=None, store:statestore.StateStore=None, **upload_kwargs) -> None:
+    """rclone_upload() files to rc_remote_path, or rclone_fanout() to each one if it is a list of destinations."""
+    if isinstance(rc_remote_path, str):
+        rclone_upload(local_path=local_path, rc_remote_path=rc_remote_path, files=files, **upload_kwargs)
+    else:
+        rclone_fanout(local_path=local_path, rc_remote_paths=rc_remote_path, files=files, identifier=identifier, store=store, **upload_kwargs)
+    return
+
+
+class UploadPipeline():
+    """Background uploader stage for pipelined download/upload.
+    The downloader hands over batches of verified filenames with submit() and carries on downloading,
+    while a worker thread runs rclone_upload() for each batch in turn.
+    The bounded queue between the two stages provides backpressure:
+    submit() blocks once queue_size batches are waiting, so local disk use stays bounded.
+    Each batch moves exactly the files named in it, so downloads still in progress are never touched.
+    rc_remote_path may be a list of destinations, each batch then goes to all of them. (See rclone_fanout())
+    """
+    def __init__(self, local_path:str, rc_remote_path, rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False,
+        queue_size:int=2, rc_rcd:bool=False, rc_url:str=None, budget:common.DiskBudget=None,
+        identifier:str=None, store:statestore.StateStore=None):
+        self.local_path = local_path
+        self.identifier = identifier
+        self.store = store
+        self.budget = budget # Disk space of uploaded files is released here.
+        self.rc_remote_path = rc_remote_path
+        self.rc_bwlimit = rc_bwlimit
+        self.rc_logfile = rc_logfile
+        self.rc_dry_run = rc_dry_run
+        self.rc_rcd = rc_rcd
+        self.rc_url = rc_url
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None # First exception raised by the uploader thread.
+        self.thread = threading.Thread(target=self._run, name='ia2rc-uploader', daemon=True)
+        self.thread.start()
+
+    def submit(self, filenames:list) -> None:
+        """Queue a batch of finished files for upload, blocking while the queue is full.
+        Raise the uploader's exception if an earlier upload failed."""
+        self.raise_if_failed()
+        logging.debug('Queueing batch of %s files for upload, queue size=%s', len(filenames), self.queue.qsize())
+        self.queue.put(list(filenames))
+        metrics.add_gauge('ia2rc_upload_queue_depth', 1)
+        return
+
+    def close(self) -> None:
+        """Wait for every queued batch to be uploaded and stop the uploader thread."""
+        self.queue.put(None)# Sentinel
+        self.thread.join()
+        self.raise_if_failed()
+        return
+
+    def raise_if_failed(self) -> None:
+        """Raise the uploader's exception if an earlier upload failed."""
+        if self.error is not None:
+            raise self.error
+
+    def _run(self) -> None:
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            metrics.add_gauge('ia2rc_upload_queue_depth', -1)
+            if self.error is not None:# Keep draining so the downloader never blocks forever, but stop uploading.
+                continue
+            try:
+                logging.info('Uploader stage handling batch of %s files', len(batch))
+                upload_files(
+                    local_path=self.local_path,
+                    rc_remote_path=self.rc_remote_path,
+                    rc_bwlimit=self.rc_bwlimit,
+                    rc_logfile=self.rc_logfile,
+                    rc_dry_run=self.rc_dry_run,
+                    rc_rcd=self.rc_rcd,
+                    rc_url=self.rc_url,
+                    files=batch,
+                    identifier=self.identifier,
+                    store=self.store,
+                )
+                if self.budget:
+                    for name in batch:
+                        self.budget.release(name)
+            except Exception as err:
+                logging.exception(err)
+                self.error = err
+
+
 ##class MaxRetriesReached(Exception):
 ##    """Signals that too the limit on retries has been reached"""
 ##def dl_ia_file_retry(identifier, filename, destdir,
@@ -167,66 +672,159 @@ def rclone_upload(local_path:str, rc_remote_path:str, rc_bwlimit:str=None, rc_lo
 ##    raise MaxRetriesReached() # Give up.
 
 
+def _count_download(file) -> None:
+    metrics.inc('ia2rc_download_files_total')
+    metrics.inc('ia2rc_download_bytes_total', int(file.size or 0))
+
+
 class MaxRetriesReached(Exception):
     """Signals that too the limit on retries has been reached"""
-def dl_ia_file_retry(file, destdir:str, dl_retries:int=100) -> None:
+@metrics.tracked('ia2rc_download')
+def dl_ia_file_retry(file, destdir:str, dl_retries:int=100, dl_stream:bool=False,
+    dl_segments:int=1, dl_segment_threshold:int=ia_stream.SEGMENT_THRESHOLD) -> None:
     """Download a single file from an IA item.
     Retry with exponential backoff if a failure occurs.
     Raise an exception if retries limit is exceeded.
     file : IA.File() instance - the file to download.
     destdir : str - path to download to.
     dl_retries : int - number of times to re-call the file.download() method before giving up.
+    dl_stream : bool - use ia_stream instead of the IA library, hashing while downloading instead of re-reading the file afterwards.
+    dl_segments : int - with dl_stream, fetch files of at least dl_segment_threshold bytes over this many connections.
+    Backoff is shared with every other download from the same host through retrycontrol,
+    so throttling and outages slow all workers down together.
     """
-    logging.debug('dl_ia_file() args={0!r}'.format(locals()))# SUPER DEBUG
-    logging.info('Attempting download for file={0!r}'.format(file))
+    logging.debug('dl_ia_file() args=%r', locals())# SUPER DEBUG
+    logging.info('Attempting download for file=%r', file)
     local_filepath = os.path.join(destdir, file.name)
-    logging.debug('local_filepath={0!r}'.format(local_filepath))
+    logging.debug('local_filepath=%r', local_filepath)
+    controller = retrycontrol.get_controller(file.url)
     for attempt in range(1, dl_retries):
-        logging.debug('attempt={a!r} of dl_retries={m!r}'.format(a=attempt, m=dl_retries))
+        logging.debug('attempt=%r of dl_retries=%r', attempt, dl_retries)
         if attempt > 1:# On retry - meaning failure to download from IA
-            delay = min(300, (2 ** (attempt-1)))# Exponential backoff up to a maximum of 5 minutes. [2,4,8,16,32,60,120,240,300,300,...] seconds.
-            logging.info('Download failure, waiting {d} seconds'.format(d=delay))
+            metrics.inc('ia2rc_download_retries_total')
+            delay = controller.backoff_delay(attempt-1)# Jittered exponential backoff up to a maximum of 5 minutes.
+            logging.info('Download failure, waiting %.1f seconds', delay)
             time.sleep(delay) # Wait a bit because something is fucky.
+        controller.wait()# Host-wide pause if IA asked us to slow down or is down.
+        if dl_stream:
+            try:
+                ia_stream.fetch_file(# Verifies hash itself.
+                    file=file,
+                    destdir=destdir,
+                    segments=dl_segments,
+                    segment_threshold=dl_segment_threshold
+                )
+            except ia_stream.HashMismatch as err:
+                logging.error('Hash mismatch on downloaded file: %s (%s)', local_filepath, err)
+                metrics.inc('ia2rc_download_hash_failures_total')
+                controller.success()# The host answered fine, the data was bad.
+                continue # Try again if permitted
+            except requests.exceptions.RequestException as err:
+                logging.exception(err)
+                logging.error('Request error streaming file from InternetArchive file=%r', file)
+                controller.report_error(err)
+                continue # Try again if permitted
+            controller.success()
+            _count_download(file)
+            return # Success.
         try:
             dl_ret = file.download(
                 destdir=destdir,
                 verbose=True,
                 checksum=True, # skip files based on md5 checksums (safer)
-                retries = 100, # Default is 2 - https://github.com/jjjake/internetarchive/blob/master/internetarchive/files.py#L195
+                retries = 1, # Retrying is left to us and retrycontrol. (Default is 2) - https://github.com/jjjake/internetarchive/blob/master/internetarchive/files.py#L195
                 ignore_errors=False, # ignore_errors=False means pass exceptions back out of the library to the caller.
             )
-            logging.debug('dl_ret={0!r}'.format(dl_ret)) # EXPECTED to be True for success, False for fail. unsure though. This is to keep an eye on what it actually does.
+            logging.debug('dl_ret=%r', dl_ret) # EXPECTED to be True for success, False for fail. unsure though. This is to keep an eye on what it actually does.
+            controller.success()
             if (dl_ret is False): # Failure.
-                logging.error('IA library says it failed to download {0}/{1}'.format(file.item, file.name))
+                logging.error('IA library says it failed to download %s/%s', file.item, file.name)
                 continue # Try again if we're allowed to.
             if (dl_ret is None): # No download.
-                logging.info('IA library says it did not attempt a download for {0}/{1}'.format(file.item, file.name))
+                logging.info('IA library says it did not attempt a download for %s/%s', file.item, file.name)
                 return # The file is there, so success.
             if (dl_ret is True): # Success.
                 if (file.format == 'Metadata'):# Special case, _files.xml hash is expected to mismatch. (Because self-hashing is very hard this file gets a hash value that does not match it)
-                    logging.info('Skipping hash check for item metadata file: {0}/{1}'.format(file.item, file.name))
+                    logging.info('Skipping hash check for item metadata file: %s/%s', file.item, file.name)
                 else: # Normal file
                     # Verify file hash
                     local_md5 = common.get_file_md5(filepath=local_filepath)
-                    logging.debug('file.md5={0!r}'.format(file.md5))
-                    logging.debug('local_md5={0!r}'.format(local_md5))
+                    logging.debug('file.md5=%r', file.md5)
+                    logging.debug('local_md5=%r', local_md5)
                     if (local_md5 != file.md5):
-                        logging.error('Hash mismatch on downloaded file: {0}'.format(local_filepath))
+                        logging.error('Hash mismatch on downloaded file: %s', local_filepath)
+                        metrics.inc('ia2rc_download_hash_failures_total')
                         continue # Try again if permitted
-                    logging.debug('Hash correct on downloaded file: {0}'.format(local_filepath))
-                # After all file verification
-                common.appendlist(
-                    lines='{0}/{1}'.format(file.item, file.name),
-                    list_file_path=os.path.join('debug', 'ia_dl_success_list.txt'),
-                    initial_text='# List of successful downloads.\n# identifier/name\n'
-                )
+                    logging.debug('Hash correct on downloaded file: %s', local_filepath)
+                _count_download(file)
                 return # Success.
-        except requests.exceptions.ConnectionError as err:
+        except internetarchive.exceptions.InvalidChecksumError as err:
+            logging.error('Hash mismatch on downloaded file: %s (%s)', local_filepath, err)
+            metrics.inc('ia2rc_download_hash_failures_total')
+            controller.success()# The host answered fine, the data was bad.
+        except requests.exceptions.RequestException as err:# ConnectionError, HTTPError (e.g. 429/503), RetryError...
             logging.exception(err)
-            logging.error('ConnectionError emitted loading file from InternetArchive file={f!r}'.format(f=file))
+            logging.error('%s emitted loading file from InternetArchive file=%r', type(err).__name__, file)
+            controller.report_error(err)
         continue # Try again if we're allowed to.
     # After all retries are used up, just break loudly.
-    logging.error('Too many download failures for file={f!r}'.format(f=file))
+    logging.error('Too many download failures for file=%r', file)
+    raise MaxRetriesReached() # Give up.
+
+
+@metrics.tracked('ia2rc_download')
+def rc_stream_file_retry(file, rc_remote_filepath:str, dl_retries:int=100, rc_bwlimit:str=None, rc_logfile:str=None,
+    rc_dry_run:bool=False, rc_quarantine_path:str=None) -> None:
+    """Stream a single file from an IA item straight to the remote with rclone_rcat(), retrying like dl_ia_file_retry().
+    A copy that fails its hash check is quarantined or deleted (rclone_discard()) before trying again.
+    file : IA.File() instance - the file to stream.
+    rc_remote_filepath : str - rclone-style destination path of the file.
+    rc_quarantine_path : str - rclone-style dir to move bad copies into, instead of deleting them.
+    """
+    logging.info('Attempting streaming transfer for file=%r', file)
+    controller = retrycontrol.get_controller(file.url)
+    rc_controller = rclone_controller(rc_remote_filepath)
+    for attempt in range(1, dl_retries):
+        logging.debug('attempt=%r of dl_retries=%r', attempt, dl_retries)
+        if attempt > 1:
+            metrics.inc('ia2rc_download_retries_total')
+            delay = controller.backoff_delay(attempt-1)
+            logging.info('Streaming failure, waiting %.1f seconds', delay)
+            time.sleep(delay)
+        controller.wait()
+        rc_controller.wait()
+        try:
+            rclone_rcat(
+                file=file,
+                rc_remote_filepath=rc_remote_filepath,
+                rc_bwlimit=rc_bwlimit,
+                rc_logfile=rc_logfile,
+                rc_dry_run=rc_dry_run,
+            )
+        except ia_stream.HashMismatch as err:
+            logging.error('Hash mismatch on streamed file: %s (%s)', rc_remote_filepath, err)
+            metrics.inc('ia2rc_download_hash_failures_total')
+            controller.success()# The host answered fine, the data was bad.
+            rclone_discard(rc_remote_filepath=rc_remote_filepath, rc_quarantine_path=rc_quarantine_path,
+                rc_logfile=rc_logfile, rc_dry_run=rc_dry_run)
+            continue # Try again if permitted
+        except requests.exceptions.RequestException as err:
+            logging.exception(err)
+            logging.error('%s emitted streaming file from InternetArchive file=%r', type(err).__name__, file)
+            controller.report_error(err)
+            continue # Try again if permitted
+        except rclone_cli.RcloneError as err:
+            logging.error('rclone failed storing streamed file: %s', err)
+            metrics.inc('ia2rc_upload_failures_total')
+            rc_controller.report_message(str(err))
+            continue # Try again if permitted
+        controller.success()
+        rc_controller.success()
+        _count_download(file)
+        metrics.inc('ia2rc_upload_files_total')
+        metrics.inc('ia2rc_upload_bytes_total', int(file.size or 0))
+        return # Success.
+    logging.error('Too many streaming failures for file=%r', file)
     raise MaxRetriesReached() # Give up.
 
 
@@ -254,129 +852,612 @@ def dl_ia_file_retry(file, destdir:str, dl_retries:int=100) -> None:
 
 
 
-def dl_ia_item(identifier:str, local_path:str, rc_remote_path:str,
+def _dl_ia_item_file(file, identifier:str, local_path:str, store:statestore.StateStore, partial_path:str=None, **dl_kwargs) -> None:
+    """Download one file of an item and remember that it was done.
+    Safe to call from several worker threads at once.
+    file : IA.File() instance - the file to download.
+    identifier : str - InternetArchive unique item identifier the file belongs to.
+    local_path : str - path to download to.
+    store : StateStore - where to record that the file is done.
+    partial_path : str - if set, download here first and only move the file into local_path once it is verified.
+    dl_kwargs - passed on to dl_ia_file_retry()
+    """
+    logging.info('Attempting download for file=%r', file)
+    dl_ia_file_retry(
+        file=file,
+        destdir=(partial_path or local_path),
+        **dl_kwargs
+    )
+    if partial_path:# Atomically hand the verified file over to the upload stage.
+        final_filepath = os.path.join(local_path, file.name)
+        common.ensure_parent_dir_exists(filepath=final_filepath)
+        os.replace(os.path.join(partial_path, file.name), final_filepath)
+    # Remember we have already saved this file so partial item downloads can be resumed.
+    store.set_file(
+        identifier=identifier,
+        name=file.name,
+        status=statestore.FILE_DOWNLOADED,
+        size=(int(file.size) if file.size else None),
+        md5=file.md5
+    )
+    return
+
+
+class DownloadPool():
+    """Download files of one item dl_workers at a time on worker threads, starting the next file as soon as one finishes.
+    submit() blocks while dl_workers files are in flight, so at most that many are ever downloading or waiting to.
+    Names of files that finished are handed back by finished(), ready to upload.
+    Disk space for each file must already be reserved.
+    After a download fails no more files are started; The error is raised once the ones in flight have finished.
+    dl_workers : int - number of files to download at once.
+    item_args - passed on to _dl_ia_item_file()
+    """
+    def __init__(self, dl_workers:int=2, **item_args):
+        logging.info('Downloading files using dl_workers=%s', dl_workers)
+        self.dl_workers = dl_workers
+        self.item_args = item_args
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=dl_workers, thread_name_prefix='ia2rc-download')
+        self.in_flight = {} # {future: filename}
+        self.done = [] # Filenames finished since the last finished() call.
+        self.error = None # First exception raised by a download.
+
+    def submit(self, file) -> None:
+        """Start downloading a file, first waiting for a free worker if need be.
+        Raise the first download exception, once the files in flight have finished, if one has failed."""
+        self.raise_if_failed()
+        while len(self.in_flight) >= self.dl_workers:
+            finished, unfinished = concurrent.futures.wait(self.in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            self._collect(finished)
+            self.raise_if_failed()
+        future = self.executor.submit(_dl_ia_item_file, file=file, **self.item_args)
+        self.in_flight[future] = file.name
+        return
+
+    def finished(self) -> list:
+        """return names of files finished since the last call, without waiting."""
+        self._collect([future for future in self.in_flight if future.done()])
+        done, self.done = self.done, []
+        return done
+
+    def drain(self) -> list:
+        """Wait for every file in flight.
+        return names of files finished since the last finished() call.
+        Raise the first download exception if one failed."""
+        self._collect(concurrent.futures.wait(self.in_flight)[0])
+        self.raise_if_failed()
+        return self.finished()
+
+    def raise_if_failed(self) -> None:
+        """Raise the first download exception, once the files in flight have finished, if one has failed.
+        Files that did finish are already recorded, so a rerun resumes after them."""
+        if self.error is not None:
+            self._collect(concurrent.futures.wait(self.in_flight)[0])
+            raise self.error
+
+    def close(self) -> None:
+        """Wait for files in flight and stop the worker threads."""
+        self.executor.shutdown(wait=True)
+        return
+
+    def _collect(self, finished) -> None:
+        for future in finished:
+            filename = self.in_flight.pop(future)
+            try:
+                future.result()
+            except Exception as err:
+                logging.exception(err)
+                if self.error is None:
+                    self.error = err
+                continue
+            self.done.append(filename)
+        return
+
+
+def _stream_ia_item_file(file, identifier:str, rc_remote_item_path:str, store:statestore.StateStore, **stream_kwargs) -> None:
+    """Stream one file of an item to the remote and remember that it was done.
+    Safe to call from several worker threads at once.
+    stream_kwargs - passed on to rc_stream_file_retry()"""
+    rc_stream_file_retry(
+        file=file,
+        rc_remote_filepath='{0}/{1}'.format(rc_remote_item_path.rstrip('/'), file.name),
+        **stream_kwargs
+    )
+    store.set_file(
+        identifier=identifier,
+        name=file.name,
+        status=statestore.FILE_DOWNLOADED,
+        size=(int(file.size) if file.size else None),
+        md5=file.md5
+    )
+    return
+
+
+def _stream_ia_item(files, identifier:str, rc_remote_item_path:str, store:statestore.StateStore, to_skip:dict,
+    ia_resuming:bool=True, dl_workers:int=1, **stream_kwargs) -> None:
+    """Stream every file of an item straight to the remote, dl_workers at a time. Nothing is written to local disk.
+    Raise the first worker exception after the rest of the files have finished.
+    stream_kwargs - passed on to rc_stream_file_retry()"""
+    logging.info('Streaming files of identifier=%r to %r using dl_workers=%s', identifier, rc_remote_item_path, dl_workers)
+    first_error = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, dl_workers)) as executor:
+        futures = []
+        for file in files:
+            if ia_resuming and (file.name in to_skip):
+                logging.info('Skipping already transferred file: %r', file.name)
+                continue
+            futures.append(executor.submit(_stream_ia_item_file,
+                file=file,
+                identifier=identifier,
+                rc_remote_item_path=rc_remote_item_path,
+                store=store,
+                **stream_kwargs
+            ))
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as err:
+                logging.exception(err)
+                if first_error is None:
+                    first_error = err
+    if first_error is not None:
+        raise first_error # Files that did finish are already recorded, so a rerun resumes after them.
+    return
+
+
+def _upload_batch(filenames:list, uploader:UploadPipeline, local_path:str, rc_remote_path,
+    rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False, rc_rcd:bool=False, rc_url:str=None,
+    budget:common.DiskBudget=None, identifier:str=None, store:statestore.StateStore=None) -> None:
+    """Upload files downloaded since the last upload, and only those.
+    Hand them to the background uploader if pipelining, otherwise block on rclone.
+    Their disk space is released from budget once they are gone."""
+    if uploader:
+        uploader.submit(filenames)
+        return
+    upload_files(
+        local_path=local_path,
+        rc_remote_path=rc_remote_path,
+        rc_bwlimit=rc_bwlimit,
+        rc_logfile=rc_logfile,
+        rc_dry_run=rc_dry_run,
+        rc_rcd=rc_rcd,
+        rc_url=rc_url,
+        files=filenames,
+        identifier=identifier,
+        store=store,
+    )
+    if budget:
+        for name in filenames:
+            budget.release(name)
+    return
+
+
+def dl_ia_item(identifier:str, local_path:str, rc_remote_path,
     rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False, # RClone
     ia_file_glob_pattern:str=None, ia_dry_run:bool=False, ia_resuming:bool=True, # InternetArchive
-    upload_every=1, dl_retries=100) -> None:
+    upload_every=1, dl_retries=100, dl_workers:int=1, pipeline:bool=False, pipeline_queue_size:int=2,
+    dl_stream:bool=False, dl_segments:int=1, dl_segment_threshold:int=ia_stream.SEGMENT_THRESHOLD,
+    state_db:str=statestore.DEFAULT_DB_PATH, rc_rcd:bool=False, rc_url:str=None, disk_budget:int=None,
+    meta_ttl:int=metacache.DEFAULT_TTL, meta_cache_db:str=metacache.DEFAULT_DB_PATH,
+    rc_stream:bool=False, rc_quarantine_path:str=None, rc_verify:bool=False, rc_reconcile:bool=False, rc_dedupe:bool=False,
+    dl_bwlimit:str=None) -> None:
     """Download all original files for a given IA item
     identifier: InternetArchive unique item identifier
-    upload_every upload after every n files"""
-    logging.debug('dl_ia_item() args={0!r}'.format(locals()))# SUPER DEBUG
-    logging.info('Attempting download for identifier={i!r}'.format(
-        i=identifier))
+    rc_remote_path rclone-style dir to put the item in, or a list of several to send every file to.
+        With several, each file is downloaded once and copied to all of them at once,
+        and its local copy deleted once every one has it. rc_stream doesn't apply.
+    upload_every upload after every n files
+    dl_workers download this many files at once.
+        When above 1, files are downloaded in batches of max(upload_every, dl_workers) files
+        and uploads only happen between batches.
+    pipeline upload in a background thread while downloading continues.
+    pipeline_queue_size number of batches allowed to wait for upload before downloading pauses.
+    dl_stream download with ia_stream, verifying the md5 as data arrives.
+    dl_segments with dl_stream, download files of at least dl_segment_threshold bytes over this many connections.
+    state_db path of the statestore database used for resuming.
+    rc_rcd upload through one long-lived rclone rcd per process instead of spawning rclone each time.
+    rc_url use an already-running rclone rc server at this URL. (Implies rc_rcd)
+    disk_budget bytes of local_path that downloads waiting for upload may use.
+        Defaults to the free space less 100MiB. Downloading pauses while the budget is used up.
+    meta_ttl seconds cached item metadata is trusted before revalidating it with IA, 0 to always fetch it.
+    meta_cache_db path of the metacache database.
+    rc_stream pipe each download straight into rclone rcat instead of staging it on local disk.
+        dl_workers files are streamed at once; upload_every, pipeline, dl_stream, rc_rcd and disk_budget don't apply.
+    rc_quarantine_path with rc_stream, rclone-style dir to move copies that fail their hash check into, instead of deleting them.
+    rc_verify once everything is uploaded, list the remote copies with their md5s (One listing per item)
+        and compare them to IA's metadata. Files that don't match are transferred again.
+    rc_reconcile before downloading, list the remote copies with their md5s (One listing per item)
+        and skip files whose name, size and md5 already match IA's metadata. Only applies when ia_resuming.
+    rc_dedupe place files whose md5 an earlier item already put on the same remote with a server-side copy
+        instead of downloading them. Every finished item is added to the content index in the state store.
+    dl_bwlimit limit on download bytes/s shared by every download thread in the process, in rclone --bwlimit syntax:
+        e.g. '5M', or a timetable like '08:00,5M 18:00,off' that is followed as the day goes on. Implies dl_stream."""
+    logging.debug('dl_ia_item() args=%r', locals())# SUPER DEBUG
+    logging.info('Attempting download for identifier=%r', identifier)
     # Prepare paths (They are either correct or incorrect BEFORE any work is done)
-    rc_remote_item_path = os.path.join(rc_remote_path, identifier) # (Assuming identifier is already a filesystem-safe slug)
-    logging.debug('rc_remote_item_path={0!r}'.format(rc_remote_item_path))
-    toskip_path = os.path.join('memory', 'done_files', '{0}.txt'.format(identifier) )
+    if isinstance(rc_remote_path, str):
+        rc_remote_path = [rc_remote_path]
+    rc_remote_item_paths = [os.path.join(path, identifier) for path in rc_remote_path] # (Assuming identifier is already a filesystem-safe slug)
+    logging.debug('rc_remote_item_paths=%r', rc_remote_item_paths)
+    fanout = (len(rc_remote_item_paths) > 1)
+    if fanout and rc_stream:
+        raise ValueError('rc_stream can only send to one rc_remote_path')
+    rc_remote_item_path = rc_remote_item_paths[0]
+    rc_upload_path = rc_remote_item_paths if fanout else rc_remote_item_path # What the upload stage sends to.
+    ratelimit.configure(dl_bwlimit)# Shared with every other item in this process.
+    if dl_bwlimit and not (dl_stream or rc_stream):
+        logging.info('dl_bwlimit only applies to the built-in streaming downloader, using dl_stream')
+        dl_stream = True
     common.ensure_dir_exists(dir_path=local_path) # There has to be a place to put our stuff.
     # Remember what we already did.
-    to_skip = {}
-    if os.path.exists(toskip_path):
-        to_skip = common.read_listfile_to_dict(filepath=toskip_path, silent=True)
-    logging.debug('to_skip={0!r}'.format(to_skip))
+    store = statestore.open_store(db_path=state_db)
+    to_skip = store.get_files(identifier=identifier, status=statestore.FILE_DOWNLOADED)
+    logging.debug('to_skip=%r', to_skip)
     # Get/instantiate objects for the item and its files
-    item = internetarchive.get_item(identifier)
-    logging.info('item={0!r}'.format(item))
+    item = metacache.get_item(identifier, db_path=meta_cache_db, ttl=meta_ttl)
+    logging.info('item=%r', item)
     item_total_files = item.item_metadata['files_count']
-    files = item.get_files(
+    store.set_item(identifier=identifier, status=statestore.ITEM_STARTED, files_count=item_total_files)
+    files = list(item.get_files(# Kept as a list so the remote copies can be verified afterwards.
         glob_pattern=ia_file_glob_pattern, # Ignore files based on glob preferences if any were set.
         on_the_fly=False, # Do not download anything other than the origianl files.
+    ))
+    logging.debug('files=%r', files)
+    verify_args = dict(# Settings for _find_on_remotes() and _verify_item()
+        files=files,
+        identifier=identifier,
+        store=store,
+        rc_logfile=rc_logfile,
+        rc_rcd=rc_rcd,
+        rc_url=rc_url
     )
-    logging.info('files={0!r}'.format(files))
-    # Download item original files
-##    todo_files = len(files)# Prepare value for messages later. DOES NOT WORK - ln.99 - object of type 'generator' has no len()
-    c = 0 # First item is number 1
-    for file in files:
-        c += 1
-        logging.info('File {c} of up to {tot}'.format(c=c, tot=item_total_files))
-        logging.debug('file={0!r}'.format(file))
-        filename = file.name
-##        logging.info('File {c} of {tot} : {fn!r}'.format(c=c, tot=item_total_files, fn=filename))
-        # Handle skipping
-        try: # Has this identifier+filename been done before?
-            dummy = to_skip[filename]  # (classic fast existance comparison)
-            logging.debug('Seen this identifier+filename before')
-            if ia_resuming:
-                logging.info('Skipping already downloaded file: {0!r}'.format(filename))
-                continue
-        except KeyError:
-            pass
-        # Verify download is possible
-        filesize = int(file.size) # File size in bytes
-        bytes_needed = filesize + common.ONE_HUNDRED_MEGABYTES
-        common.check_disk_free(bytes_req=bytes_needed, local_path=local_path)
-        # Perform download of this file
-        logging.info('Attempting download for file={f!r}'.format(f=file))
-        dl_ia_file_retry(
-            file=file,
-            destdir=local_path,
-            dl_retries=dl_retries
+    if rc_dedupe and rc_dry_run:
+        logging.info('Not deduplicating because rc_dry_run is set')
+        rc_dedupe = False
+    if (rc_reconcile or rc_dedupe) and ia_resuming:
+        _find_on_remotes(rc_remote_item_paths=rc_remote_item_paths, to_skip=to_skip, rc_reconcile=rc_reconcile, rc_dedupe=rc_dedupe, **verify_args)
+    if rc_verify and rc_dry_run:
+        logging.info('Not verifying remote copies because rc_dry_run is set')
+        rc_verify = False
+    if rc_stream:
+        leftovers = [name for name in to_skip if os.path.exists(os.path.join(local_path, name))]
+        if leftovers:# From an earlier run that staged on disk.
+            logging.info('Found %s previously downloaded files still waiting for upload', len(leftovers))
+            rclone_upload(local_path=local_path, rc_remote_path=rc_remote_item_path, rc_bwlimit=rc_bwlimit,
+                rc_logfile=rc_logfile, rc_dry_run=rc_dry_run, rc_rcd=rc_rcd, rc_url=rc_url, files=leftovers)
+        stream_args = dict(# Settings for _stream_ia_item()
+            identifier=identifier,
+            rc_remote_item_path=rc_remote_item_path,
+            store=store,
+            dl_workers=dl_workers,
+            dl_retries=dl_retries,
+            rc_bwlimit=rc_bwlimit,
+            rc_logfile=rc_logfile,
+            rc_dry_run=rc_dry_run,
+            rc_quarantine_path=rc_quarantine_path
         )
-        # Remember we have already saved this file so partial item downloads can be resumed.
-        common.appendlist(
-            lines=filename,
-            list_file_path=toskip_path,
-            initial_text='# List of previously downloaded filenames for identifier={0!r}.\n'.format(identifier)
+        try:
+            _stream_ia_item(files=files, to_skip=to_skip, ia_resuming=ia_resuming, **stream_args)
+            if rc_verify:
+                _verify_item(rc_remote_item_path=rc_remote_item_path,
+                    redo=(lambda bad_files: _stream_ia_item(files=bad_files, to_skip={}, **stream_args)),
+                    rc_quarantine_path=rc_quarantine_path, rc_dry_run=rc_dry_run, **verify_args)
+        finally:
+            store.commit()
+        if not rc_dry_run:
+            _index_item(files=files, rc_remote_item_path=rc_remote_item_path, store=store)
+        store.set_item(identifier=identifier, status=statestore.ITEM_DONE)
+        store.commit()
+        logging.info('Finished work for identifier=%r', identifier)
+        return
+    # Prepare upload stage
+    budget = common.DiskBudget(local_path=local_path, budget_bytes=disk_budget)
+    uploader = None
+    partial_path = None
+    if pipeline:
+        partial_path = os.path.join(local_path, PARTIAL_DIRNAME)
+        uploader = UploadPipeline(
+            local_path=local_path,
+            rc_remote_path=rc_upload_path,
+            rc_bwlimit=rc_bwlimit,
+            rc_logfile=rc_logfile,
+            rc_dry_run=rc_dry_run,
+            queue_size=pipeline_queue_size,
+            rc_rcd=rc_rcd,
+            rc_url=rc_url,
+            budget=budget,
+            identifier=identifier,
+            store=store,
         )
-        if upload_every and (c % upload_every == 0):
-            # Perform upload via rclone
-            rclone_upload(
-                local_path=local_path,
-                rc_remote_path=rc_remote_item_path,
-                rc_bwlimit=rc_bwlimit,
-                rc_logfile=rc_logfile,
-                rc_dry_run=rc_dry_run
-            )
-    logging.debug('Finished all downloading for identifier={0}'.format(identifier))
-    # Perform upload via rclone
-    rclone_upload(
+    dl_kwargs = dict(# Settings for dl_ia_file_retry()
+        dl_retries=dl_retries,
+        dl_stream=dl_stream,
+        dl_segments=dl_segments,
+        dl_segment_threshold=dl_segment_threshold
+    )
+    upload_args = dict(
+        uploader=uploader,
         local_path=local_path,
-        rc_remote_path=rc_remote_item_path,
+        rc_remote_path=rc_upload_path,
         rc_bwlimit=rc_bwlimit,
         rc_logfile=rc_logfile,
-        rc_dry_run=rc_dry_run
+        rc_dry_run=rc_dry_run,
+        rc_rcd=rc_rcd,
+        rc_url=rc_url,
+        budget=budget,
+        identifier=identifier,
+        store=store
     )
-    # Remember we have already saved this item.
-    common.appendlist(
-        lines=identifier,
-        list_file_path=os.path.join('memory', 'done_identifiers.txt',),
-        initial_text='# List of previously downloaded identifiers\n',
+    item_args = dict(# Settings for _dl_ia_item_file() and DownloadPool
+        identifier=identifier,
+        local_path=local_path,
+        store=store,
+        partial_path=partial_path,
+        **dl_kwargs
     )
-    logging.info('Finished work for identifier={i!r}'.format(i=identifier))
+    # Download item original files
+##    todo_files = len(files)# Prepare value for messages later. DOES NOT WORK - ln.99 - object of type 'generator' has no len()
+    if upload_every:
+        batch_size = max(upload_every, dl_workers)
+    else:
+        batch_size = None # Only upload once everything is downloaded.
+    pool = DownloadPool(dl_workers=dl_workers, **item_args) if (dl_workers > 1) else None
+    # Files an earlier run downloaded but never got to upload.
+    to_upload = [name for name in to_skip if os.path.exists(os.path.join(local_path, name))] # Names of files downloaded since the last upload.
+    if to_upload:
+        logging.info('Found %s previously downloaded files still waiting for upload', len(to_upload))
+    c = 0 # First item is number 1
+    try:
+        for file in files:
+            c += 1
+            logging.info('File %s of up to %s', c, item_total_files)
+            logging.debug('file=%r', file)
+            filename = file.name
+    ##        logging.info('File {c} of {tot} : {fn!r}'.format(c=c, tot=item_total_files, fn=filename))
+            # Handle skipping
+            try: # Has this identifier+filename been done before?
+                dummy = to_skip[filename]  # (classic fast existance comparison)
+                logging.debug('Seen this identifier+filename before')
+                if ia_resuming:
+                    logging.info('Skipping already downloaded file: %r', filename)
+                    continue
+            except KeyError:
+                pass
+            # Reserve disk space, pausing until uploads make room if need be.
+            filesize = int(file.size) if file.size else 0 # File size in bytes
+            if not budget.reserve(key=filename, nbytes=filesize, timeout=0):
+                logging.info('Disk budget used up, uploading what we have before downloading %r', filename)
+                while True:
+                    if pool:# Downloads in flight hold space too, upload them as they finish.
+                        to_upload += pool.finished()
+                        pool.raise_if_failed()
+                    if to_upload:
+                        _upload_batch(filenames=to_upload, **upload_args)
+                        to_upload = []
+                        store.commit()# Everything so far is on disk or uploaded, make sure we remember it.
+                    if budget.reserve(key=filename, nbytes=filesize, timeout=1):# Wait for the uploader to drain or a download to finish.
+                        break
+                    if uploader:
+                        uploader.raise_if_failed()
+            if pool: # Concurrent mode, start the file as soon as a worker is free.
+                pool.submit(file)
+                to_upload += pool.finished()
+                if batch_size and (len(to_upload) >= batch_size):
+                    _upload_batch(filenames=to_upload, **upload_args)
+                    to_upload = []
+                    store.commit()# Everything so far is on disk or uploaded, make sure we remember it.
+                continue
+            # Perform download of this file
+            _dl_ia_item_file(file=file, **item_args)
+            to_upload.append(filename)
+            if upload_every and (c % upload_every == 0):
+                # Perform upload via rclone
+                _upload_batch(filenames=to_upload, **upload_args)
+                to_upload = []
+                store.commit()# Everything so far is on disk or uploaded, make sure we remember it.
+        if pool: # Files still downloading in concurrent mode.
+            to_upload += pool.drain()
+        logging.debug('Finished all downloading for identifier=%s', identifier)
+        # Perform upload via rclone
+        _upload_batch(filenames=to_upload, **upload_args)
+    except BaseException:
+        if pool:
+            pool.close()
+            pool = None
+        if uploader:# Let queued uploads finish even if downloading broke, so the next run has less to do.
+            try:
+                uploader.close()
+            except Exception as err:# Don't let it hide why downloading stopped.
+                logging.exception(err)
+                logging.error('Uploads for identifier=%r failed as well', identifier)
+            uploader = None
+        raise
+    finally:
+        if pool:
+            pool.close()
+        if uploader:
+            uploader.close()
+        store.commit()
+    if rc_verify:
+        for rc_verify_path in rc_remote_item_paths:
+            def redo(bad_files, rc_verify_path=rc_verify_path):# Fetch them again, one at a time, and upload to just this destination.
+                redo_upload_args = dict(upload_args, uploader=None, rc_remote_path=rc_verify_path)
+                fetched = []
+                for file in bad_files:
+                    filesize = int(file.size) if file.size else 0 # File size in bytes
+                    if not budget.reserve(key=file.name, nbytes=filesize, timeout=0):# Make room by uploading what we have.
+                        _upload_batch(filenames=fetched, **redo_upload_args)
+                        fetched = []
+                        budget.reserve(key=file.name, nbytes=filesize)
+                    _dl_ia_item_file(file=file, **item_args)
+                    fetched.append(file.name)
+                _upload_batch(filenames=fetched, **redo_upload_args)
+            _verify_item(rc_remote_item_path=rc_verify_path, redo=redo,
+                rc_quarantine_path=rc_quarantine_path, rc_dry_run=rc_dry_run, **verify_args)
+    if partial_path:
+        try:# Leave the staging dir as clean as we found it.
+            os.rmdir(partial_path)
+        except OSError:
+            pass
+    # Remember we have already saved this item.
+    if not rc_dry_run:
+        for path in rc_remote_item_paths:
+            _index_item(files=files, rc_remote_item_path=path, store=store)
+    store.set_item(identifier=identifier, status=statestore.ITEM_DONE)
+    store.commit()
+    logging.info('Finished work for identifier=%r', identifier)
     return
 
 
-def dl_ia_uploader(uploader:str, local_path:str, rc_remote_path:str,
+def iter_uploader_identifiers(uploader:str, ia_item_glob_pattern:str=None):
+    """Yield the identifier of every item by an uploader, one at a time.
+    Uses the IA scrape API, which pages through results with a cursor, so only one page is ever held in memory.
+    ia_item_glob_pattern : str - only yield identifiers matching this glob pattern. Separate several patterns with '|'."""
+    patterns = ia_item_glob_pattern.split('|') if ia_item_glob_pattern else None
+    session = metacache.get_ia_session()
+    # https://archive.org/help/aboutsearch.htm
+    search = session.search_items('uploader:"{0}"'.format(uploader), fields=['identifier'])
+    for result in search:
+        identifier = result['identifier']
+        if patterns and not any(fnmatch.fnmatch(identifier, pattern) for pattern in patterns):
+            logging.debug('Skipping identifier=%r as it does not match ia_item_glob_pattern', identifier)
+            continue
+        yield identifier
+
+
+def dl_ia_uploader(uploader:str, local_path:str, rc_remote_path,
     rc_bwlimit:str=None, rc_logfile:str=None, rc_dry_run:bool=False, # RClone
-    ia_item_glob_pattern:str=None, ia_file_glob_pattern:str=None, ia_dry_run:bool=False, # InternetArchive
-    upload_every=1, ) -> None:
-    """Download all items by a given user"""
-    logging.debug('dl_ia_uploader() args={0!r}'.format(locals()))# SUPER DEBUG
-    logging.info('Attempting download for uploader={un!r}'.format(un=uploader))
-    raise NotImplementedError()# TODO
-
-    # Find everything by the uploader
-    # Exclude by glob pattern if given
-    # Process each item sequentially using its identifier
+    ia_item_glob_pattern:str=None, ia_file_glob_pattern:str=None, ia_dry_run:bool=False, ia_resuming:bool=True, # InternetArchive
+    upload_every=1, state_db:str=statestore.DEFAULT_DB_PATH, **item_kwargs) -> int:
+    """Download all items by a given user
+    Items are processed one at a time as search results arrive; Items already done are skipped when resuming.
+    ia_item_glob_pattern only process items with identifiers matching this glob pattern.
+    item_kwargs are passed on to dl_ia_item()
+    return the number of items that failed."""
+    logging.debug('dl_ia_uploader() args=%r', locals())# SUPER DEBUG
+    logging.info('Attempting download for uploader=%r', uploader)
+    store = statestore.open_store(db_path=state_db)
     c = 0
-    n_files = len(files)
-    for item in items:
+    skipped = 0
+    failed = []
+    for identifier in iter_uploader_identifiers(uploader=uploader, ia_item_glob_pattern=ia_item_glob_pattern):
         c += 1
-        logging.debug('File {cur} of {tot} : {fn!r}'.format(cur=c, tot=n_files, fn=file['name']))
-        dl_ia_item(
-            identifier,
-            local_path,
-            rc_remote_path,
-            ia_file_glob_pattern=None,
-            upload_every=1,
-            ia_dry_run=ia_dry_run,
-            rc_bwlimit=rc_bwlimit,
-            rc_logfile=rc_logfile,
-            rc_dry_run=rc_dry_run
+        if ia_resuming and (store.item_status(identifier) == statestore.ITEM_DONE):
+            logging.debug('Skipping already done identifier=%r', identifier)
+            skipped += 1
+            continue
+        logging.info('Item %s : %r', c, identifier)
+        try:
+            dl_ia_item(
+                identifier=identifier,
+                local_path=local_path,
+                rc_remote_path=rc_remote_path,
+                ia_file_glob_pattern=ia_file_glob_pattern,
+                ia_resuming=ia_resuming,
+                upload_every=upload_every,
+                state_db=state_db,
+                ia_dry_run=ia_dry_run,
+                rc_bwlimit=rc_bwlimit,
+                rc_logfile=rc_logfile,
+                rc_dry_run=rc_dry_run,
+                **item_kwargs
+            )
+        except Exception as err:# Keep going with the rest of the account.
+            logging.exception(err)
+            logging.error('Failed to process identifier=%r', identifier)
+            failed.append(identifier)
+    logging.info('Finished download for uploader=%r found=%s, skipped=%s, failed=%s', uploader, c, skipped, len(failed))
+    if failed:
+        common.appendlist(
+            lines=failed,
+            list_file_path=os.path.join('debug', 'by_uploader.failed.txt'),
+            initial_text='# List of identifiers that failed during uploader runs\n',
         )
-    logging.info('Finished download for uploader={un!r}'.format(
-        un=uploader))
-    return
+    return len(failed)
+
+
+def add_transfer_args(parser):
+    """Add the download/upload options every CLI accepts, matching dl_ia_item()'s keyword arguments and defaults."""
+    parser.add_argument('--rc_bwlimit', help='Rclone bwlimit argument, if unset will not tell rclone any bwlimit.',
+        type=str, default=None)
+    parser.add_argument('--dl_bwlimit', help='Limit downloads from InternetArchive, shared by all download threads, in rclone bwlimit syntax: e.g. "5M", or "08:00,5M 18:00,off" for 5MiB/s in office hours only. Implies --dl_stream.',
+        type=ratelimit.bwlimit_arg, default=None)
+    parser.add_argument('--rc_logfile', help='Rclone logfile argument, if unset will not tell rclone to verbosely log to a file.',
+        type=str, default=None)
+    parser.add_argument('--ia_file_glob_pattern', help='only download files matching this glob pattern',
+        type=str, default=None)
+    parser.add_argument('--upload_every', help='Upload after  every N files',
+        type=int, default=None)
+    parser.add_argument('--dl_workers', help='Download up to N files from an item at once, starting the next file as soon as one finishes. (Uploads then happen in batches of at least N files)',
+        type=int, default=1)
+    parser.add_argument('--pipeline', help='Upload in the background while downloading continues, instead of pausing downloads for each upload.',
+        default=False, action='store_true')
+    parser.add_argument('--dl_stream', help='Download with the built-in streaming downloader, which checks the md5 while downloading instead of re-reading each file afterwards.',
+        default=False, action='store_true')
+    parser.add_argument('--dl_segments', help='With --dl_stream, download big files over N connections at once. (Falls back to one connection if the server does not support ranges)',
+        type=int, default=1)
+    parser.add_argument('--dl_segment_threshold', help='Minimum filesize in bytes for --dl_segments to be used.',
+        type=int, default=ia_stream.SEGMENT_THRESHOLD)
+    parser.add_argument('--state_db', help='SQLite database used to remember progress. (Import old memory/ listfiles with statestore.py)',
+        type=str, default=statestore.DEFAULT_DB_PATH)
+    parser.add_argument('--rc_rcd', help='Upload through one long-lived "rclone rcd" instead of starting rclone for every upload.',
+        default=False, action='store_true')
+    parser.add_argument('--rc_url', help='Use an already-running rclone rc server at this URL, e.g. http://127.0.0.1:5572/ (Implies --rc_rcd)',
+        type=str, default=None)
+    parser.add_argument('--disk_budget', help='Bytes of local_path that files waiting for upload may use; downloading pauses when it is used up. Default is free space less 100MiB.',
+        type=int, default=None)
+    parser.add_argument('--meta_ttl', help='Seconds to trust cached item metadata before checking with InternetArchive whether it changed. 0 disables the cache.',
+        type=int, default=metacache.DEFAULT_TTL)
+    parser.add_argument('--rc_stream', help='Pipe each download straight into "rclone rcat" instead of staging it on local disk. --dl_workers files are streamed at once.',
+        default=False, action='store_true')
+    parser.add_argument('--rc_quarantine_path', help='Move remote copies that fail their hash check (--rc_stream) or verification (--rc_verify) under this rclone path instead of deleting them.',
+        type=str, default=None)
+    parser.add_argument('--rc_verify', help='After uploading each item, check the remote copies against the md5s InternetArchive has (One rclone listing per item) and transfer mismatches again.',
+        default=False, action='store_true')
+    parser.add_argument('--rc_reconcile', help='Before downloading each item, list the remote copies with their md5s (One rclone listing per item) and skip files that already match what InternetArchive has.',
+        default=False, action='store_true')
+    parser.add_argument('--rc_dedupe', help='Place files whose md5 is already on the same remote (From an earlier item) with a server-side rclone copy instead of downloading them.',
+        default=False, action='store_true')
+    parser.add_argument('--metrics_port', help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics',
+        type=int, default=None)
+    parser.add_argument('--metrics_file', help='Periodically write a JSON snapshot of the metrics to this file, e.g. debug/metrics.json',
+        type=str, default=None)
+    parser.add_argument('--metrics_interval', help='Seconds between --metrics_file snapshots.',
+        type=float, default=metrics.DEFAULT_SNAPSHOT_INTERVAL)
+    parser.add_argument('--rc_dry_run', help='Only simulate rclone actions.',
+        default=False, action='store_true')
+    parser.add_argument('--ia_dry_run', help='Only simulate InternetArchive actions.',
+        default=False, action='store_true')
+    return parser
+
+
+def transfer_kwargs(args) -> dict:
+    """Turn the CLI args class into dl_ia_item() keyword arguments; The options from add_transfer_args() plus local_path and rc_remote_path."""
+    return dict(
+        local_path=args.local_path,
+        rc_remote_path=args.rc_remote_path,
+        upload_every=args.upload_every,
+        dl_workers=args.dl_workers,
+        pipeline=args.pipeline,
+        dl_stream=args.dl_stream,
+        dl_segments=args.dl_segments,
+        dl_segment_threshold=args.dl_segment_threshold,
+        state_db=args.state_db,
+        rc_rcd=args.rc_rcd,
+        rc_url=args.rc_url,
+        disk_budget=args.disk_budget,
+        meta_ttl=args.meta_ttl,
+        rc_stream=args.rc_stream,
+        rc_quarantine_path=args.rc_quarantine_path,
+        rc_verify=args.rc_verify,
+        rc_reconcile=args.rc_reconcile,
+        rc_dedupe=args.rc_dedupe,
+        dl_bwlimit=args.dl_bwlimit,
+        ia_file_glob_pattern=args.ia_file_glob_pattern,
+        ia_dry_run=args.ia_dry_run,
+        rc_bwlimit=args.rc_bwlimit,
+        rc_logfile=args.rc_logfile,
+        rc_dry_run=args.rc_dry_run
+    )
 
 
 def dev() -> None:
@@ -391,7 +1472,7 @@ def main() -> None:
 
 
 if __name__ == '__main__':
-    logger = common.setup_logging(os.path.join("debug", "ia2rc.log.ts{ts}.txt"))# Setup logging
+    logger = common.setup_logging_from_argv(os.path.join("debug", "ia2rc.log.ts{ts}.txt"))# Setup logging, --log_mode etc.
     try:
         main()
     except Exception as e:# Log unhandled exceptions.
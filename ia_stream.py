@@ -0,0 +1,315 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        ia_stream
+# Purpose: Streaming downloader for InternetArchive files that hashes while downloading.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import time
+import hashlib
+import threading
+# Py3-specific stdlib
+import concurrent.futures
+# Py2-specific stdlib
+# Remote libraries
+import requests
+import requests.adapters
+# Local
+import common # General-purpose functions.
+import retrycontrol # Shared per-host backoff.
+import ratelimit # Download bandwidth limit.
+
+
+
+DL_CHUNK_SIZE = common.ONE_MEGABYTE * 4 # Bytes per write; Large chunks keep syscall and hashing overhead per byte low.
+DL_TIMEOUT = 300 # Seconds to wait for the server before giving up on a request.
+POOL_SIZE = 32 # Max pooled connections per host, should be at least the number of download workers.
+USER_AGENT = 'ia2rc (https://github.com/woodenphone/ia2rc)'
+PART_SUFFIX = '.ia2rc.part' # Appended to the filename while data is still arriving.
+SEGMENT_PART_SUFFIX = '.ia2rc.segpart' # As PART_SUFFIX, for preallocated files being filled by segmented downloads.
+SEGMENT_RETRIES = 5 # Times a single segment may fail before the whole download is abandoned.
+SEGMENT_THRESHOLD = common.ONE_HUNDRED_MEGABYTES # Default minimum filesize for segmented downloading.
+
+
+_session = None
+_session_lock = threading.Lock()
+_resume_states = {} # {tmp_filepath: (offset, hasher)} for part files interrupted during this run.
+_resume_lock = threading.Lock()
+
+
+class HashMismatch(Exception):
+    """Signals that downloaded data did not match the md5 IA has for the file"""
+    def __init__(self, url, expected_md5, local_md5):
+        self.url = url
+        self.expected_md5 = expected_md5
+        self.local_md5 = local_md5
+        super().__init__('Hash mismatch for url={u!r} expected_md5={e!r} local_md5={l!r}'.format(
+            u=url, e=expected_md5, l=local_md5))
+
+
+def get_session() -> requests.Session:
+    """Get the process-wide requests session, creating it on first use.
+    The connection pool is shared by every download thread so TCP/TLS connections get reused."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'user-agent': USER_AGENT})
+            _session = session
+        return _session
+
+
+def expected_md5(file):
+    """return the md5 IA has for a file, or None if it can't be used for verification.
+    _files.xml is expected to mismatch (Because self-hashing is very hard this file gets a hash value that does not match it)"""
+    if (file.format == 'Metadata'):
+        return None
+    return file.md5
+
+
+def _resume_point(tmp_filepath:str, size:int=None, chunk_size:int=DL_CHUNK_SIZE) -> tuple:
+    """Work out where to resume an interrupted download from.
+    Within one run the md5 state is carried forward from the failed attempt, so nothing is re-read.
+    After a restart the md5 has to catch up by reading the part file once, which is still far cheaper than re-downloading it.
+    tmp_filepath : str - path of the part file.
+    size : int - expected size of the complete file, if known.
+    return (offset, hasher)
+    """
+    with _resume_lock:
+        state = _resume_states.pop(tmp_filepath, None)
+    if not os.path.exists(tmp_filepath):
+        return (0, hashlib.md5())
+    offset = os.path.getsize(tmp_filepath)
+    if size is not None and offset > size:# Can't be part of this file.
+        logging.warning('Discarding oversized part file %r', tmp_filepath)
+        os.remove(tmp_filepath)
+        return (0, hashlib.md5())
+    if state and (state[0] == offset):
+        logging.debug('Resuming %r at offset=%r with carried md5 state', tmp_filepath, offset)
+        return state
+    logging.info('Rehashing %s bytes of existing part file %r before resuming', offset, tmp_filepath)
+    hasher = hashlib.md5()
+    with open(tmp_filepath, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            hasher.update(data)
+    return (offset, hasher)
+
+
+def download_file(file, destdir:str, chunk_size:int=DL_CHUNK_SIZE) -> str:
+    """Stream a single IA file to disk, updating the md5 as bytes arrive.
+    Data goes to a part file and is only renamed into place once the hash has been verified,
+    so a file at the final path is always complete.
+    If a part file is already there (From a failed attempt or an earlier run) the download resumes from its end
+    using an HTTP Range request. Servers that ignore Range get a fresh download.
+    file : IA.File() instance - the file to download.
+    destdir : str - path to download to.
+    return md5 hexdigest of the downloaded data.
+    Raise HashMismatch if the data does not match file.md5, or a requests exception on network trouble.
+    The part file is kept on network trouble so the next call can resume it.
+    """
+    local_filepath = os.path.join(destdir, file.name)
+    want_md5 = expected_md5(file)
+    if os.path.exists(local_filepath) and want_md5:# Same behaviour as IA library checksum=True; skip files we already have.
+        if common.get_file_md5(filepath=local_filepath) == want_md5:
+            logging.info('Already have %r, skipping download', local_filepath)
+            return want_md5
+    tmp_filepath = '{0}{1}'.format(local_filepath, PART_SUFFIX)
+    common.ensure_parent_dir_exists(filepath=tmp_filepath)
+    size = int(file.size) if file.size else None
+    offset, hasher = _resume_point(tmp_filepath=tmp_filepath, size=size, chunk_size=chunk_size)
+    headers = {}
+    if offset:# https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Range
+        headers['Range'] = 'bytes={0}-'.format(offset)
+    logging.debug('Streaming url=%r to tmp_filepath=%r from offset=%r', file.url, tmp_filepath, offset)
+    session = get_session()
+    with session.get(file.url, auth=file.auth, headers=headers, stream=True, timeout=DL_TIMEOUT) as response:
+        if offset and (response.status_code == 416) and (offset == size):# Part file already holds everything.
+            logging.debug('Nothing left to fetch for %r', tmp_filepath)
+        else:
+            if offset and (response.status_code == 416):# Part file does not fit the remote file, start over.
+                os.remove(tmp_filepath)
+            response.raise_for_status()
+            if offset and (response.status_code != 206):# Server ignored Range and is sending the whole file.
+                logging.warning('Server did not honour Range for url=%r, restarting download', file.url)
+                offset = 0
+                hasher = hashlib.md5()
+            try:
+                with open(tmp_filepath, ('ab' if offset else 'wb')) as f:
+                    for chunk in response.iter_content(chunk_size=ratelimit.chunk_size(chunk_size)):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        offset += len(chunk)
+                        ratelimit.throttle(len(chunk))
+            except BaseException:# Remember the md5 state so a retry doesn't need to re-read the part file.
+                with _resume_lock:
+                    _resume_states[tmp_filepath] = (offset, hasher)
+                raise
+    local_md5 = hasher.hexdigest()
+    if want_md5 and (local_md5 != want_md5):
+        os.remove(tmp_filepath)# Useless data.
+        raise HashMismatch(url=file.url, expected_md5=want_md5, local_md5=local_md5)
+    os.replace(tmp_filepath, local_filepath)
+    logging.debug('Streamed %r with local_md5=%r', local_filepath, local_md5)
+    return local_md5
+
+
+def pipe_file(file, sink, chunk_size:int=DL_CHUNK_SIZE) -> str:
+    """Stream a single IA file into a writable binary file object (e.g. a subprocess's stdin) instead of to disk,
+    updating the md5 as bytes arrive. Nothing can be resumed, every call starts from the first byte.
+    file : IA.File() instance - the file to download.
+    sink : file object - where the data goes; Not closed here.
+    return md5 hexdigest of the data.
+    Raise HashMismatch if the data does not match file.md5 (After all of it has been written to sink),
+    a requests exception on network trouble, or OSError if sink stops accepting data."""
+    hasher = hashlib.md5()
+    session = get_session()
+    logging.debug('Piping url=%r', file.url)
+    with session.get(file.url, auth=file.auth, stream=True, timeout=DL_TIMEOUT) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=ratelimit.chunk_size(chunk_size)):
+            sink.write(chunk)
+            hasher.update(chunk)
+            ratelimit.throttle(len(chunk))
+    local_md5 = hasher.hexdigest()
+    want_md5 = expected_md5(file)
+    if want_md5 and (local_md5 != want_md5):
+        raise HashMismatch(url=file.url, expected_md5=want_md5, local_md5=local_md5)
+    return local_md5
+
+
+def supports_ranges(url:str, size:int, auth=None) -> bool:
+    """Ask the server for the first byte of a file to see if Range requests are honoured."""
+    session = get_session()
+    with session.get(url, auth=auth, headers={'Range': 'bytes=0-0'}, stream=True, timeout=DL_TIMEOUT) as response:
+        response.raise_for_status()
+        content_range = response.headers.get('Content-Range', '')# e.g. 'bytes 0-0/12345'
+        logging.debug('Range probe for url=%r status_code=%r content_range=%r', url, response.status_code, content_range)
+        return (response.status_code == 206) and content_range.endswith('/{0}'.format(size))
+
+
+def _download_segment(url:str, auth, filepath:str, start:int, end:int, chunk_size:int=DL_CHUNK_SIZE) -> int:
+    """Fetch bytes start-end (inclusive) of url into the same position of an existing file.
+    Retry from wherever the segment got to if the connection breaks.
+    The first attempt goes ahead under the caller's own controller.wait() for the whole file;
+    If that wait made the caller the circuit's probe, waiting again here would stall every segment until the probe deadline.
+    return number of bytes written."""
+    session = get_session()
+    controller = retrycontrol.get_controller(url)
+    position = start
+    for attempt in range(1, SEGMENT_RETRIES+1):
+        if attempt > 1:
+            time.sleep(controller.backoff_delay(attempt-1))
+            controller.wait()
+        try:
+            headers = {'Range': 'bytes={0}-{1}'.format(position, end)}
+            with session.get(url, auth=auth, headers=headers, stream=True, timeout=DL_TIMEOUT) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.exceptions.HTTPError('Server stopped honouring Range for url={0!r}'.format(url), response=response)
+                with open(filepath, 'r+b') as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(chunk_size=ratelimit.chunk_size(chunk_size)):
+                        f.write(chunk)
+                        position += len(chunk)
+                        ratelimit.throttle(len(chunk))
+            if position != (end + 1):
+                raise requests.exceptions.ContentDecodingError('Short segment for url={u!r} got to {p} of {e}'.format(u=url, p=position, e=end))
+            controller.success()
+            return (end + 1 - start)
+        except requests.exceptions.RequestException as err:
+            logging.warning('Segment %s-%s of url=%r failed at position=%s attempt=%s: %r', start, end, url, position, attempt, err)
+            controller.report_error(err)
+            if attempt == SEGMENT_RETRIES:
+                raise
+    return (end + 1 - start)
+
+
+def download_file_segmented(file, destdir:str, segments:int=4, chunk_size:int=DL_CHUNK_SIZE) -> str:
+    """Download a single IA file over several connections at once, each fetching its own byte range
+    into a preallocated file.
+    The segments arrive out of order so the md5 can't be computed while downloading;
+    the whole file is hashed once at the end instead.
+    Fall back to download_file() if the server doesn't honour Range requests.
+    file : IA.File() instance - the file to download.
+    destdir : str - path to download to.
+    segments : int - number of parallel connections.
+    return md5 hexdigest of the downloaded data.
+    Raise HashMismatch if the data does not match file.md5, or a requests exception on network trouble.
+    """
+    local_filepath = os.path.join(destdir, file.name)
+    want_md5 = expected_md5(file)
+    size = int(file.size)
+    if size < segments:# Not worth splitting.
+        return download_file(file=file, destdir=destdir, chunk_size=chunk_size)
+    if os.path.exists(local_filepath) and want_md5:# Same behaviour as IA library checksum=True; skip files we already have.
+        if common.get_file_md5(filepath=local_filepath) == want_md5:
+            logging.info('Already have %r, skipping download', local_filepath)
+            return want_md5
+    if not supports_ranges(url=file.url, size=size, auth=file.auth):# Only worth asking once we know something needs fetching.
+        logging.info('Server does not support ranges for url=%r, using a single stream', file.url)
+        return download_file(file=file, destdir=destdir, chunk_size=chunk_size)
+    tmp_filepath = '{0}{1}'.format(local_filepath, SEGMENT_PART_SUFFIX)
+    common.ensure_parent_dir_exists(filepath=tmp_filepath)
+    # Preallocate so every segment can write straight into its final position.
+    with open(tmp_filepath, 'wb') as f:
+        if hasattr(os, 'posix_fallocate') and size:
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+    segment_size = -(-size // segments)# Ceiling division.
+    ranges = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    logging.debug('Downloading url=%r in ranges=%r', file.url, ranges)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges) or 1) as executor:
+            futures = [
+                executor.submit(_download_segment,
+                    url=file.url,
+                    auth=file.auth,
+                    filepath=tmp_filepath,
+                    start=start,
+                    end=end,
+                    chunk_size=chunk_size
+                )
+                for start, end in ranges
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()# Re-raise segment failures.
+    except BaseException:
+        os.remove(tmp_filepath)# Holes in unknown places, can't be resumed.
+        raise
+    local_md5 = common.get_file_md5(filepath=tmp_filepath)
+    if want_md5 and (local_md5 != want_md5):
+        os.remove(tmp_filepath)# Useless data.
+        raise HashMismatch(url=file.url, expected_md5=want_md5, local_md5=local_md5)
+    os.replace(tmp_filepath, local_filepath)
+    logging.debug('Downloaded %r in %s segments with local_md5=%r', local_filepath, len(ranges), local_md5)
+    return local_md5
+
+
+def fetch_file(file, destdir:str, segments:int=1, segment_threshold:int=SEGMENT_THRESHOLD) -> str:
+    """Download a single IA file, using several connections if it is big enough.
+    segments : int - number of connections to use for files of at least segment_threshold bytes.
+    return md5 hexdigest of the downloaded data."""
+    if (segments > 1) and file.size and (int(file.size) >= segment_threshold):
+        return download_file_segmented(file=file, destdir=destdir, segments=segments)
+    return download_file(file=file, destdir=destdir)
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        metacache
+# Purpose: On-disk cache of InternetArchive item metadata, so restarts don't refetch every item.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import json
+import time
+import zlib
+import sqlite3
+import threading
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+import internetarchive # https://github.com/jjjake/internetarchive
+# Local
+import common # General-purpose functions.
+
+
+
+DEFAULT_DB_PATH = os.path.join('memory', 'ia2rc_metadata.sqlite3')
+DEFAULT_TTL = 24 * 60 * 60 # Seconds an entry is trusted without asking IA.
+DEFAULT_MAX_BYTES = 1024 * common.ONE_MEGABYTE # Compressed metadata kept before least-recently-used entries are evicted.
+IA_CONFIG = None # Passed to internetarchive.get_session(), e.g. to point at a test server.
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS metadata (
+        identifier TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        item_last_updated INTEGER,
+        fetched REAL NOT NULL,
+        accessed REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed)',
+]
+
+
+_ia_sessions = {} # {pid: ArchiveSession}
+_caches = {} # {(pid, abspath): MetadataCache}
+_lock = threading.Lock()
+
+
+def get_ia_session():
+    """Get this process's shared internetarchive session."""
+    with _lock:
+        pid = os.getpid()
+        if pid not in _ia_sessions:
+            _ia_sessions[pid] = internetarchive.get_session(config=IA_CONFIG)
+        return _ia_sessions[pid]
+
+
+class MetadataCache():
+    """Item metadata JSON stored zlib-compressed in SQLite, with its fetch time and IA's item_last_updated stamp.
+    Entries younger than ttl are used as-is. Older ones are revalidated by asking IA for just item_last_updated,
+    and only refetched in full if the item has changed.
+    The cache is kept under max_bytes by evicting least-recently-used entries."""
+    def __init__(self, db_path:str=DEFAULT_DB_PATH, ttl:int=DEFAULT_TTL, max_bytes:int=DEFAULT_MAX_BYTES):
+        logging.debug('Opening metadata cache db_path=%r', db_path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        common.ensure_parent_dir_exists(filepath=db_path)
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+    def lookup(self, identifier:str):
+        """return (metadata, item_last_updated, fetched) for a cached item, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data, item_last_updated, fetched FROM metadata WHERE identifier=?', (identifier,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute('UPDATE metadata SET accessed=? WHERE identifier=?', (time.time(), identifier))
+        data, item_last_updated, fetched = row
+        return (json.loads(zlib.decompress(data).decode('utf8')), item_last_updated, fetched)
+
+    def store(self, identifier:str, metadata:dict) -> None:
+        """Save freshly fetched metadata, then evict old entries if over max_bytes."""
+        data = zlib.compress(json.dumps(metadata).encode('utf8'))
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    '''INSERT OR REPLACE INTO metadata (identifier, data, size, item_last_updated, fetched, accessed)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                    (identifier, data, len(data), metadata.get('item_last_updated'), now, now)
+                )
+            self.evict(keep=identifier)
+        return
+
+    def touch(self, identifier:str) -> None:
+        """Mark a cached entry as freshly validated."""
+        with self.lock:
+            with self.conn:
+                self.conn.execute('UPDATE metadata SET fetched=? WHERE identifier=?', (time.time(), identifier))
+        return
+
+    def evict(self, keep:str=None) -> None:
+        """Drop least-recently-used entries until the cache fits in max_bytes.
+        keep : str - identifier to never evict, e.g. the one just stored."""
+        with self.lock:
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = 0
+            with self.conn:
+                for identifier, size in self.conn.execute('SELECT identifier, size FROM metadata ORDER BY accessed ASC').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    if identifier == keep:
+                        continue
+                    self.conn.execute('DELETE FROM metadata WHERE identifier=?', (identifier,))
+                    total -= size
+                    evicted += 1
+            logging.debug('Evicted %s entries from metadata cache', evicted)
+        return
+
+    def get_metadata(self, identifier:str) -> dict:
+        """return item metadata, from the cache if it's fresh (Or still valid), otherwise from IA."""
+        cached = self.lookup(identifier)
+        session = get_ia_session()
+        if cached:
+            metadata, item_last_updated, fetched = cached
+            age = time.time() - fetched
+            if age < self.ttl:
+                logging.debug('Metadata cache hit for identifier=%r age=%.0fs', identifier, age)
+                return metadata
+            # Stale, ask IA if anything changed. https://archive.org/developers/md-read.html
+            url = '{0}//{1}/metadata/{2}/item_last_updated'.format(session.protocol, session.host, identifier)
+            try:
+                response = session.get(url, timeout=12)
+                response.raise_for_status()
+                remote_last_updated = response.json().get('result')
+            except Exception as err:
+                logging.warning('Could not revalidate cached metadata for identifier=%r: %r', identifier, err)
+                remote_last_updated = None
+            if (remote_last_updated is not None) and (remote_last_updated == item_last_updated):
+                logging.debug('Metadata cache revalidated for identifier=%r', identifier)
+                self.touch(identifier)
+                return metadata
+            logging.debug('Metadata cache entry outdated for identifier=%r', identifier)
+        metadata = session.get_metadata(identifier)
+        if metadata:# Don't remember items that don't exist (Yet).
+            self.store(identifier, metadata)
+        return metadata
+
+
+def open_cache(db_path:str=DEFAULT_DB_PATH, ttl:int=DEFAULT_TTL, max_bytes:int=DEFAULT_MAX_BYTES) -> MetadataCache:
+    """Get the shared MetadataCache for a db file in this process, opening it on first use."""
+    key = (os.getpid(), os.path.abspath(db_path))
+    with _lock:
+        if key not in _caches:
+            _caches[key] = MetadataCache(db_path=db_path, ttl=ttl, max_bytes=max_bytes)
+        cache = _caches[key]
+        cache.ttl = ttl
+        cache.max_bytes = max_bytes
+        return cache
+
+
+def get_item(identifier:str, db_path:str=DEFAULT_DB_PATH, ttl:int=DEFAULT_TTL, max_bytes:int=DEFAULT_MAX_BYTES):
+    """Drop-in for internetarchive.get_item() that serves metadata from the cache when possible.
+    A ttl of 0 or less bypasses the cache.
+    return internetarchive.Item instance."""
+    session = get_ia_session()
+    if ttl <= 0:
+        return session.get_item(identifier)
+    metadata = open_cache(db_path=db_path, ttl=ttl, max_bytes=max_bytes).get_metadata(identifier)
+    return session.get_item(identifier, item_metadata=metadata)
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
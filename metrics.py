@@ -0,0 +1,313 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        metrics
+# Purpose: Counters and timings for downloads, uploads and disk checks, served as Prometheus text and saved as JSON snapshots.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import json
+import time
+import glob
+import threading
+import functools
+import contextlib
+import atexit
+import multiprocessing.util
+import http.server
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+
+
+
+DEFAULT_SNAPSHOT_INTERVAL = 60 # Seconds between JSON snapshots.
+DEFAULT_SNAPSHOT_PATH = os.path.join('debug', 'metrics.json') # Used when worker processes need snapshots but no path was given.
+
+# {name: (type, help)} https://prometheus.io/docs/instrumenting/exposition_formats/
+DESCRIPTIONS = {
+    'ia2rc_download_files_total': ('counter', 'Files downloaded from InternetArchive and verified.'),
+    'ia2rc_download_bytes_total': ('counter', 'Bytes of files downloaded from InternetArchive and verified.'),
+    'ia2rc_download_retries_total': ('counter', 'Download attempts that failed and were retried.'),
+    'ia2rc_download_hash_failures_total': ('counter', 'Downloads whose md5 did not match the item metadata.'),
+    'ia2rc_download_failures_total': ('counter', 'Files that could not be downloaded at all.'),
+    'ia2rc_download_seconds': ('summary', 'Time spent downloading each file, including retries.'),
+    'ia2rc_download_in_flight': ('gauge', 'Files currently being downloaded.'),
+    'ia2rc_download_limit_bytes': ('gauge', 'Download limit in force, bytes/s; 0 for unlimited.'),
+    'ia2rc_download_throttled_seconds_total': ('counter', 'Time downloads spent paused to stay within the download limit.'),
+    'ia2rc_upload_files_total': ('counter', 'Files moved to the remote by rclone.'),
+    'ia2rc_upload_bytes_total': ('counter', 'Bytes of files moved to the remote by rclone.'),
+    'ia2rc_upload_failures_total': ('counter', 'rclone moves that failed.'),
+    'ia2rc_upload_seconds': ('summary', 'Time spent waiting on each rclone move.'),
+    'ia2rc_upload_in_flight': ('gauge', 'rclone moves currently running.'),
+    'ia2rc_upload_queue_depth': ('gauge', 'Batches waiting for the pipelined uploader.'),
+    'ia2rc_upload_speed_bytes': ('gauge', 'Transfer speed rclone last reported, bytes/s.'),
+    'ia2rc_verify_files_total': ('counter', 'Remote copies checked against InternetArchive sizes and md5s.'),
+    'ia2rc_verify_failures_total': ('counter', 'Remote copies that were missing or did not match.'),
+    'ia2rc_reconcile_files_total': ('counter', 'Files skipped because a matching copy was already on the remote.'),
+    'ia2rc_reconcile_bytes_total': ('counter', 'Bytes not downloaded because a matching copy was already on the remote.'),
+    'ia2rc_dedupe_files_total': ('counter', 'Files placed by a server-side copy of identical content already on the remote.'),
+    'ia2rc_dedupe_bytes_saved_total': ('counter', 'Bytes not downloaded or uploaded thanks to server-side copies.'),
+    'ia2rc_disk_checks_total': ('counter', 'Free disk space checks.'),
+    'ia2rc_disk_check_failures_total': ('counter', 'Free disk space checks that found too little space.'),
+    'ia2rc_disk_free_bytes': ('gauge', 'Free disk space at the last check.'),
+    'ia2rc_disk_reserved_bytes': ('gauge', 'Disk space reserved for files waiting to be uploaded.'),
+    'ia2rc_disk_wait_seconds': ('summary', 'Time spent waiting for disk space to be released.'),
+    'ia2rc_backoff_seconds': ('summary', 'Time requests were held back by the shared per-host retry controller.'),
+    'ia2rc_throttled_total': ('counter', 'Responses where a server asked us to slow down (429/503/Retry-After).'),
+    'ia2rc_circuit_opens_total': ('counter', 'Times a host circuit breaker opened after repeated failures.'),
+}
+
+
+class Registry():
+    """Thread-safe in-memory store of metric values for this process.
+    Each series is keyed by its name and a sorted tuple of (label, value) pairs."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {} # {(name, labels): value}
+        self.gauges = {} # {(name, labels): value}
+        self.summaries = {} # {(name, labels): [count, sum]}
+
+    def inc(self, name:str, value=1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name:str, value, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def add_gauge(self, name:str, value, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name:str, value, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+
+    def samples(self) -> list:
+        """return [(name, labels_dict, value), ...] for every series, summaries split into _count and _sum."""
+        with self.lock:
+            samples = []
+            for (name, labels), value in self.counters.items():
+                samples.append((name, dict(labels), value))
+            for (name, labels), value in self.gauges.items():
+                samples.append((name, dict(labels), value))
+            for (name, labels), (count, total) in self.summaries.items():
+                samples.append(('{0}_count'.format(name), dict(labels), count))
+                samples.append(('{0}_sum'.format(name), dict(labels), total))
+        return samples
+
+
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+add_gauge = REGISTRY.add_gauge
+observe = REGISTRY.observe
+
+
+@contextlib.contextmanager
+def track(name:str, **labels):
+    """Count a block as in flight while it runs, then record its duration in <name>_seconds
+    and count it in <name>_failures_total if it raises."""
+    add_gauge('{0}_in_flight'.format(name), 1, **labels)
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        inc('{0}_failures_total'.format(name), **labels)
+        raise
+    finally:
+        observe('{0}_seconds'.format(name), time.monotonic() - start, **labels)
+        add_gauge('{0}_in_flight'.format(name), -1, **labels)
+
+
+def tracked(name:str):
+    """Decorator form of track()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot() -> dict:
+    """return this process's metrics as a JSON-serialisable dict."""
+    return {
+        'time': time.time(),
+        'pid': os.getpid(),
+        'samples': [{'name': name, 'labels': labels, 'value': value} for name, labels, value in REGISTRY.samples()],
+    }
+
+
+def write_snapshot(snapshot_path:str) -> None:
+    """Atomically write a JSON snapshot of this process's metrics."""
+    parent = os.path.dirname(snapshot_path)
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent, exist_ok=True)
+    tmp_path = '{0}.tmp{1}'.format(snapshot_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot(), f, indent=1)
+    os.replace(tmp_path, snapshot_path)
+    return
+
+
+def worker_snapshot_path(snapshot_path:str, pid:int=None) -> str:
+    """Per-process snapshot path for worker processes, e.g. debug/metrics.json -> debug/metrics.pid123.json"""
+    root, ext = os.path.splitext(snapshot_path)
+    return '{r}.pid{p}{e}'.format(r=root, p=(pid or os.getpid()), e=ext)
+
+
+def _worker_samples(snapshot_path:str) -> list:
+    """Read the latest snapshots written by worker processes, labelling each series with the worker's pid."""
+    samples = []
+    root, ext = os.path.splitext(snapshot_path)
+    for path in glob.glob('{r}.pid*{e}'.format(r=glob.escape(root), e=ext)):
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):# Being replaced right now, next scrape will get it.
+            continue
+        for sample in data.get('samples', []):
+            labels = dict(sample['labels'])
+            labels['pid'] = str(data.get('pid'))
+            samples.append((sample['name'], labels, sample['value']))
+    return samples
+
+
+def _base_name(name:str) -> str:
+    for suffix in ('_count', '_sum'):
+        if name.endswith(suffix) and (name[:-len(suffix)] in DESCRIPTIONS):
+            return name[:-len(suffix)]
+    return name
+
+
+def _format_labels(labels:dict) -> str:
+    if not labels:
+        return ''
+    escaped = ('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+
+def render(snapshot_path:str=None) -> str:
+    """return metrics in the Prometheus text exposition format.
+    snapshot_path : str - also include series from worker processes' snapshots next to this path."""
+    samples = REGISTRY.samples()
+    if snapshot_path:
+        samples.extend(_worker_samples(snapshot_path))
+    by_base = {}
+    for name, labels, value in samples:
+        by_base.setdefault(_base_name(name), []).append((name, labels, value))
+    lines = []
+    for base in sorted(by_base):
+        if base in DESCRIPTIONS:
+            metric_type, help_text = DESCRIPTIONS[base]
+            lines.append('# HELP {0} {1}'.format(base, help_text))
+            lines.append('# TYPE {0} {1}'.format(base, metric_type))
+        for name, labels, value in sorted(by_base[base], key=lambda s: (s[0], sorted(s[1].items()))):
+            lines.append('{n}{l} {v}'.format(n=name, l=_format_labels(labels), v=value))
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    snapshot_path = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render(snapshot_path=self.snapshot_path).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):# Scrapes would otherwise go to stderr.
+        logging.debug('metrics request: %s', format % args)
+
+
+def start_http_server(port:int, addr:str='127.0.0.1', snapshot_path:str=None) -> http.server.HTTPServer:
+    """Serve /metrics in a daemon thread."""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'snapshot_path': snapshot_path})
+    server = http.server.ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='ia2rc-metrics-http', daemon=True)
+    thread.start()
+    logging.info('Serving metrics on http://%s:%s/metrics', addr, server.server_address[1])
+    return server
+
+
+def start_snapshots(snapshot_path:str, interval:float=DEFAULT_SNAPSHOT_INTERVAL) -> threading.Thread:
+    """Write a JSON snapshot every interval seconds in a daemon thread, and once more at exit."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(snapshot_path)
+            except OSError as err:
+                logging.warning('Could not write metrics snapshot: %r', err)
+    thread = threading.Thread(target=loop, name='ia2rc-metrics-snapshot', daemon=True)
+    thread.start()
+    atexit.register(write_snapshot, snapshot_path)
+    return thread
+
+
+_started = set() # pids that already called start()
+_started_lock = threading.Lock()
+
+
+def start(metrics_port:int=None, metrics_file:str=None, metrics_interval:float=DEFAULT_SNAPSHOT_INTERVAL) -> None:
+    """Start whichever exporters were asked for; Does nothing if neither is, or if already started in this process."""
+    if (metrics_port is None) and (not metrics_file):
+        return
+    with _started_lock:
+        if os.getpid() in _started:
+            return
+        _started.add(os.getpid())
+    if metrics_file:
+        for old_path in glob.glob(worker_snapshot_path(glob.escape(metrics_file), pid='*')):# Left by an earlier run's workers.
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        start_snapshots(snapshot_path=metrics_file, interval=metrics_interval)
+    if metrics_port is not None:
+        start_http_server(port=metrics_port, snapshot_path=metrics_file)
+    return
+
+
+def start_worker(metrics_file:str=None, metrics_interval:float=DEFAULT_SNAPSHOT_INTERVAL) -> None:
+    """Start snapshots for a worker process, next to the parent's snapshot so the parent can include them."""
+    if not metrics_file:
+        return
+    with _started_lock:
+        if os.getpid() in _started:
+            return
+        _started.add(os.getpid())
+    snapshot_path = worker_snapshot_path(metrics_file)
+    start_snapshots(snapshot_path=snapshot_path, interval=metrics_interval)
+    multiprocessing.util.Finalize(None, write_snapshot, args=(snapshot_path,), exitpriority=10)# Process pool workers skip atexit handlers.
+    return
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,7 @@ import time
 import glob
 import subprocess
 # Py3-specific stdlib
+import concurrent.futures
 # Py2-specific stdlib
 # Remote libraries
 import internetarchive # https://github.com/jjjake/internetarchive
@@ -26,35 +27,325 @@ import psutil
 # Local
 import ia2rc
 import common # General-purpose functions.
+import metrics # Instrumentation.
+import planner # Sizing and ordering items up front.
+import workqueue # Work shared between hosts.
+import ratelimit # Download bandwidth limit.
 
 
 
-def from_listfile(args):
-    list_path = args.list_path
-    logging.info('Processing listfile from list_path={0!r}'.format(list_path))
+def read_identifiers(list_path:str):
+    """Yield identifiers from a listfile one at a time, skipping comments and blank lines."""
     with open(list_path, 'r') as f:
         line_counter = 0
         for raw_line in f:
             line_counter += 1
             if raw_line[0] in ['#', '\n', '\r']:# Skip empty lines and comments
                 continue
-            logging.debug('line_counter={0!r}, raw_line={1!r}'.format(line_counter, raw_line))
+            logging.debug('line_counter=%r, raw_line=%r', line_counter, raw_line)
             cleaned_line = raw_line.strip()
-            ia2rc.dl_ia_item(
-                identifier=cleaned_line,
-                local_path=args.local_path,
-                rc_remote_path=args.rc_remote_path,
-                upload_every=args.upload_every,
-                ia_file_glob_pattern=args.ia_file_glob_pattern,
-                ia_dry_run=args.ia_dry_run,
-                rc_bwlimit=args.rc_bwlimit,
-                rc_logfile=args.rc_logfile,
-                rc_dry_run=args.rc_dry_run
-            )
-    logging.info('Finished saving items from list.')
+            yield cleaned_line
+
+
+def dl_item_worker(identifier:str, kwargs:dict, metrics_file:str=None, metrics_interval:float=metrics.DEFAULT_SNAPSHOT_INTERVAL) -> tuple:
+    """Process pool entry point; Download one item into its own staging dir.
+    metrics_file : str - the parent's metrics snapshot path; this worker writes its own snapshot beside it.
+    return (identifier, error) where error is None on success or a repr of the exception."""
+    metrics.start_worker(metrics_file=metrics_file, metrics_interval=metrics_interval)
+    try:
+        ia2rc.dl_ia_item(identifier=identifier, **kwargs)
+    except Exception as err:# Keep going with other items, the parent collects failures.
+        logging.exception(err)
+        logging.error('Failed to process identifier=%r', identifier)
+        return (identifier, repr(err))
+    try:# Tidy up the now-empty per-item staging dir so big lists don't leave thousands behind.
+        os.rmdir(kwargs['local_path'])
+    except OSError:
+        pass
+    return (identifier, None)
+
+
+def from_listfile_parallel(args, identifiers) -> int:
+    """Process several items at once, each in its own process and staging dir.
+    return the number of items that failed."""
+    list_path = args.list_path
+    item_workers = args.item_workers
+    logging.info('Processing listfile from list_path=%r with item_workers=%r', list_path, item_workers)
+    base_kwargs = ia2rc.transfer_kwargs(args)
+    if base_kwargs['disk_budget'] is None:# Split the disk between the workers so they can't overcommit it together.
+        base_kwargs['disk_budget'] = staging_capacity(args) // item_workers
+        logging.info('Each item worker gets disk_budget=%r', base_kwargs['disk_budget'])
+    base_kwargs['dl_bwlimit'] = ratelimit.split_schedule(args.dl_bwlimit, item_workers)# Workers together stay within it.
+    done = []
+    failed = []
+    pending = {} # {future: identifier}
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=item_workers)
+    try:
+        for identifier in identifiers:
+            kwargs = dict(base_kwargs)
+            kwargs['local_path'] = os.path.join(args.local_path, identifier)# Isolated staging so rclone never moves another item's files.
+            try:
+                future = executor.submit(dl_item_worker, identifier, kwargs, args.metrics_file, args.metrics_interval)
+            except concurrent.futures.process.BrokenProcessPool:# A worker process died, taking the pool with it.
+                executor = restart_executor(executor, item_workers)
+                finished, unfinished = concurrent.futures.wait(pending)# Already failed along with the pool.
+                collect_results(finished, pending, done, failed)
+                future = executor.submit(dl_item_worker, identifier, kwargs, args.metrics_file, args.metrics_interval)
+            pending[future] = identifier
+            if len(pending) >= (item_workers * 2):# Don't queue the whole list up at once.
+                finished, unfinished = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect_results(finished, pending, done, failed)
+        finished, unfinished = concurrent.futures.wait(pending)
+        collect_results(finished, pending, done, failed)
+    finally:
+        executor.shutdown()
+    report_results(done, failed)
+    return len(failed)
+
+
+def from_listfile_binpack(args, plans:list, capacity:int) -> int:
+    """Process several items at once like from_listfile_parallel(), choosing which run side by side so their staging disk needs fit capacity together.
+    Each item gets the staging_bytes its plan says it needs as its disk_budget. (See planner.BinpackScheduler)
+    return the number of items that failed."""
+    item_workers = args.item_workers
+    logging.info('Processing listfile from list_path=%r with item_workers=%r, binpacking items into capacity=%r',
+        args.list_path, item_workers, capacity)
+    base_kwargs = ia2rc.transfer_kwargs(args)
+    base_kwargs['dl_bwlimit'] = ratelimit.split_schedule(args.dl_bwlimit, item_workers)# Workers together stay within it.
+    scheduler = planner.BinpackScheduler(plans, capacity=capacity)
+    done = []
+    failed = []
+    pending = {} # {future: identifier}
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=item_workers)
+    try:
+        while True:
+            while len(pending) < item_workers:
+                started = scheduler.next()
+                if started is None:
+                    break
+                plan, disk_budget = started
+                identifier = plan['identifier']
+                kwargs = dict(base_kwargs, disk_budget=disk_budget)
+                kwargs['local_path'] = os.path.join(args.local_path, identifier)# Isolated staging so rclone never moves another item's files.
+                logging.info('Starting identifier=%r with disk_budget=%r, %r of capacity=%r in use', identifier, disk_budget, scheduler.in_use, capacity)
+                try:
+                    future = executor.submit(dl_item_worker, identifier, kwargs, args.metrics_file, args.metrics_interval)
+                except concurrent.futures.process.BrokenProcessPool:# A worker process died, taking the pool with it.
+                    executor = restart_executor(executor, item_workers)
+                    for lost_identifier in pending.values():# Already failed along with the pool.
+                        scheduler.finish(lost_identifier)
+                    finished, unfinished = concurrent.futures.wait(pending)
+                    collect_results(finished, pending, done, failed)
+                    future = executor.submit(dl_item_worker, identifier, kwargs, args.metrics_file, args.metrics_interval)
+                pending[future] = identifier
+            if not pending:
+                break # Nothing left waiting.
+            finished, unfinished = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                scheduler.finish(pending[future])
+            collect_results(finished, pending, done, failed)
+    finally:
+        executor.shutdown()
+    report_results(done, failed)
+    return len(failed)
+
+
+def report_results(done:list, failed:list) -> None:
+    """Log how a parallel run went and add failed identifiers to debug/multi_by_identifier.failed.txt"""
+    logging.info('Finished saving items from list. done=%s, failed=%s', len(done), len(failed))
+    for identifier, error in failed:
+        logging.error('Failed identifier=%r error=%s', identifier, error)
+    if failed:
+        common.appendlist(
+            lines=[identifier for identifier, error in failed],
+            list_file_path=os.path.join('debug', 'multi_by_identifier.failed.txt'),
+            initial_text='# List of identifiers that failed during parallel runs\n',
+        )
+    return
+
+
+def from_queue(args, identifiers) -> int:
+    """Work through the shared queue at --queue_db alongside workers on other hosts, item_workers items at a time.
+    identifiers are added to the queue first (Ones already queued are left alone), so every host can be given the same list.
+    Items are claimed with leases kept alive by a heartbeat; Items whose worker died are requeued by whoever claims next.
+    Keeps going until nothing is pending or leased anywhere.
+    return the number of items that ran out of attempts here."""
+    queue = workqueue.WorkQueue(db_path=args.queue_db, lease_seconds=args.queue_lease, max_attempts=args.queue_max_attempts)
+    queue.add(identifiers)
+    owner = workqueue.default_owner()
+    item_workers = max(1, args.item_workers)
+    poll_interval = min(60.0, args.queue_lease / 4) # While waiting on other hosts' leases.
+    logging.info('Working through queue_db=%r as owner=%r with item_workers=%r', args.queue_db, owner, item_workers)
+    base_kwargs = ia2rc.transfer_kwargs(args)
+    if base_kwargs['disk_budget'] is None:# Split the disk between the workers so they can't overcommit it together.
+        base_kwargs['disk_budget'] = staging_capacity(args) // item_workers
+    base_kwargs['dl_bwlimit'] = ratelimit.split_schedule(args.dl_bwlimit, item_workers)# Workers together stay within it.
+    heartbeat = workqueue.Heartbeat(queue=queue, owner=owner)
+    done = []
+    failed = []
+    lost = [] # Items whose lease ran out while they were being worked on here; Another worker owns them now.
+    pending = {} # {future: identifier}
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=item_workers)
+    try:
+        while True:
+            while len(pending) < item_workers:
+                identifier = queue.claim(owner=owner)
+                if identifier is None:
+                    break
+                heartbeat.add(identifier)
+                kwargs = dict(base_kwargs)
+                kwargs['local_path'] = os.path.join(args.local_path, identifier)# Isolated staging so rclone never moves another item's files.
+                try:
+                    future = executor.submit(dl_item_worker, identifier, kwargs, args.metrics_file, args.metrics_interval)
+                except concurrent.futures.process.BrokenProcessPool:# A worker process died, taking the pool with it.
+                    executor = restart_executor(executor, item_workers)# Items still pending on the old pool fail below and are requeued.
+                    future = executor.submit(dl_item_worker, identifier, kwargs, args.metrics_file, args.metrics_interval)
+                pending[future] = identifier
+            if not pending:
+                counts = queue.counts()
+                if not counts[workqueue.LEASED]:
+                    break # Nothing left anywhere.
+                logging.info('Nothing to claim, waiting on %s items leased by other workers', counts[workqueue.LEASED])
+                time.sleep(poll_interval)
+                continue
+            finished, unfinished = concurrent.futures.wait(pending, timeout=poll_interval, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in unfinished:
+                identifier = pending[future]
+                if heartbeat.is_lost(identifier) and (identifier not in lost):
+                    lost.append(identifier)
+                    if future.cancel():
+                        logging.warning('Lost the lease on identifier=%r before starting it, dropped it', identifier)
+                    else:# Can't stop a running worker process; Its result just won't be reported.
+                        logging.warning('Lost the lease on identifier=%r while working on it, another worker may be processing it too', identifier)
+            for future in finished:
+                identifier = pending.pop(future)
+                was_lost = heartbeat.is_lost(identifier)
+                heartbeat.remove(identifier)
+                if future.cancelled():
+                    continue
+                try:
+                    identifier, error = future.result()
+                except Exception as err:# Worker process itself died.
+                    logging.exception(err)
+                    error = repr(err)
+                status = None if was_lost else queue.finish(identifier, owner=owner, error=error)
+                if status is None:# Not ours any more, whoever holds the lease now reports it.
+                    if identifier not in lost:
+                        lost.append(identifier)
+                    logging.warning('Not reporting identifier=%r error=%s, its lease was lost', identifier, error)
+                elif error is None:
+                    done.append(identifier)
+                elif status == workqueue.FAILED:# Out of attempts.
+                    failed.append((identifier, error))
+                    logging.error('Failed identifier=%r error=%s', identifier, error)
+                else:
+                    logging.warning('Failed identifier=%r error=%s, queue status now %r', identifier, error, status)
+            if finished:
+                logging.info('Progress: done=%s, failed=%s, lost=%s, queue=%r', len(done), len(failed), len(lost), queue.counts())
+    finally:
+        executor.shutdown()
+        heartbeat.stop()
+    logging.info('Finished working through queue. done=%s, failed=%s, lost=%s, queue=%r', len(done), len(failed), len(lost), queue.counts())
+    if failed:
+        common.appendlist(
+            lines=[identifier for identifier, error in failed],
+            list_file_path=os.path.join('debug', 'multi_by_identifier.failed.txt'),
+            initial_text='# List of identifiers that failed during queue runs\n',
+        )
+    return len(failed)
+
+
+def collect_results(finished, pending:dict, done:list, failed:list) -> None:
+    """Sort finished dl_item_worker futures into done and failed lists, removing them from pending. ({future: identifier})"""
+    for future in finished:
+        identifier = pending.pop(future)
+        try:
+            identifier, error = future.result()
+        except Exception as err:# Worker process itself died.
+            logging.exception(err)
+            error = repr(err)
+        if error is None:
+            done.append(identifier)
+        else:
+            failed.append((identifier, error))
+    logging.info('Progress: done=%s, failed=%s', len(done), len(failed))
     return
 
 
+def restart_executor(executor, item_workers:int):
+    """Replace a process pool that broke because one of its workers died (Killed for memory, crashed...), so the run can carry on.
+    return the new pool."""
+    logging.error('An item worker process died, restarting the process pool')
+    executor.shutdown(wait=False)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=item_workers)
+
+
+def staging_capacity(args) -> int:
+    """Bytes of local_path the whole run may use: --disk_budget, or the free space less 100MiB."""
+    if args.disk_budget is not None:
+        return args.disk_budget
+    common.ensure_dir_exists(dir_path=args.local_path)
+    return psutil.disk_usage(args.local_path).free - common.ONE_HUNDRED_MEGABYTES
+
+
+def plan_listfile(args) -> list:
+    """Fetch metadata for every item in the listfile, write the plan manifest and return the plans in --order order."""
+    capacity = staging_capacity(args)
+    if (args.disk_budget is None) and (args.item_workers > 1) and (args.order != 'binpack'):# Each item gets its share, as in from_listfile_parallel().
+        capacity //= args.item_workers
+    plans = planner.plan_items(
+        read_identifiers(args.list_path),
+        plan_workers=args.plan_workers,
+        ia_file_glob_pattern=args.ia_file_glob_pattern,
+        upload_every=args.upload_every,
+        dl_workers=args.dl_workers,
+        pipeline=args.pipeline,
+        meta_ttl=args.meta_ttl,
+        rc_stream=args.rc_stream,
+    )
+    plans = planner.order_plans(plans, order=args.order)
+    summary = planner.summarize(plans, bandwidth=args.plan_bandwidth)
+    summary['staging_capacity_bytes'] = capacity # Per item, or shared by the items running at once with binpack.
+    planner.log_summary(summary, capacity=capacity)
+    params = {'list_path': args.list_path, 'order': args.order, 'ia_file_glob_pattern': args.ia_file_glob_pattern,
+        'upload_every': args.upload_every, 'dl_workers': args.dl_workers, 'item_workers': args.item_workers}
+    planner.write_manifest(manifest_path=args.plan_file, plans=plans, summary=summary, params=params)
+    return plans
+
+
+def from_listfile(args) -> int:
+    if (args.metrics_port is not None) and (not args.metrics_file) and ((args.item_workers > 1) or args.queue_db):
+        # Counters live in the worker processes, the endpoint only sees them through their snapshots.
+        args.metrics_file = metrics.DEFAULT_SNAPSHOT_PATH
+        logging.info('Worker processes report metrics through snapshots, using metrics_file=%r', args.metrics_file)
+    metrics.start(metrics_port=args.metrics_port, metrics_file=args.metrics_file, metrics_interval=args.metrics_interval)
+    plans = None
+    if args.plan or (args.order != 'listfile'):
+        plans = plan_listfile(args)
+        if args.plan:# Dry run, just the manifest.
+            return len([p for p in plans if p['error']])
+        identifiers = [p['identifier'] for p in plans]
+    else:
+        identifiers = read_identifiers(args.list_path)
+    if args.queue_db:
+        if args.order == 'binpack':
+            logging.warning('With --queue_db, binpack only sets the order items are queued in')
+        return from_queue(args, identifiers)
+    if args.item_workers > 1:
+        if args.order == 'binpack':
+            return from_listfile_binpack(args, plans, capacity=staging_capacity(args))
+        return from_listfile_parallel(args, identifiers)
+    list_path = args.list_path
+    logging.info('Processing listfile from list_path=%r', list_path)
+    for identifier in identifiers:
+        ia2rc.dl_ia_item(
+            identifier=identifier,
+            **ia2rc.transfer_kwargs(args)
+        )
+    logging.info('Finished saving items from list.')
+    return 0
+
+
 def command_line():
     # Handle command line args
     parser = argparse.ArgumentParser()
@@ -63,38 +354,48 @@ def command_line():
         type=str)
     parser.add_argument('local_path', help='path to store things temporarily. (Normal format) (Used by script & fed into rclone so dont be too clever.)',
         type=str)
-    parser.add_argument('rc_remote_path', help='path for rclone to push to. (Rclone format)',
-        type=str)
+    parser.add_argument('rc_remote_path', help='path for rclone to push to. (Rclone format) Give several to download once and send every file to each of them.',
+        type=str, nargs='+')
     # 'multi_by_identifier' command optional args
-    # Common optional args
-    parser.add_argument('--rc_bwlimit', help='Rclone bwlimit argument, if unset will not tell rclone any bwlimit.',
-        type=str, default=None)
-    parser.add_argument('--rc_logfile', help='Rclone logfile argument, if unset will not tell rclone to verbosely log to a file.',
-        type=str, default=None)
-    parser.add_argument('--ia_file_glob_pattern', help='only download files matching this glob pattern',
-        type=str, default=None)
-    parser.add_argument('--upload_every', help='Upload after  every N files',
-        type=int, default=None)
-    parser.add_argument('--rc_dry_run', help='Only simulate rclone actions.',
-        default=False, action='store_true')
-    parser.add_argument('--ia_dry_run', help='Only simulate InternetArchive actions.',
+    parser.add_argument('--item_workers', help='Process up to N items at once, each in its own process and in its own subdir of local_path.',
+        type=int, default=1)
+    parser.add_argument('--plan', help='Only fetch metadata for every item and write a plan manifest (Sizes, file counts, staging disk needed, --order) to --plan_file. Nothing is downloaded.',
         default=False, action='store_true')
+    parser.add_argument('--order', help='Order to process items in: as listed, largest or smallest total size first, or binpack to run --item_workers items side by side only when their staging disk needs fit --disk_budget (Or the free space) together. Anything but listfile plans first.',
+        choices=planner.ORDERS, default='listfile')
+    parser.add_argument('--plan_file', help='Where to write the plan manifest.',
+        type=str, default=planner.DEFAULT_PLAN_PATH)
+    parser.add_argument('--plan_workers', help='Fetch metadata for up to N items at once while planning.',
+        type=int, default=planner.DEFAULT_PLAN_WORKERS)
+    parser.add_argument('--plan_bandwidth', help='Expected download bytes/s, for the plan to estimate how long the run will take.',
+        type=int, default=None)
+    parser.add_argument('--queue_db', help='Share the work with other hosts through a queue in this SQLite file on storage they can all reach. Every host adds list_path to it and claims items from it.',
+        type=str, default=None)
+    parser.add_argument('--queue_lease', help='With --queue_db, seconds a worker may go silent before its items are given to someone else.',
+        type=float, default=workqueue.DEFAULT_LEASE_SECONDS)
+    parser.add_argument('--queue_max_attempts', help='With --queue_db, times an item is tried (On any host) before it counts as failed.',
+        type=int, default=workqueue.DEFAULT_MAX_ATTEMPTS)
+    # Common optional args
+    ia2rc.add_transfer_args(parser)
     parser.set_defaults(func=from_listfile)
+    common.add_logging_args(parser)# Consumed by setup_logging_from_argv()
     args = parser.parse_args()
     logging.debug('args={args!r}'.format(args=args))# Record CLI arguments
-    args.func(args)
+    exit_status = args.func(args)
     logging.info('Finished command-line invocation')
-    return
+    return exit_status
 
 
 def main():
-    command_line()
+    return command_line()
 
 if __name__ == '__main__':
-    logger = common.setup_logging(os.path.join("debug", "multi_by_identifier.log.ts{ts}.txt"))# Setup logging
+    logger = common.setup_logging_from_argv(os.path.join("debug", "multi_by_identifier.log.ts{ts}.txt"))# Setup logging, --log_mode etc.
+    exit_status = 1
     try:
-        main()
+        exit_status = main()
     except Exception as e:# Log unhandled exceptions.
         logging.critical("Unhandled exception!")
         logging.exception(e)
-    logging.info('Finshed. sys.argv={0}'.format(sys.argv))
\ No newline at end of file
+    logging.info('Finshed. sys.argv={0}'.format(sys.argv))
+    sys.exit(1 if exit_status else 0)
\ No newline at end of file
@@ -0,0 +1,192 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        planner
+# Purpose: Size up a list of items before downloading them, and pick the order to process them in.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import json
+import time
+# Py3-specific stdlib
+import concurrent.futures
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import common # General-purpose functions.
+import metacache # Cached item metadata.
+
+
+
+DEFAULT_PLAN_WORKERS = 8 # Metadata requests in flight at once while planning.
+DEFAULT_PLAN_PATH = os.path.join('debug', 'plan.json')
+ORDERS = ('listfile', 'largest', 'smallest', 'binpack')
+
+
+def plan_item(identifier:str, ia_file_glob_pattern:str=None, upload_every:int=1, dl_workers:int=1,
+    pipeline:bool=False, pipeline_queue_size:int=2, rc_stream:bool=False, meta_ttl:int=metacache.DEFAULT_TTL,
+    meta_cache_db:str=metacache.DEFAULT_DB_PATH) -> dict:
+    """Size up one item the same way dl_ia_item() would select its files.
+    return dict with files_count, total_bytes, largest_file, largest_file_bytes and staging_bytes,
+    the most of local_path the item should need at once given how often it is uploaded.
+    error is set instead if the item could not be looked at."""
+    plan = {'identifier': identifier, 'files_count': 0, 'total_bytes': 0, 'largest_file': None,
+        'largest_file_bytes': 0, 'staging_bytes': 0, 'error': None}
+    try:
+        item = metacache.get_item(identifier, db_path=meta_cache_db, ttl=meta_ttl)
+        if not item.item_metadata:
+            plan['error'] = 'Item does not exist'
+            return plan
+        sizes = []
+        for file in item.get_files(glob_pattern=ia_file_glob_pattern, on_the_fly=False):
+            filesize = int(file.size) if file.size else 0
+            sizes.append(filesize)
+            if filesize >= plan['largest_file_bytes']:
+                plan['largest_file'] = file.name
+                plan['largest_file_bytes'] = filesize
+    except Exception as err:# One bad item shouldn't spoil the plan.
+        logging.exception(err)
+        plan['error'] = repr(err)
+        return plan
+    plan['files_count'] = len(sizes)
+    plan['total_bytes'] = sum(sizes)
+    # Files sit on disk until their batch is uploaded; With pipeline more batches can wait behind the upload.
+    if rc_stream:# Nothing touches local disk.
+        plan['staging_bytes'] = 0
+    elif upload_every:
+        batch_size = max(upload_every, dl_workers)
+        if pipeline:
+            batch_size *= (1 + pipeline_queue_size)
+        batch_size += dl_workers - 1 # Downloads carry on while a batch is uploaded.
+        plan['staging_bytes'] = sum(sorted(sizes, reverse=True)[:batch_size])
+    else:
+        plan['staging_bytes'] = plan['total_bytes']
+    return plan
+
+
+def plan_items(identifiers, plan_workers:int=DEFAULT_PLAN_WORKERS, **plan_kwargs) -> list:
+    """plan_item() for every identifier, fetching metadata plan_workers at a time.
+    return list of plans in the same order as identifiers."""
+    identifiers = list(identifiers)
+    logging.info('Planning %s items with plan_workers=%r', len(identifiers), plan_workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, plan_workers)) as executor:
+        futures = [executor.submit(plan_item, identifier, **plan_kwargs) for identifier in identifiers]
+        plans = []
+        for c, future in enumerate(futures, start=1):
+            plans.append(future.result())
+            if (c % 100 == 0):
+                logging.info('Planned %s of %s items', c, len(futures))
+    return plans
+
+
+def order_plans(plans:list, order:str='listfile') -> list:
+    """Sort plans into the order items should be processed in. Items that could not be planned go last.
+    order : str - 'listfile' keeps the listfile order, 'largest' / 'smallest' go by total_bytes,
+        'binpack' goes by staging_bytes, largest first, the order BinpackScheduler tries them in."""
+    good = [p for p in plans if not p['error']]
+    bad = [p for p in plans if p['error']]
+    if order == 'listfile':
+        pass
+    elif order == 'largest':
+        good.sort(key=lambda p: p['total_bytes'], reverse=True)
+    elif order == 'smallest':
+        good.sort(key=lambda p: p['total_bytes'])
+    elif order == 'binpack':
+        good.sort(key=lambda p: p['staging_bytes'], reverse=True)
+    else:
+        raise ValueError('Unknown order {0!r}'.format(order))
+    return good + bad
+
+
+class BinpackScheduler():
+    """Pick which items run side by side so their staging disk needs fit in capacity bytes together.
+    Each running item holds its staging_bytes of the capacity, which is also the disk_budget it is given.
+    next() hands out the largest waiting item that fits in what is left (First-fit decreasing, as items finish);
+    An item that needs more than the whole capacity, or could not be planned, runs with the whole capacity once nothing else is running.
+    Not thread-safe; Meant for the one loop that starts item workers."""
+    def __init__(self, plans:list, capacity:int):
+        self.capacity = int(capacity)
+        self.waiting = order_plans(plans, order='binpack')
+        self.running = {} # {identifier: bytes held}
+        self.in_use = 0
+        for plan in self.waiting:
+            if (not plan['error']) and (plan['staging_bytes'] > self.capacity):
+                logging.warning('identifier=%r needs staging_bytes=%r, more than capacity=%r, it will run on its own',
+                    plan['identifier'], plan['staging_bytes'], self.capacity)
+
+    def need(self, plan:dict) -> int:
+        """Bytes of the capacity an item holds while it runs."""
+        if plan['error']:# Size unknown.
+            return self.capacity
+        return min(plan['staging_bytes'], self.capacity)
+
+    def next(self):
+        """Start the next item: return (plan, disk_budget), or None if nothing waiting fits until a running item finishes."""
+        for index, plan in enumerate(self.waiting):
+            need = self.need(plan)
+            if self.in_use + need <= self.capacity:
+                del self.waiting[index]
+                self.running[plan['identifier']] = need
+                self.in_use += need
+                return (plan, need)
+        return None
+
+    def finish(self, identifier:str) -> None:
+        """Give back what a finished item held."""
+        self.in_use -= self.running.pop(identifier, 0)
+        return
+
+
+def summarize(plans:list, bandwidth:int=None) -> dict:
+    """Totals over a list of plans.
+    bandwidth : int - expected download bytes/s, to estimate how long the run will take."""
+    good = [p for p in plans if not p['error']]
+    largest = max(good, key=lambda p: p['largest_file_bytes'], default=None)
+    total_bytes = sum(p['total_bytes'] for p in good)
+    summary = {
+        'items': len(plans),
+        'items_failed': len(plans) - len(good),
+        'files_count': sum(p['files_count'] for p in good),
+        'total_bytes': total_bytes,
+        'largest_file': (largest['identifier'], largest['largest_file']) if largest else None,
+        'largest_file_bytes': largest['largest_file_bytes'] if largest else 0,
+        'max_staging_bytes': max((p['staging_bytes'] for p in good), default=0),
+        'estimated_seconds': (total_bytes / bandwidth) if bandwidth else None,
+    }
+    return summary
+
+
+def write_manifest(manifest_path:str, plans:list, summary:dict, params:dict=None) -> None:
+    """Save a plan as JSON, atomically."""
+    common.ensure_parent_dir_exists(filepath=manifest_path)
+    tmp_path = '{0}.tmp{1}'.format(manifest_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': params or {}, 'summary': summary, 'items': plans}, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+    logging.info('Wrote plan for %s items to manifest_path=%r', len(plans), manifest_path)
+    return
+
+
+def log_summary(summary:dict, capacity:int=None) -> None:
+    logging.info('Plan: %s items (%s could not be planned), %s files, %.1f GB total',
+        summary['items'], summary['items_failed'], summary['files_count'], summary['total_bytes'] / 1e9)
+    logging.info('Plan: largest file %r is %s bytes, one item needs up to %s bytes of staging disk',
+        summary['largest_file'], summary['largest_file_bytes'], summary['max_staging_bytes'])
+    if summary['estimated_seconds'] is not None:
+        logging.info('Plan: estimated download time %.1f hours', summary['estimated_seconds'] / 3600)
+    if capacity and (summary['max_staging_bytes'] > capacity):
+        logging.warning('Plan: largest item needs more staging disk than the capacity=%r available', capacity)
+    return
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
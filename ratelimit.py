@@ -0,0 +1,191 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        ratelimit
+# Purpose: Process-wide download bandwidth limit, with its rate following a time-of-day timetable.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import re
+import time
+import threading
+import argparse
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import metrics # Instrumentation.
+
+
+
+EVALUATE_INTERVAL = 1.0 # Seconds between checks of which timetable entry applies.
+MIN_CHUNK_SIZE = 64 * 1024 # Smallest read size used while limited.
+SUFFIXES = {'b': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4} # As rclone; A bare number is KiB.
+
+
+_limiters = {} # {pid: RateLimiter}
+_limiters_lock = threading.Lock()
+
+
+def parse_rate(text:str):
+    """'5M' -> 5242880 bytes/s; 'off' -> None (Unlimited). Same units as rclone --bwlimit."""
+    text = text.strip().lower()
+    if text in ('off', '', '0'):
+        return None
+    match = re.match(r'^(\d+(?:\.\d+)?)([bkmgt]?)(?:i?b)?$', text)
+    if not match:
+        raise ValueError('Bad rate {0!r}, expected e.g. 512K, 5M or off'.format(text))
+    rate = float(match.group(1)) * SUFFIXES[match.group(2) or 'k']
+    return rate or None
+
+
+def parse_schedule(text:str) -> list:
+    """Parse a limit in rclone --bwlimit syntax: Either one rate ('5M'), or a timetable of
+    'HH:MM,rate' entries separated by spaces, each applying from its time until the next one,
+    e.g. '08:00,5M 18:00,off' is 5MiB/s during office hours and unlimited otherwise.
+    https://rclone.org/docs/#bwlimit-bandwidth-spec
+    return [(minute_of_day, rate), ...] sorted by time, rate None meaning unlimited."""
+    entries = text.split()
+    if (len(entries) == 1) and (',' not in entries[0]):
+        return [(0, parse_rate(entries[0]))]
+    schedule = []
+    for entry in entries:
+        match = re.match(r'^(\d{1,2}):(\d{2}),(.+)$', entry)
+        if not match or (int(match.group(1)) > 23) or (int(match.group(2)) > 59):
+            raise ValueError('Bad timetable entry {0!r}, expected HH:MM,rate'.format(entry))
+        schedule.append((int(match.group(1)) * 60 + int(match.group(2)), parse_rate(match.group(3))))
+    if not schedule:
+        raise ValueError('Empty bandwidth timetable')
+    return sorted(schedule)
+
+
+def rate_at(schedule:list, minute_of_day:int):
+    """The rate a parsed schedule gives at a time of day. Before the first entry, the last one from the day before still applies."""
+    rate = schedule[-1][1]
+    for minute, entry_rate in schedule:
+        if minute <= minute_of_day:
+            rate = entry_rate
+    return rate
+
+
+def format_rate(rate) -> str:
+    return 'off' if rate is None else '{0}B'.format(int(rate))
+
+
+def split_schedule(text:str, n:int) -> str:
+    """Divide every rate of a limit between n processes, so together they stay within it.
+    return the divided limit in the same syntax."""
+    if not text or (n <= 1):
+        return text
+    schedule = parse_schedule(text)
+    divided = [(minute, (None if rate is None else max(1, rate / n))) for minute, rate in schedule]
+    if ',' not in text:# Just one rate.
+        return format_rate(divided[0][1])
+    return ' '.join('{0:02d}:{1:02d},{2}'.format(minute // 60, minute % 60, format_rate(rate)) for minute, rate in divided)
+
+
+class RateLimiter():
+    """Token bucket shared by every download thread in the process.
+    Its rate follows a timetable (See parse_schedule()), checked every EVALUATE_INTERVAL seconds,
+    so a run started overnight slows down when the working day starts and speeds up again after, without restarting.
+    Up to one second of traffic can be sent in a burst; Reads bigger than that put the bucket into debt,
+    and whoever reads next waits it off, so the rate holds on average across all threads."""
+    def __init__(self, schedule_text:str):
+        self.schedule_text = schedule_text
+        self.schedule = parse_schedule(schedule_text)
+        self.lock = threading.Lock()
+        self.rate = None # Bytes/s, None for unlimited.
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.checked = 0.0 # time.monotonic() of the last timetable check.
+        self._update_rate(self.last, force=True)
+
+    def _update_rate(self, now:float, force:bool=False) -> None:
+        if (not force) and (now - self.checked < EVALUATE_INTERVAL):
+            return
+        self.checked = now
+        local = time.localtime()
+        rate = rate_at(self.schedule, local.tm_hour * 60 + local.tm_min)
+        if force or (rate != self.rate):
+            logging.info('Download limit is now %s', 'unlimited' if rate is None else '{0:.0f} bytes/s'.format(rate))
+            metrics.set_gauge('ia2rc_download_limit_bytes', rate or 0)
+            self.tokens = 0.0 if (rate is None) else min(self.tokens, rate)
+        self.rate = rate
+
+    def chunk_size(self, chunk_size:int) -> int:
+        """Read size to use instead of chunk_size, small enough that the limit is kept smoothly rather than in bursts."""
+        rate = self.rate
+        if rate is None:
+            return chunk_size
+        return int(max(MIN_CHUNK_SIZE, min(chunk_size, rate / 4)))
+
+    def consume(self, nbytes:int) -> float:
+        """Take nbytes out of the bucket, sleeping as long as the current rate requires.
+        return seconds slept."""
+        with self.lock:
+            now = time.monotonic()
+            self._update_rate(now)
+            if self.rate is None:
+                self.last = now
+                return 0.0
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            delay = (-self.tokens / self.rate) if (self.tokens < 0) else 0.0
+        if delay > 0:
+            time.sleep(delay)
+            metrics.inc('ia2rc_download_throttled_seconds_total', delay)
+        return delay
+
+
+def bwlimit_arg(text:str) -> str:
+    """argparse type for limits, checking them up front."""
+    try:
+        parse_schedule(text)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+    return text
+
+
+def configure(schedule_text:str=None):
+    """Set this process's download limit. Keeps the existing limiter (And its bucket) if the limit is unchanged.
+    schedule_text : str - see parse_schedule(); None for no limit.
+    return the RateLimiter, or None.
+    Raise ValueError if schedule_text can't be parsed."""
+    pid = os.getpid()
+    with _limiters_lock:
+        limiter = _limiters.get(pid)
+        if not schedule_text:
+            _limiters.pop(pid, None)
+            return None
+        if (limiter is None) or (limiter.schedule_text != schedule_text):
+            logging.info('Limiting downloads to dl_bwlimit=%r', schedule_text)
+            limiter = RateLimiter(schedule_text)
+            _limiters[pid] = limiter
+        return limiter
+
+
+def chunk_size(chunk_size:int) -> int:
+    """Read size downloads should use right now. (chunk_size unless limited)"""
+    limiter = _limiters.get(os.getpid())
+    return limiter.chunk_size(chunk_size) if limiter else chunk_size
+
+
+def throttle(nbytes:int) -> float:
+    """Account for nbytes just downloaded, sleeping if this process is over its limit.
+    return seconds slept."""
+    limiter = _limiters.get(os.getpid())
+    return limiter.consume(nbytes) if limiter else 0.0
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
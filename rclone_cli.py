@@ -0,0 +1,159 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        rclone_cli
+# Purpose: Run rclone commands with their output read through pipes, parsing JSON logs and stats as they arrive.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import json
+import subprocess
+import threading
+import collections
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import metrics # Instrumentation.
+
+
+
+STATS_INTERVAL = '5s' # How often rclone reports transfer progress. https://rclone.org/docs/#stats-duration
+STDERR_TAIL_LINES = 20 # Unstructured stderr lines kept for error messages.
+
+
+_logfile_lock = threading.Lock() # Lines from concurrent rclone runs sharing one rc_logfile must not interleave.
+
+
+class RcloneError(Exception):
+    """Signals that an rclone command exited with an error"""
+    def __init__(self, cmd:list, returncode:int, errors:list):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.errors = errors # [{'msg':, 'object':}, ...] from rclone's JSON log, or plain stderr lines.
+        super().__init__('rclone {c!r} exited with returncode={r!r} errors={e!r}'.format(
+            c=(cmd[1] if len(cmd) > 1 else cmd), r=returncode, e=errors[-5:]))
+
+
+def log_progress(stats:dict) -> None:
+    """Default progress handler: Log and record rclone's live transfer figures."""
+    logging.debug('rclone progress: %s of %s bytes at %.0f bytes/s, eta=%r, errors=%r',
+        stats.get('bytes'), stats.get('totalBytes'), stats.get('speed') or 0, stats.get('eta'), stats.get('errors'))
+    if stats.get('speed') is not None:
+        metrics.set_gauge('ia2rc_upload_speed_bytes', stats['speed'])
+    return
+
+
+class RcloneProcess():
+    """One rclone invocation, its stdout collected in memory and its stderr parsed line by line while it runs.
+    rclone is asked for JSON logs (--use-json-log) with periodic stats (--stats), so progress and error reasons
+    arrive as structured data rather than free text. Nothing is written to fixed paths, so any number can run at once.
+    https://rclone.org/docs/#use-json-log
+    cmd : list - rclone command line, e.g. ['rclone', 'move', src, dst]
+    stdin : bool - give the process a pipe to write to through .stdin (e.g. for rcat).
+    rc_logfile : str - also append every line rclone logs (At DEBUG level) to this file.
+    on_progress : callable - called with rclone's stats dict each time it reports them.
+    """
+    def __init__(self, cmd:list, stdin:bool=False, rc_logfile:str=None, on_progress=log_progress, stats_interval:str=STATS_INTERVAL):
+        self.cmd = list(cmd) + ['--use-json-log', '--stats', stats_interval, '--stats-log-level', 'NOTICE']
+        if rc_logfile:
+            self.cmd += ['--log-level', 'DEBUG']
+        self.rc_logfile = rc_logfile
+        self.on_progress = on_progress
+        self.stats = {} # Latest stats rclone reported.
+        self.errors = [] # [{'msg':, 'object':}, ...]
+        self.stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        self.stdout = b''
+        logging.debug('cmd=%r', self.cmd)
+        self.process = subprocess.Popen(
+            args=self.cmd,
+            stdin=(subprocess.PIPE if stdin else subprocess.DEVNULL),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.stdin = self.process.stdin
+        # Both pipes are drained continuously, so rclone can never block on a full pipe.
+        self.threads = [
+            threading.Thread(target=self._read_stdout, name='rclone-stdout', daemon=True),
+            threading.Thread(target=self._read_stderr, name='rclone-stderr', daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _read_stdout(self) -> None:
+        self.stdout = self.process.stdout.read()
+
+    def _read_stderr(self) -> None:
+        logfile = open(self.rc_logfile, 'a', encoding='utf8') if self.rc_logfile else None
+        try:
+            for raw_line in self.process.stderr:
+                line = raw_line.decode('utf8', 'replace').rstrip('\r\n')
+                if not line:
+                    continue
+                if logfile:
+                    with _logfile_lock:
+                        logfile.write(line + '\n')
+                        logfile.flush()
+                self._handle_line(line)
+        finally:
+            if logfile:
+                logfile.close()
+
+    def _handle_line(self, line:str) -> None:
+        try:
+            entry = json.loads(line)
+        except ValueError:# Not everything rclone prints is JSON, e.g. Go panics.
+            self.stderr_tail.append(line)
+            return
+        if not isinstance(entry, dict):
+            self.stderr_tail.append(line)
+            return
+        stats = entry.get('stats')
+        if stats:
+            self.stats = stats
+            if self.on_progress:
+                try:
+                    self.on_progress(stats)
+                except Exception as err:# A broken progress handler must not stop us reading.
+                    logging.exception(err)
+            return
+        if entry.get('level') in ('error', 'critical', 'fatal', 'emergency', 'alert'):
+            self.errors.append({'msg': entry.get('msg'), 'object': entry.get('object')})
+        self.stderr_tail.append(entry.get('msg', line))
+
+    def kill(self) -> None:
+        """Stop rclone without letting it finish."""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.wait(check=False)
+
+    def wait(self, check:bool=True) -> str:
+        """Wait for rclone to exit.
+        return its stdout as text.
+        Raise RcloneError if check and it failed."""
+        returncode = self.process.wait()
+        for thread in self.threads:
+            thread.join()
+        if check and (returncode != 0):
+            raise RcloneError(cmd=self.cmd, returncode=returncode, errors=(self.errors or list(self.stderr_tail)))
+        return self.stdout.decode('utf8', 'replace')
+
+
+def run(cmd:list, rc_logfile:str=None, on_progress=log_progress) -> str:
+    """Run an rclone command to completion.
+    return its stdout as text.
+    Raise RcloneError if it failed."""
+    return RcloneProcess(cmd=cmd, rc_logfile=rc_logfile, on_progress=on_progress).wait()
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        rclone_rc
+# Purpose: Talk to a long-lived "rclone rcd" over its HTTP remote control API instead of spawning rclone per upload.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import time
+import subprocess
+import socket
+import secrets
+import threading
+import atexit
+import multiprocessing.util
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+import requests
+# Local
+
+
+
+# https://rclone.org/rc/
+POLL_INTERVAL = 0.5 # Seconds between job/status calls.
+STARTUP_TIMEOUT = 30 # Seconds to wait for a fresh rcd to start answering.
+
+
+_daemon = None
+_daemon_lock = threading.Lock()
+
+
+class RcloneRCError(Exception):
+    """Signals that the rclone rc API reported a failure"""
+
+
+def _free_port() -> int:
+    """Ask the OS for a currently unused localhost TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RcloneRC():
+    """Client for the rclone remote control API.
+    If rc_url is not given a private "rclone rcd" is started on a random localhost port with random credentials,
+    and stopped again by stop().
+    Give rc_url (And rc_user/rc_pass if it needs them) to use an rc server that is already running, such as a stand-in for testing.
+    """
+    def __init__(self, rc_url:str=None, rc_user:str=None, rc_pass:str=None, rc_logfile:str=None):
+        self.process = None
+        self.pid = os.getpid() # Process that owns this client.
+        self.session = requests.Session()
+        self.bwlimit = None # Last rate given to core/bwlimit.
+        if rc_url is None:
+            rc_user = 'ia2rc'
+            rc_pass = secrets.token_hex(16)
+            rc_url = self._start_rcd(rc_user=rc_user, rc_pass=rc_pass, rc_logfile=rc_logfile)
+            self.session.trust_env = False# Our own rcd is on localhost, never go through http_proxy for it.
+        self.rc_url = rc_url.rstrip('/')
+        if rc_user:
+            self.session.auth = (rc_user, rc_pass)
+        self._wait_ready()
+
+    def _start_rcd(self, rc_user:str, rc_pass:str, rc_logfile:str=None) -> str:
+        """Launch rclone rcd and return its URL."""
+        port = _free_port()
+        # https://rclone.org/commands/rclone_rcd/
+        cmd = [
+            'rclone', 'rcd',
+            '--rc-addr', '127.0.0.1:{0}'.format(port),
+            '--rc-user', rc_user,
+            '--rc-pass', rc_pass,
+        ]
+        if rc_logfile:# Verbose debugging info. https://rclone.org/docs/#log-level-level
+            cmd.append('--log-file={0}'.format(rc_logfile))
+            cmd.append('--log-level')
+            cmd.append('DEBUG')
+        logging.info('Starting rclone rcd on port %s', port)
+        logging.debug('cmd=%r', [c if c != rc_pass else '<hidden>' for c in cmd])
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return 'http://127.0.0.1:{0}'.format(port)
+
+    def _wait_ready(self) -> None:
+        """Block until the rc server answers rc/noop."""
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            if self.process and (self.process.poll() is not None):
+                raise RcloneRCError('rclone rcd exited with returncode={0!r}'.format(self.process.returncode))
+            try:
+                self.call('rc/noop')
+                logging.debug('rc server at %s is ready', self.rc_url)
+                return
+            except requests.exceptions.ConnectionError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def call(self, command:str, params:dict=None) -> dict:
+        """Run one rc command synchronously and return its JSON result.
+        Raise RcloneRCError if rclone reports an error."""
+        url = '{0}/{1}'.format(self.rc_url, command)
+        response = self.session.post(url, json=(params or {}), timeout=None)
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        if response.status_code != 200:
+            raise RcloneRCError('rc command={c!r} status_code={s!r} error={e!r}'.format(
+                c=command, s=response.status_code, e=result.get('error')))
+        return result
+
+    def run_job(self, command:str, params:dict=None) -> dict:
+        """Submit an rc command as an async job and poll job/status until it finishes.
+        return the job output. Raise RcloneRCError if the job failed."""
+        params = dict(params or {})
+        params['_async'] = True
+        jobid = self.call(command, params)['jobid']
+        logging.debug('Submitted rc command=%r as jobid=%r', command, jobid)
+        while True:
+            status = self.call('job/status', {'jobid': jobid})
+            if status.get('finished'):
+                break
+            time.sleep(POLL_INTERVAL)
+        logging.debug('rc jobid=%r finished success=%r duration=%r', jobid, status.get('success'), status.get('duration'))
+        if not status.get('success'):
+            raise RcloneRCError('rc job for command={c!r} failed: {e}'.format(c=command, e=status.get('error')))
+        return status.get('output') or {}
+
+    def set_bwlimit(self, rc_bwlimit:str=None) -> None:
+        """Apply a bandwidth limit to the daemon, if it differs from the current one."""
+        rate = rc_bwlimit or 'off'
+        if rate != self.bwlimit:
+            self.call('core/bwlimit', {'rate': rate})
+            self.bwlimit = rate
+
+    def _common_params(self, rc_bwlimit:str=None, rc_dry_run:bool=False) -> dict:
+        self.set_bwlimit(rc_bwlimit)
+        params = {}
+        if rc_dry_run:
+            params['_config'] = {'DryRun': True}
+        return params
+
+    def move_file(self, local_path:str, name:str, rc_remote_path:str, rc_bwlimit:str=None, rc_dry_run:bool=False,
+        keep_source:bool=False) -> None:
+        """Equivalent of "rclone moveto local_path/name rc_remote_path/name". ("rclone copyto" if keep_source)"""
+        params = self._common_params(rc_bwlimit=rc_bwlimit, rc_dry_run=rc_dry_run)
+        params['srcFs'] = os.path.abspath(local_path)
+        params['srcRemote'] = name
+        params['dstFs'] = rc_remote_path
+        params['dstRemote'] = name
+        self.run_job('operations/copyfile' if keep_source else 'operations/movefile', params)
+        return
+
+    def copy_file(self, rc_src_path:str, rc_dst_path:str, rc_dry_run:bool=False) -> None:
+        """Equivalent of "rclone copyto rc_src_path rc_dst_path", server-side when both are on the same remote."""
+        params = self._common_params(rc_dry_run=rc_dry_run)
+        params['srcFs'], _, params['srcRemote'] = rc_src_path.rpartition('/')
+        params['dstFs'], _, params['dstRemote'] = rc_dst_path.rpartition('/')
+        self.run_job('operations/copyfile', params)
+        return
+
+    def list(self, rc_remote_path:str, rc_max_depth:int=None, show_hash:bool=False) -> list:
+        """Equivalent of "rclone lsjson -R rc_remote_path", return the list of entries.
+        show_hash : bool - include each file's md5 in its 'Hashes' (As "--hash --hash-type md5")."""
+        opt = {'recurse': True}
+        if rc_max_depth is not None:
+            opt['maxDepth'] = rc_max_depth
+        if show_hash:
+            opt['showHash'] = True
+            opt['hashTypes'] = ['md5']
+            opt['filesOnly'] = True
+        result = self.call('operations/list', {'fs': rc_remote_path, 'remote': '', 'opt': opt})
+        return result.get('list', [])
+
+    def stop(self) -> None:
+        """Stop the daemon if we started it."""
+        if self.process and (self.process.poll() is None):
+            logging.info('Stopping rclone rcd')
+            try:
+                self.call('core/quit')
+            except Exception as err:
+                logging.debug('core/quit failed: %r', err)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        return
+
+
+def get_daemon(rc_url:str=None, rc_logfile:str=None) -> RcloneRC:
+    """Get the shared rc client for this process, starting rclone rcd on first use.
+    rc_url : str - use an already-running rc server instead of starting one."""
+    global _daemon
+    with _daemon_lock:
+        if (_daemon is None) or (_daemon.pid != os.getpid()):# Don't reuse a parent process's daemon after forking.
+            _daemon = RcloneRC(rc_url=rc_url, rc_logfile=rc_logfile)
+            multiprocessing.util.Finalize(None, stop_daemon, exitpriority=10)# Process pool workers skip atexit handlers.
+        return _daemon
+
+
+def stop_daemon() -> None:
+    """Stop this process's shared rcd, if any."""
+    global _daemon
+    with _daemon_lock:
+        if _daemon and (_daemon.pid == os.getpid()):
+            _daemon.stop()
+        _daemon = None
+atexit.register(stop_daemon)
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        retrycontrol
+# Purpose: One retry/backoff controller per remote host, shared by every thread in the process.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import logging
+import re
+import time
+import random
+import threading
+import urllib.parse
+import email.utils
+import datetime
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import metrics # Instrumentation.
+
+
+
+BASE_DELAY = 2.0 # Seconds; Backoff before the first retry, doubling after that.
+MAX_DELAY = 300.0 # Seconds; Cap on any one backoff, including server Retry-After hints.
+FAILURE_THRESHOLD = 5 # Consecutive failures against a host before its circuit opens.
+OPEN_SECONDS = 30.0 # Minimum seconds an open circuit stays shut before a single probe request is let through.
+THROTTLE_STATUSES = (429, 503) # Server asking us to slow down.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_MESSAGE = re.compile(r'\b429\b|rate ?limit|too many requests', re.IGNORECASE) # Remote asking rclone to slow down, in its error text.
+
+# Circuit states
+CLOSED = 'closed' # Normal.
+OPEN = 'open' # Nobody may send requests until blocked_until.
+HALF_OPEN = 'half-open' # One probe request is in flight, everyone else waits for its result.
+
+
+_controllers = {} # {(pid, host): HostController}
+_controllers_lock = threading.Lock()
+
+
+def retry_after_seconds(response) -> float:
+    """return the delay a response's Retry-After header asks for in seconds, or None.
+    Handles both the delay-seconds and HTTP-date forms. https://httpwg.org/specs/rfc9110.html#field.retry-after"""
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logging.debug('Unparseable Retry-After=%r', value)
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class HostController():
+    """Retry state for one host, shared by all threads talking to it.
+    Callers wait() before every request and report success() or failure() afterwards.
+    - Throttling responses (429/503, or any Retry-After) pause every caller for the host, not just the one that got it.
+    - After failure_threshold consecutive failures the circuit opens: everyone waits at least open_seconds
+      (Longer as failures continue), then a single probe request is let through.
+      If it succeeds the circuit closes and everyone resumes at once; If not it opens again.
+    - backoff_delay() gives callers a jittered exponential delay for their own retries,
+      so workers that failed together don't all retry in the same instant.
+    """
+    def __init__(self, host:str, base_delay:float=BASE_DELAY, max_delay:float=MAX_DELAY,
+        failure_threshold:int=FAILURE_THRESHOLD, open_seconds:float=OPEN_SECONDS):
+        self.host = host
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.cond = threading.Condition()
+        self.state = CLOSED
+        self.failures = 0 # Consecutive failures.
+        self.blocked_until = 0.0 # time.monotonic() before which nobody may send a request.
+        self.probe_deadline = 0.0 # When a probe that never reported back is given up on.
+
+    def backoff_delay(self, attempt:int) -> float:
+        """Exponential backoff with equal jitter: half the delay is fixed, half random.
+        attempt : int - 1 for the first retry."""
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        return (delay / 2) + random.uniform(0, delay / 2)
+
+    def wait(self) -> float:
+        """Block until a request to this host is allowed.
+        return seconds spent waiting."""
+        start = time.monotonic()
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if (self.state == HALF_OPEN) and (now < self.probe_deadline):# Someone else is probing.
+                    self.cond.wait(self.probe_deadline - now)
+                    continue
+                if now < self.blocked_until:
+                    self.cond.wait(self.blocked_until - now)
+                    continue
+                if self.state in (OPEN, HALF_OPEN):# Be the probe.
+                    logging.info('Probing host=%r after circuit opened', self.host)
+                    self.state = HALF_OPEN
+                    self.probe_deadline = now + max(self.open_seconds, 60)
+                break
+        waited = time.monotonic() - start
+        if waited > 0.01:
+            logging.debug('Waited %.1fs for host=%r', waited, self.host)
+            metrics.observe('ia2rc_backoff_seconds', waited)
+        return waited
+
+    def success(self) -> None:
+        """Report that a request to this host worked."""
+        with self.cond:
+            self.failures = 0
+            if self.state != CLOSED:
+                logging.info('Circuit for host=%r closed again', self.host)
+                self.state = CLOSED
+                self.blocked_until = 0.0
+                self.cond.notify_all()
+        return
+
+    def failure(self, retry_after:float=None, throttled:bool=False) -> None:
+        """Report that a request to this host failed.
+        retry_after : float - seconds the server asked us to wait, if it did.
+        throttled : bool - the server told us to slow down (e.g. 429/503), so pause every caller."""
+        with self.cond:
+            self.failures += 1
+            now = time.monotonic()
+            delay = self.backoff_delay(self.failures)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_delay))
+            if throttled or (retry_after is not None):
+                metrics.inc('ia2rc_throttled_total')
+            if (self.state == HALF_OPEN) or (self.failures >= self.failure_threshold):
+                if self.state != OPEN:
+                    logging.warning('Opening circuit for host=%r after %s consecutive failures', self.host, self.failures)
+                    metrics.inc('ia2rc_circuit_opens_total')
+                self.state = OPEN
+                delay = max(delay, self.open_seconds)
+                self.blocked_until = max(self.blocked_until, now + delay)
+            elif throttled or (retry_after is not None):
+                logging.info('Host=%r asked us to slow down, pausing all requests to it for %.1fs', self.host, delay)
+                self.blocked_until = max(self.blocked_until, now + delay)
+            self.cond.notify_all()
+        return
+
+    def report_error(self, err:Exception) -> None:
+        """failure() for a requests exception, using the status code and Retry-After of its response if it has one."""
+        response = getattr(err, 'response', None)
+        status_code = getattr(response, 'status_code', None)
+        self.failure(
+            retry_after=retry_after_seconds(response),
+            throttled=(status_code in THROTTLE_STATUSES) or (type(err).__name__ == 'RetryError'),# RetryError: urllib3 already gave up on retryable statuses.
+        )
+        return
+
+    def report_message(self, message:str) -> None:
+        """failure() for an error known only by its text, such as an rclone error; Rate limit complaints count as throttling."""
+        self.failure(throttled=bool(THROTTLE_MESSAGE.search(message or '')))
+        return
+
+    def report_response(self, response) -> bool:
+        """success() or failure() depending on a response's status code.
+        return True if the response is worth retrying."""
+        if response.status_code in RETRY_STATUSES:
+            self.failure(
+                retry_after=retry_after_seconds(response),
+                throttled=(response.status_code in THROTTLE_STATUSES),
+            )
+            return True
+        self.success()
+        return False
+
+
+def host_of(url:str) -> str:
+    """'https://archive.org/download/x/y' -> 'archive.org'"""
+    return urllib.parse.urlsplit(url).netloc.lower() or url
+
+
+def get_controller(url:str) -> HostController:
+    """Get this process's shared controller for the host of url (Or a bare hostname)."""
+    host = host_of(url) if '//' in url else url.lower()
+    key = (os.getpid(), host)
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = HostController(host=host)
+        return _controllers[key]
+
+
+def main():
+    pass
+
+if __name__ == '__main__':
+    main()
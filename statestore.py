@@ -0,0 +1,269 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        statestore
+# Purpose: SQLite store for per-file and per-item progress, replacing the memory/ listfiles.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import sys
+import logging
+import argparse
+import glob
+import re
+import time
+import sqlite3
+import threading
+import atexit
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import common # General-purpose functions.
+
+
+
+DEFAULT_DB_PATH = os.path.join('memory', 'ia2rc_state.sqlite3')
+BATCH_SIZE = 100 # Writes to buffer before committing. Losing an uncommitted batch only means redoing a few files.
+
+# File statuses
+FILE_DOWNLOADED = 'downloaded' # Verified on local disk (Or already moved to the remote).
+FILE_VERIFY_FAILED = 'verify_failed' # Remote copy did not match IA's metadata, needs transferring again.
+# Item statuses
+ITEM_STARTED = 'started'
+ITEM_DONE = 'done'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS items (
+        identifier TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        files_count INTEGER,
+        updated REAL NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS files (
+        identifier TEXT NOT NULL,
+        name TEXT NOT NULL,
+        status TEXT NOT NULL,
+        size INTEGER,
+        md5 TEXT,
+        updated REAL NOT NULL,
+        PRIMARY KEY (identifier, name)
+    )''',
+    'CREATE INDEX IF NOT EXISTS files_status ON files (identifier, status)',
+    '''CREATE TABLE IF NOT EXISTS uploads (
+        identifier TEXT NOT NULL,
+        name TEXT NOT NULL,
+        rc_path TEXT NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (identifier, name, rc_path)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS content (
+        md5 TEXT PRIMARY KEY,
+        size INTEGER,
+        rc_path TEXT NOT NULL,
+        updated REAL NOT NULL
+    )''',
+]
+
+
+_stores = {} # {(pid, abspath): StateStore}
+_stores_lock = threading.Lock()
+
+
+class StateStore():
+    """Per-file and per-item status, size, md5 and timestamps in one WAL-mode SQLite database.
+    Writes are buffered here and written batch_size at a time in one short transaction; Call commit() at points that must be durable.
+    No transaction is held open between batches, so other processes sharing the database (--item_workers, --queue_db) never wait long on it.
+    Reads see buffered writes. Safe to share between threads; each process should open its own (See open_store())."""
+    def __init__(self, db_path:str=DEFAULT_DB_PATH, batch_size:int=BATCH_SIZE):
+        logging.debug('Opening state store db_path=%r', db_path)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.pending = [] # Buffered writes, [(sql, params), ...]
+        self.lock = threading.RLock()
+        common.ensure_parent_dir_exists(filepath=db_path)
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')# Readers don't block the writer, and commits are cheap.
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+
+    def _write(self, sql:str, params:tuple) -> None:
+        with self.lock:
+            self.pending.append((sql, params))
+            if len(self.pending) >= self.batch_size:
+                self.commit()
+
+    def commit(self) -> None:
+        """Write buffered writes to the database."""
+        with self.lock:
+            if self.pending:
+                with self.conn:# One transaction, committed (Or rolled back) straight away.
+                    for sql, params in self.pending:
+                        self.conn.execute(sql, params)
+                self.pending = []
+
+    def close(self) -> None:
+        with self.lock:
+            self.commit()
+            self.conn.close()
+
+    def set_file(self, identifier:str, name:str, status:str, size:int=None, md5:str=None) -> None:
+        """Record the status of one file of an item."""
+        self._write(
+            '''INSERT INTO files (identifier, name, status, size, md5, updated) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (identifier, name) DO UPDATE SET
+                status=excluded.status,
+                size=COALESCE(excluded.size, size),
+                md5=COALESCE(excluded.md5, md5),
+                updated=excluded.updated''',
+            (identifier, name, status, size, md5, time.time())
+        )
+
+    def get_files(self, identifier:str, status:str=None) -> dict:
+        """return {name: {'status':, 'size':, 'md5':, 'updated':}} for files of an item, optionally only those with a given status."""
+        with self.lock:
+            self.commit()# So buffered writes are seen.
+            if status is None:
+                rows = self.conn.execute('SELECT name, status, size, md5, updated FROM files WHERE identifier=?', (identifier,))
+            else:
+                rows = self.conn.execute('SELECT name, status, size, md5, updated FROM files WHERE identifier=? AND status=?', (identifier, status))
+            return {name: {'status': st, 'size': size, 'md5': md5, 'updated': updated} for name, st, size, md5, updated in rows}
+
+    def set_item(self, identifier:str, status:str, files_count:int=None) -> None:
+        """Record the status of an item."""
+        self._write(
+            '''INSERT INTO items (identifier, status, files_count, updated) VALUES (?, ?, ?, ?)
+            ON CONFLICT (identifier) DO UPDATE SET
+                status=excluded.status,
+                files_count=COALESCE(excluded.files_count, files_count),
+                updated=excluded.updated''',
+            (identifier, status, files_count, time.time())
+        )
+
+    def set_upload(self, identifier:str, name:str, rc_path:str) -> None:
+        """Record that one destination has a file, when sending to several. (rc_path is the item dir on that destination)"""
+        self._write(
+            'INSERT OR REPLACE INTO uploads (identifier, name, rc_path, updated) VALUES (?, ?, ?, ?)',
+            (identifier, name, rc_path, time.time())
+        )
+
+    def get_uploads(self, identifier:str) -> dict:
+        """return {name: set(rc_path, ...)} of the destinations each file of an item has reached."""
+        with self.lock:
+            self.commit()# So buffered writes are seen.
+            uploads = {}
+            for name, rc_path in self.conn.execute('SELECT name, rc_path FROM uploads WHERE identifier=?', (identifier,)):
+                uploads.setdefault(name, set()).add(rc_path)
+            return uploads
+
+    def add_content(self, md5:str, rc_path:str, size:int=None) -> None:
+        """Remember that a file with this md5 is on a remote at rc_path. The first copy recorded is kept."""
+        self._write(
+            'INSERT OR IGNORE INTO content (md5, size, rc_path, updated) VALUES (?, ?, ?, ?)',
+            (md5.lower(), size, rc_path, time.time())
+        )
+
+    def find_content(self, md5:str):
+        """return {'size':, 'rc_path':} of a remote copy of a file with this md5, or None if there isn't one."""
+        with self.lock:
+            self.commit()# So buffered writes are seen.
+            row = self.conn.execute('SELECT size, rc_path FROM content WHERE md5=?', (md5.lower(),)).fetchone()
+            return {'size': row[0], 'rc_path': row[1]} if row else None
+
+    def forget_content(self, md5:str, rc_path:str) -> None:
+        """Drop a remote copy that turned out to be gone."""
+        self._write('DELETE FROM content WHERE md5=? AND rc_path=?', (md5.lower(), rc_path))
+
+    def item_status(self, identifier:str):
+        """return the status of an item, or None if it has never been seen."""
+        with self.lock:
+            self.commit()# So buffered writes are seen.
+            row = self.conn.execute('SELECT status FROM items WHERE identifier=?', (identifier,)).fetchone()
+            return row[0] if row else None
+
+
+def open_store(db_path:str=DEFAULT_DB_PATH) -> StateStore:
+    """Get the shared StateStore for a db file in this process, opening it on first use.
+    Keyed by process id so a forked worker never reuses its parent's connection."""
+    key = (os.getpid(), os.path.abspath(db_path))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = StateStore(db_path=db_path)
+        return _stores[key]
+
+
+def close_stores() -> None:
+    """Commit and close every store opened by this process."""
+    with _stores_lock:
+        for key in list(_stores.keys()):
+            if key[0] == os.getpid():
+                _stores.pop(key).close()
+atexit.register(close_stores)
+
+
+def import_text_memory(store:StateStore, memory_dir:str='memory', debug_dir:str='debug') -> dict:
+    """One-shot import of the old text listfiles into a StateStore.
+    memory/done_files/<identifier>.txt -> files with status FILE_DOWNLOADED
+    memory/done_identifiers.txt -> items with status ITEM_DONE
+    debug/ia_dl_success_list.txt -> files with status FILE_DOWNLOADED
+    return counts of imported entries."""
+    counts = {'files': 0, 'items': 0, 'success_list': 0}
+    for list_path in glob.glob(os.path.join(memory_dir, 'done_files', '*.txt')):
+        identifier = os.path.splitext(os.path.basename(list_path))[0]
+        for name in common.read_listfile(filepath=list_path, silent=True):
+            store.set_file(identifier=identifier, name=name, status=FILE_DOWNLOADED)
+            counts['files'] += 1
+    done_identifiers = common.read_listfile(filepath=os.path.join(memory_dir, 'done_identifiers.txt'), silent=True)
+    for identifier in (done_identifiers or []):
+        store.set_item(identifier=identifier, status=ITEM_DONE)
+        counts['items'] += 1
+    success_list = common.read_listfile(filepath=os.path.join(debug_dir, 'ia_dl_success_list.txt'), silent=True)
+    for line in (success_list or []):
+        # Lines were written as '{file.item}/{file.name}', where file.item is the repr of an Item.
+        match = re.match(r"^.*?identifier='([^']+)'[^/]*/(.+)$", line) or re.match(r'^([^/]+)/(.+)$', line)
+        if not match:
+            logging.warning('Could not parse success list line=%r', line)
+            continue
+        store.set_file(identifier=match.group(1), name=match.group(2), status=FILE_DOWNLOADED)
+        counts['success_list'] += 1
+    store.commit()
+    logging.info('Imported text memory: %r', counts)
+    return counts
+
+
+def command_line():
+    # Handle command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db_path', help='State store database to import into.',
+        type=str, default=DEFAULT_DB_PATH)
+    parser.add_argument('--memory_dir', help='Dir holding the old done_files/ and done_identifiers.txt listfiles.',
+        type=str, default='memory')
+    parser.add_argument('--debug_dir', help='Dir holding the old ia_dl_success_list.txt',
+        type=str, default='debug')
+    common.add_logging_args(parser)# Consumed by setup_logging_from_argv()
+    args = parser.parse_args()
+    logging.debug('args={args!r}'.format(args=args))# Record CLI arguments
+    store = open_store(db_path=args.db_path)
+    import_text_memory(store=store, memory_dir=args.memory_dir, debug_dir=args.debug_dir)
+    logging.info('Finished command-line invocation')
+    return
+
+
+def main():
+    command_line()
+
+if __name__ == '__main__':
+    logger = common.setup_logging_from_argv(os.path.join("debug", "statestore.log.ts{ts}.txt"))# Setup logging, --log_mode etc.
+    try:
+        main()
+    except Exception as e:# Log unhandled exceptions.
+        logging.critical("Unhandled exception!")
+        logging.exception(e)
+    logging.info('Finshed. sys.argv={0}'.format(sys.argv))
@@ -0,0 +1,59 @@
+# Reserving staging disk space.
+import threading
+
+import pytest
+
+import common
+
+
+def test_reserve_and_release():
+    budget = common.DiskBudget(local_path='.', budget_bytes=100)
+    assert budget.reserve('a', 60)
+    assert budget.reserve('b', 40)
+    assert budget.reserved == 100
+    assert not budget.reserve('c', 1, timeout=0.01)# Full.
+    budget.release('a')
+    assert budget.reserved == 40
+    assert budget.reserve('c', 60, timeout=0.01)
+
+
+def test_reserve_same_key_accumulates():
+    budget = common.DiskBudget(local_path='.', budget_bytes=100)
+    assert budget.reserve('a', 30)
+    assert budget.reserve('a', 30)
+    assert budget.reservations == {'a': 60}
+    budget.release('a')
+    assert budget.reserved == 0
+    budget.release('a')# Unknown keys are ignored.
+    budget.release('never')
+    assert budget.reserved == 0
+
+
+def test_oversize_file_raises():
+    budget = common.DiskBudget(local_path='.', budget_bytes=100)
+    assert budget.reserve('exact', 100)# Exactly the capacity fits.
+    budget.release('exact')
+    with pytest.raises(IOError):
+        budget.reserve('big', 101)
+    assert budget.reserved == 0
+
+
+def test_reserve_waits_for_release():
+    budget = common.DiskBudget(local_path='.', budget_bytes=100)
+    assert budget.reserve('a', 80)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(budget.reserve('b', 50, timeout=10)))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()# Blocked while 'a' holds the space.
+    budget.release('a')
+    waiter.join(10)
+    assert results == [True]
+    assert budget.reservations == {'b': 50}
+
+
+def test_default_budget_is_free_space_less_headroom(monkeypatch):
+    class Usage():
+        free = 1000
+    monkeypatch.setattr(common.psutil, 'disk_usage', lambda path: Usage())
+    assert common.DiskBudget(local_path='.', headroom=100).capacity == 900
@@ -0,0 +1,79 @@
+# Per-item download worker pool.
+import threading
+import time
+import types
+
+import pytest
+
+import ia2rc
+
+
+class Downloads():
+    """Stands in for _dl_ia_item_file(); Each file downloads until released, failing if its name starts with 'bad'."""
+    def __init__(self):
+        self.started = []
+        self.release = {} # {name: Event}
+        self.lock = threading.Lock()
+
+    def __call__(self, file, **item_args):
+        with self.lock:
+            self.started.append(file.name)
+            event = self.release.setdefault(file.name, threading.Event())
+        assert event.wait(10)
+        if file.name.startswith('bad'):
+            raise IOError('download of {0} failed'.format(file.name))
+
+    def finish(self, name:str) -> None:
+        with self.lock:
+            self.release.setdefault(name, threading.Event()).set()
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    downloads = Downloads()
+    monkeypatch.setattr(ia2rc, '_dl_ia_item_file', downloads)
+    return downloads
+
+
+def ia_file(name:str):
+    return types.SimpleNamespace(name=name)
+
+
+def wait_for(condition) -> None:
+    for i in range(500):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError('Timed out')
+
+
+def test_next_file_starts_as_soon_as_one_finishes(downloads):
+    pool = ia2rc.DownloadPool(dl_workers=2)
+    pool.submit(ia_file('a'))
+    pool.submit(ia_file('b'))
+    submitter = threading.Thread(target=pool.submit, args=(ia_file('c'),))
+    submitter.start()
+    wait_for(lambda: len(downloads.started) == 2)
+    time.sleep(0.05)
+    assert sorted(downloads.started) == ['a', 'b']# Both workers busy, c waits.
+    downloads.finish('b')
+    submitter.join(5)
+    wait_for(lambda: 'c' in downloads.started)# Without waiting for a.
+    assert pool.finished() == ['b']
+    downloads.finish('a')
+    downloads.finish('c')
+    assert sorted(pool.drain()) == ['a', 'c']
+    pool.close()
+
+
+def test_failure_stops_new_downloads(downloads):
+    pool = ia2rc.DownloadPool(dl_workers=2)
+    pool.submit(ia_file('bad'))
+    pool.submit(ia_file('a'))
+    downloads.finish('bad')
+    downloads.finish('a')
+    with pytest.raises(IOError, match='bad'):
+        pool.submit(ia_file('b'))
+    assert 'b' not in downloads.started
+    assert pool.finished() == ['a']# Recorded, so a rerun skips it.
+    pool.close()
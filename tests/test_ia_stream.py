@@ -0,0 +1,136 @@
+# Streaming downloads against the fake InternetArchive server.
+import os
+import time
+import types
+
+import pytest
+
+import fake_ia
+import ia_stream
+import retrycontrol
+
+
+SIZE = 200000
+
+
+@pytest.fixture
+def archive(monkeypatch):
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    monkeypatch.setattr(ia_stream, '_session', None)
+    monkeypatch.setattr(ia_stream, '_resume_states', {})
+    archive = fake_ia.FakeArchive()
+    archive.add_item(identifier='item', files_count=1, file_size=SIZE)
+    server = fake_ia.start_server(archive)
+    archive.base_url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    yield archive
+    server.shutdown()
+    server.server_close()
+
+
+def ia_file(archive, name:str='file00000.bin'):
+    """Just the attributes of internetarchive.File that ia_stream uses."""
+    synthetic = archive.items['item'][1][name]
+    return types.SimpleNamespace(
+        name=name, url='{0}/download/item/{1}'.format(archive.base_url, name), auth=None,
+        size=str(synthetic.size), md5=synthetic.md5, format='Data',
+    )
+
+
+def body(archive, start:int=0, end:int=SIZE) -> bytes:
+    return b''.join(archive.items['item'][1]['file00000.bin'].read(start, end))
+
+
+def bytes_sent(archive, expected:int) -> int:
+    """The server counts a response once it has finished writing it, which can be just after the client has read it all."""
+    for i in range(100):
+        if archive.stats['bytes_sent'] >= expected:
+            break
+        time.sleep(0.01)
+    return archive.stats['bytes_sent']
+
+
+def write_part(tmp_path, data:bytes) -> str:
+    part = tmp_path / ('file00000.bin' + ia_stream.PART_SUFFIX)
+    part.write_bytes(data)
+    return str(part)
+
+
+def test_download(archive, tmp_path):
+    file = ia_file(archive)
+    assert ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096) == file.md5
+    assert (tmp_path / file.name).read_bytes() == body(archive)
+    assert os.listdir(tmp_path) == [file.name]
+
+
+def test_resume_with_range(archive, tmp_path):
+    file = ia_file(archive)
+    write_part(tmp_path, body(archive, 0, 50000))
+    assert ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096) == file.md5
+    assert bytes_sent(archive, SIZE - 50000) == SIZE - 50000# Only the rest was fetched.
+    assert (tmp_path / file.name).read_bytes() == body(archive)
+
+
+def test_resume_server_ignores_range(archive, tmp_path):
+    archive.ranges = False# 200 with the whole file instead of 206.
+    file = ia_file(archive)
+    write_part(tmp_path, body(archive, 0, 50000))
+    assert ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096) == file.md5
+    assert bytes_sent(archive, SIZE) == SIZE
+    assert (tmp_path / file.name).read_bytes() == body(archive)# Not the part file with the whole file appended.
+
+
+def test_resume_complete_part_file_416(archive, tmp_path):
+    file = ia_file(archive)
+    write_part(tmp_path, body(archive))
+    assert ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096) == file.md5
+    assert bytes_sent(archive, 0) == 0
+    assert os.listdir(tmp_path) == [file.name]
+
+
+def test_oversized_part_file_discarded(archive, tmp_path):
+    file = ia_file(archive)
+    write_part(tmp_path, body(archive) + b'extra')
+    assert ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096) == file.md5
+    assert bytes_sent(archive, SIZE) == SIZE
+
+
+def test_corrupt_part_file_hash_mismatch(archive, tmp_path):
+    file = ia_file(archive)
+    part = write_part(tmp_path, b'\0' * 50000)
+    with pytest.raises(ia_stream.HashMismatch):
+        ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096)
+    assert not os.path.exists(part)# Next attempt starts clean.
+    assert ia_stream.download_file(file, destdir=str(tmp_path), chunk_size=4096) == file.md5
+
+
+def test_already_have_file(archive, tmp_path):
+    file = ia_file(archive)
+    (tmp_path / file.name).write_bytes(body(archive))
+    assert ia_stream.download_file(file, destdir=str(tmp_path)) == file.md5
+    assert archive.stats['requests'] == 0
+
+
+def test_segmented(archive, tmp_path):
+    file = ia_file(archive)
+    assert ia_stream.download_file_segmented(file, destdir=str(tmp_path), segments=4, chunk_size=4096) == file.md5
+    assert (tmp_path / file.name).read_bytes() == body(archive)
+
+
+def test_segmented_while_caller_is_probe(archive, tmp_path, monkeypatch):
+    monkeypatch.setattr(retrycontrol, '_controllers', {})
+    file = ia_file(archive)
+    controller = retrycontrol.get_controller(file.url)
+    controller.state = retrycontrol.OPEN# Open circuit whose wait is over.
+    controller.wait()# As dl_ia_file_retry() does, making this thread the probe.
+    assert controller.state == retrycontrol.HALF_OPEN
+    start = time.monotonic()
+    assert ia_stream.download_file_segmented(file, destdir=str(tmp_path), segments=4, chunk_size=4096) == file.md5
+    assert time.monotonic() - start < 10# Segments didn't wait out the probe deadline.
+    assert controller.state == retrycontrol.CLOSED
+
+
+def test_segmented_already_have_file(archive, tmp_path):
+    file = ia_file(archive)
+    (tmp_path / file.name).write_bytes(body(archive))
+    assert ia_stream.download_file_segmented(file, destdir=str(tmp_path), segments=4) == file.md5
+    assert archive.stats['requests'] == 0# Not even the range probe.
@@ -0,0 +1,107 @@
+# Sizing up and ordering items.
+import types
+
+import pytest
+
+import planner
+
+
+def plan(identifier:str, total_bytes:int, error:str=None) -> dict:
+    return {'identifier': identifier, 'files_count': 1, 'total_bytes': total_bytes, 'largest_file': 'f',
+        'largest_file_bytes': total_bytes, 'staging_bytes': total_bytes, 'error': error}
+
+
+PLANS = [plan('b', 20), plan('bad', 0, error='Item does not exist'), plan('a', 10), plan('c', 30)]
+
+
+@pytest.mark.parametrize('order, expected', [
+    ('listfile', ['b', 'a', 'c', 'bad']),
+    ('largest', ['c', 'b', 'a', 'bad']),
+    ('smallest', ['a', 'b', 'c', 'bad']),
+])
+def test_order_plans(order, expected):
+    assert [p['identifier'] for p in planner.order_plans(list(PLANS), order=order)] == expected
+
+
+def test_order_plans_unknown():
+    with pytest.raises(ValueError):
+        planner.order_plans(list(PLANS), order='random')
+
+
+def test_summarize():
+    summary = planner.summarize(PLANS, bandwidth=10)
+    assert summary['items'] == 4
+    assert summary['items_failed'] == 1
+    assert summary['total_bytes'] == 60
+    assert summary['largest_file'] == ('c', 'f')
+    assert summary['max_staging_bytes'] == 30
+    assert summary['estimated_seconds'] == 6
+    assert planner.summarize(PLANS)['estimated_seconds'] is None
+
+
+class FakeItem():
+    item_metadata = {'metadata': {}}
+
+    def get_files(self, glob_pattern=None, on_the_fly=False):
+        return [types.SimpleNamespace(name='f{0}'.format(size), size=str(size)) for size in (10, 40, 20, 30)]
+
+
+@pytest.fixture
+def item(monkeypatch):
+    monkeypatch.setattr(planner.metacache, 'get_item', lambda identifier, **kwargs: FakeItem())
+
+
+@pytest.mark.parametrize('kwargs, staging_bytes', [
+    ({'upload_every': None}, 100),# Everything waits for the one upload at the end.
+    ({'upload_every': 1}, 40),
+    ({'upload_every': 1, 'dl_workers': 2}, 90),
+    ({'upload_every': 1, 'pipeline': True, 'pipeline_queue_size': 1}, 70),
+    ({'upload_every': 1, 'rc_stream': True}, 0),
+])
+def test_plan_item_staging(item, kwargs, staging_bytes):
+    result = planner.plan_item('x', **kwargs)
+    assert result['error'] is None
+    assert (result['files_count'], result['total_bytes'], result['largest_file']) == (4, 100, 'f40')
+    assert result['staging_bytes'] == staging_bytes
+
+
+def test_plan_item_error(monkeypatch):
+    def broken(identifier, **kwargs):
+        raise IOError('no route to host')
+    monkeypatch.setattr(planner.metacache, 'get_item', broken)
+    assert 'no route to host' in planner.plan_item('x')['error']
+
+
+def test_order_plans_binpack():
+    plans = [plan('a', 10), plan('bad', 0, error='Item does not exist'), plan('c', 30), plan('b', 20)]
+    assert [p['identifier'] for p in planner.order_plans(plans, order='binpack')] == ['c', 'b', 'a', 'bad']
+
+
+def start_all(scheduler) -> list:
+    started = []
+    while True:
+        item = scheduler.next()
+        if item is None:
+            return started
+        started.append((item[0]['identifier'], item[1]))
+
+
+def test_binpack_fills_capacity_largest_first():
+    scheduler = planner.BinpackScheduler([plan('a', 10), plan('b', 20), plan('c', 30), plan('d', 40)], capacity=60)
+    assert start_all(scheduler) == [('d', 40), ('b', 20)]# c doesn't fit beside d, b does.
+    assert scheduler.in_use == 60
+    scheduler.finish('d')
+    assert start_all(scheduler) == [('c', 30), ('a', 10)]
+    scheduler.finish('b')
+    scheduler.finish('c')
+    scheduler.finish('a')
+    assert (scheduler.next(), scheduler.in_use) == (None, 0)
+
+
+def test_binpack_oversized_and_unplanned_items_run_alone():
+    scheduler = planner.BinpackScheduler([plan('a', 10), plan('big', 100), plan('bad', 0, error='Item does not exist')], capacity=50)
+    assert start_all(scheduler) == [('big', 50)]
+    scheduler.finish('big')
+    assert start_all(scheduler) == [('a', 10)]
+    scheduler.finish('a')
+    assert start_all(scheduler) == [('bad', 50)]
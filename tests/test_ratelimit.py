@@ -0,0 +1,140 @@
+# Download bandwidth limit parsing and token bucket.
+import argparse
+
+import pytest
+
+import ratelimit
+
+
+@pytest.mark.parametrize('text, rate', [
+    ('512', 512 * 1024),# Bare numbers are KiB, as in rclone.
+    ('512K', 512 * 1024),
+    ('5M', 5 * 1024**2),
+    ('1.5m', 1.5 * 1024**2),
+    ('2G', 2 * 1024**3),
+    ('100B', 100),
+    ('5MiB', 5 * 1024**2),
+    ('off', None),
+    ('OFF', None),
+    ('0', None),
+])
+def test_parse_rate(text, rate):
+    assert ratelimit.parse_rate(text) == rate
+
+
+@pytest.mark.parametrize('text', ['fast', '5X', '-1M', 'M'])
+def test_parse_rate_rejects(text):
+    with pytest.raises(ValueError):
+        ratelimit.parse_rate(text)
+
+
+def test_parse_schedule_single_rate():
+    assert ratelimit.parse_schedule('5M') == [(0, 5 * 1024**2)]
+    assert ratelimit.parse_schedule('off') == [(0, None)]
+
+
+def test_parse_schedule_timetable_sorted():
+    assert ratelimit.parse_schedule('18:00,off 08:30,5M') == [(8 * 60 + 30, 5 * 1024**2), (18 * 60, None)]
+
+
+@pytest.mark.parametrize('text', ['24:00,5M', '08:60,5M', '8,5M', '08:00', '08:00,5M 5M', '08:00,fast'])
+def test_parse_schedule_rejects(text):
+    with pytest.raises(ValueError):
+        ratelimit.parse_schedule(text)
+
+
+def test_rate_at():
+    schedule = ratelimit.parse_schedule('08:00,5M 18:00,off')
+    assert ratelimit.rate_at(schedule, 8 * 60) == 5 * 1024**2
+    assert ratelimit.rate_at(schedule, 17 * 60 + 59) == 5 * 1024**2
+    assert ratelimit.rate_at(schedule, 18 * 60) is None
+    assert ratelimit.rate_at(schedule, 23 * 60) is None
+
+
+def test_rate_at_wraps_before_first_entry():
+    schedule = ratelimit.parse_schedule('08:00,5M 18:00,1M')
+    assert ratelimit.rate_at(schedule, 0) == 1024**2# Yesterday's 18:00 entry still applies.
+    assert ratelimit.rate_at(schedule, 7 * 60 + 59) == 1024**2
+
+
+def test_split_schedule_single_rate():
+    assert ratelimit.split_schedule('4M', 4) == '1048576B'
+    assert ratelimit.parse_rate(ratelimit.split_schedule('4M', 4)) == 1024**2
+    assert ratelimit.split_schedule('off', 4) == 'off'
+
+
+def test_split_schedule_timetable():
+    assert ratelimit.split_schedule('08:00,4M 18:00,off', 2) == '08:00,2097152B 18:00,off'
+
+
+def test_split_schedule_unsplit():
+    assert ratelimit.split_schedule('4M', 1) == '4M'
+    assert ratelimit.split_schedule(None, 4) is None
+
+
+def test_bwlimit_arg():
+    assert ratelimit.bwlimit_arg('08:00,5M 18:00,off') == '08:00,5M 18:00,off'
+    with pytest.raises(argparse.ArgumentTypeError):
+        ratelimit.bwlimit_arg('08:00,fast')
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(ratelimit.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_consume_debt(clock):
+    limiter = ratelimit.RateLimiter('1000B')
+    assert limiter.consume(500) == 0.5# Bucket starts empty.
+    assert limiter.consume(1000) == 1.0# Slept off the first debt, now owes for this read.
+    clock.now += 10# Idle time only refills up to one second's worth.
+    assert limiter.consume(1500) == 0.5
+    assert clock.slept == [0.5, 1.0, 0.5]
+
+
+def test_consume_burst(clock):
+    limiter = ratelimit.RateLimiter('1000B')
+    clock.now += 5
+    assert limiter.consume(1000) == 0.0# Burst of up to one second.
+    assert limiter.consume(2000) == 2.0
+    assert limiter.consume(0) == 0.0
+
+
+def test_consume_unlimited(clock):
+    limiter = ratelimit.RateLimiter('off')
+    assert limiter.consume(10**9) == 0.0
+    assert limiter.chunk_size(1024**2) == 1024**2
+
+
+def test_chunk_size():
+    limiter = ratelimit.RateLimiter('1M')
+    assert limiter.chunk_size(1024**2) == 1024**2 // 4
+    assert ratelimit.RateLimiter('1K').chunk_size(1024**2) == ratelimit.MIN_CHUNK_SIZE
+
+
+def test_configure():
+    try:
+        limiter = ratelimit.configure('1M')
+        assert ratelimit.configure('1M') is limiter# Unchanged limit keeps its bucket.
+        assert ratelimit.configure('2M') is not limiter
+        assert ratelimit.chunk_size(1024**2) == 2 * 1024**2 // 4
+    finally:
+        ratelimit.configure(None)
+    assert ratelimit.chunk_size(1024**2) == 1024**2
+    assert ratelimit.throttle(10**9) == 0.0
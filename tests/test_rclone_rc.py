@@ -0,0 +1,157 @@
+# RcloneRC against a stand-in rc server.
+import base64
+import json
+import threading
+import http.server
+
+import pytest
+
+import ia2rc
+import rclone_rc
+import retrycontrol
+
+
+class StubRC():
+    """Records every rc call; Async jobs finish after a couple of job/status polls, failing if their command is in fail."""
+    def __init__(self, user:str=None, password:str=None):
+        self.user = user
+        self.password = password
+        self.calls = [] # [(command, params, authorization header)]
+        self.jobs = {} # {jobid: [command, polls]}
+        self.fail = {} # {command: error text}
+        self.lock = threading.Lock()
+
+    def handle(self, command:str, params:dict, auth:str):
+        with self.lock:
+            self.calls.append((command, params, auth))
+            if self.user and (auth != 'Basic ' + base64.b64encode('{0}:{1}'.format(self.user, self.password).encode()).decode()):
+                return 401, {'error': 'unauthorized'}
+            if command == 'job/status':
+                job = self.jobs[params['jobid']]
+                job[1] += 1
+                if job[1] < 2:
+                    return 200, {'finished': False}
+                error = self.fail.get(job[0])
+                return 200, {'finished': True, 'success': error is None, 'error': error or '', 'duration': 0.1, 'output': {'command': job[0]}}
+            if command == 'operations/list':
+                if command in self.fail:
+                    return 404, {'error': self.fail[command], 'status': 404}
+                return 200, {'list': [{'Path': 'a.txt', 'Hashes': {'md5': 'abc'}}]}
+            if params.get('_async'):
+                jobid = len(self.jobs) + 1
+                self.jobs[jobid] = [command, 0]
+                return 200, {'jobid': jobid}
+            return 200, {}
+
+    def commands(self) -> list:
+        return [c for c, p, a in self.calls if c not in ('job/status', 'rc/noop')]
+
+    def params(self, command:str) -> dict:
+        return [p for c, p, a in self.calls if c == command][-1]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(rclone_rc, 'POLL_INTERVAL', 0.01)
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    rc = StubRC(user='user', password='secret')
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            status, result = rc.handle(self.path.strip('/'), json.loads(body or b'{}'), self.headers.get('Authorization'))
+            data = json.dumps(result).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    rc.url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+    yield rc
+    server.shutdown()
+    server.server_close()
+
+
+def client(stub) -> rclone_rc.RcloneRC:
+    return rclone_rc.RcloneRC(rc_url=stub.url, rc_user='user', rc_pass='secret')
+
+
+def test_call_sends_auth(stub):
+    rc = client(stub)
+    assert rc.call('core/version') == {}
+    assert all(auth and auth.startswith('Basic ') for c, p, auth in stub.calls)
+
+
+def test_call_raises_on_http_error(stub):
+    rc = client(stub)
+    rc.session.auth = ('user', 'wrong')
+    with pytest.raises(rclone_rc.RcloneRCError, match='unauthorized'):
+        rc.call('core/version')
+
+
+def test_run_job_polls_until_finished(stub):
+    rc = client(stub)
+    assert rc.run_job('sync/copy', {'srcFs': 'a', 'dstFs': 'b'}) == {'command': 'sync/copy'}
+    assert stub.params('sync/copy') == {'srcFs': 'a', 'dstFs': 'b', '_async': True}
+    polls = [p for c, p, a in stub.calls if c == 'job/status']
+    assert len(polls) == 2
+    assert all(p == {'jobid': 1} for p in polls)
+
+
+def test_run_job_surfaces_job_error(stub):
+    stub.fail['sync/move'] = 'directory not found'
+    rc = client(stub)
+    with pytest.raises(rclone_rc.RcloneRCError, match='directory not found'):
+        rc.run_job('sync/move', {})
+
+
+def test_move_file(stub, tmp_path):
+    rc = client(stub)
+    rc.move_file(str(tmp_path), 'a.txt', 'remote:dest')
+    assert stub.params('operations/movefile') == {'srcFs': str(tmp_path), 'srcRemote': 'a.txt', 'dstFs': 'remote:dest', 'dstRemote': 'a.txt', '_async': True}
+    rc.move_file(str(tmp_path), 'a.txt', 'remote:dest', keep_source=True)
+    assert stub.commands()[-1] == 'operations/copyfile'
+
+
+def test_copy_file(stub):
+    rc = client(stub)
+    rc.copy_file('remote:item1/sub/a.txt', 'remote:item2/b.txt')
+    assert stub.params('operations/copyfile') == {'srcFs': 'remote:item1/sub', 'srcRemote': 'a.txt', 'dstFs': 'remote:item2', 'dstRemote': 'b.txt', '_async': True}
+
+
+def test_list(stub):
+    rc = client(stub)
+    assert rc.list('remote:item', show_hash=True) == [{'Path': 'a.txt', 'Hashes': {'md5': 'abc'}}]
+    assert stub.params('operations/list') == {'fs': 'remote:item', 'remote': '', 'opt': {'recurse': True, 'showHash': True, 'hashTypes': ['md5'], 'filesOnly': True}}
+    rc.list('remote:item', rc_max_depth=1)
+    assert stub.params('operations/list') == {'fs': 'remote:item', 'remote': '', 'opt': {'recurse': True, 'maxDepth': 1}}
+
+
+@pytest.fixture
+def daemon(stub, monkeypatch):
+    monkeypatch.setattr(rclone_rc, '_daemon', client(stub))
+    monkeypatch.setattr(retrycontrol, '_controllers', {})
+    return stub
+
+
+def test_list_hashes(daemon):
+    assert ia2rc.rclone_list_hashes('remote:item', rc_rcd=True) == {'a.txt': {'size': None, 'md5': 'abc'}}
+
+
+def test_list_hashes_missing_dir_is_empty(daemon):
+    daemon.fail['operations/list'] = 'directory not found'
+    assert ia2rc.rclone_list_hashes('remote:item', rc_rcd=True) == {}
+    assert ia2rc.rclone_controller('remote:item').failures == 0
+
+
+def test_list_hashes_error(daemon):
+    daemon.fail['operations/list'] = 'couldn\'t connect'
+    assert ia2rc.rclone_list_hashes('remote:item', rc_rcd=True) is None
+    assert ia2rc.rclone_controller('remote:item').failures == 1
@@ -0,0 +1,70 @@
+# Shared backoff and circuit breaking, for IA hosts and rclone remotes.
+import pytest
+
+import retrycontrol
+import rclone_cli
+import ia2rc
+
+
+@pytest.fixture(autouse=True)
+def controllers(monkeypatch):
+    monkeypatch.setattr(retrycontrol, '_controllers', {})
+
+
+def test_backoff_delay_bounds():
+    controller = retrycontrol.HostController('example.org', base_delay=2, max_delay=10)
+    for attempt, full in [(1, 2), (2, 4), (3, 8), (4, 10), (10, 10)]:
+        delay = controller.backoff_delay(attempt)
+        assert (full / 2) <= delay <= full
+
+
+def test_circuit_opens_after_threshold():
+    controller = retrycontrol.HostController('example.org', failure_threshold=3, open_seconds=30)
+    controller.failure()
+    controller.failure()
+    assert controller.state == retrycontrol.CLOSED
+    controller.failure()
+    assert controller.state == retrycontrol.OPEN
+    assert controller.blocked_until > 0
+    controller.success()
+    assert (controller.state, controller.failures, controller.blocked_until) == (retrycontrol.CLOSED, 0, 0.0)
+
+
+@pytest.mark.parametrize('message, throttled', [
+    ('Error 429: Too Many Requests', True),
+    ('googleapi: Error 403: User Rate Limit Exceeded, userRateLimitExceeded', True),
+    ('directory not found', False),
+])
+def test_report_message(message, throttled):
+    controller = retrycontrol.HostController('rclone:gdrive')
+    controller.report_message(message)
+    assert controller.failures == 1
+    assert (controller.blocked_until > 0) == throttled# Throttling pauses everyone, plain failures only the caller.
+
+
+def test_retry_after_seconds():
+    class Response():
+        headers = {'Retry-After': '7'}
+    assert retrycontrol.retry_after_seconds(Response()) == 7.0
+    Response.headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    assert retrycontrol.retry_after_seconds(Response()) == 0.0# In the past.
+    Response.headers = {}
+    assert retrycontrol.retry_after_seconds(Response()) is None
+
+
+def test_rclone_controller_per_remote():
+    assert ia2rc.rclone_controller('gdrive:a/b') is ia2rc.rclone_controller('gdrive:c')
+    assert ia2rc.rclone_controller('gdrive:a') is not ia2rc.rclone_controller('s3:a')
+    assert ia2rc.rclone_controller('gdrive:a') is not retrycontrol.get_controller('gdrive')
+
+
+def test_rclone_guarded_reports():
+    controller = ia2rc.rclone_controller('gdrive:a')
+    with ia2rc.rclone_guarded('gdrive:a'):
+        pass
+    assert controller.failures == 0
+    with pytest.raises(rclone_cli.RcloneError):
+        with ia2rc.rclone_guarded('gdrive:a'):
+            raise rclone_cli.RcloneError(cmd=['rclone', 'copy'], returncode=5, errors=['Error 429'])
+    assert controller.failures == 1
+    assert controller.blocked_until > 0
@@ -0,0 +1,103 @@
+# SQLite state store and the import of the old text listfiles.
+import sqlite3
+
+import pytest
+
+import statestore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'state.sqlite3')
+
+
+@pytest.fixture
+def store(db_path):
+    store = statestore.StateStore(db_path=db_path)
+    yield store
+    store.close()
+
+
+def test_files_round_trip(store):
+    store.set_file('item', 'a.bin', statestore.FILE_DOWNLOADED, size=3, md5='abc')
+    store.set_file('item', 'b.bin', statestore.FILE_VERIFY_FAILED)
+    files = store.get_files('item')
+    assert files['a.bin']['size'] == 3
+    assert files['a.bin']['md5'] == 'abc'
+    assert list(store.get_files('item', status=statestore.FILE_VERIFY_FAILED)) == ['b.bin']
+    assert store.get_files('other') == {}
+
+
+def test_file_update_keeps_known_size_and_md5(store):
+    store.set_file('item', 'a.bin', statestore.FILE_VERIFY_FAILED, size=3, md5='abc')
+    store.set_file('item', 'a.bin', statestore.FILE_DOWNLOADED)
+    entry = store.get_files('item')['a.bin']
+    assert (entry['status'], entry['size'], entry['md5']) == (statestore.FILE_DOWNLOADED, 3, 'abc')
+
+
+def test_item_status(store):
+    assert store.item_status('item') is None
+    store.set_item('item', statestore.ITEM_STARTED, files_count=2)
+    assert store.item_status('item') == statestore.ITEM_STARTED
+    store.set_item('item', statestore.ITEM_DONE)
+    assert store.item_status('item') == statestore.ITEM_DONE
+
+
+def test_uploads_and_content(store):
+    store.set_upload('item', 'a.bin', 'one:item')
+    store.set_upload('item', 'a.bin', 'two:item')
+    assert store.get_uploads('item') == {'a.bin': {'one:item', 'two:item'}}
+    store.add_content('ABC', 'one:item/a.bin', size=3)
+    store.add_content('abc', 'two:item/a.bin', size=3)# First copy is kept.
+    assert store.find_content('abc') == {'size': 3, 'rc_path': 'one:item/a.bin'}
+    store.forget_content('abc', 'one:item/a.bin')
+    assert store.find_content('abc') is None
+
+
+def test_writes_are_batched(db_path):
+    store = statestore.StateStore(db_path=db_path, batch_size=3)
+    other = sqlite3.connect(db_path)
+    store.set_file('item', 'a.bin', statestore.FILE_DOWNLOADED)
+    store.set_file('item', 'b.bin', statestore.FILE_DOWNLOADED)
+    assert other.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 0
+    store.set_file('item', 'c.bin', statestore.FILE_DOWNLOADED)
+    assert other.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 3
+    store.set_file('item', 'd.bin', statestore.FILE_DOWNLOADED)
+    store.close()
+    assert other.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 4
+    other.close()
+
+
+def test_buffered_writes_do_not_lock_other_processes(db_path):
+    store = statestore.StateStore(db_path=db_path)
+    store.set_item('item', statestore.ITEM_STARTED)# Buffered, as while an item downloads.
+    other = sqlite3.connect(db_path, timeout=0)
+    with other:
+        other.execute("INSERT INTO items (identifier, status, updated) VALUES ('other', 'started', 0)")
+    other.close()
+    assert store.item_status('other') == statestore.ITEM_STARTED
+    store.close()
+
+
+def test_import_text_memory(tmp_path, store):
+    memory_dir = tmp_path / 'memory'
+    debug_dir = tmp_path / 'debug'
+    (memory_dir / 'done_files').mkdir(parents=True)
+    debug_dir.mkdir()
+    (memory_dir / 'done_files' / 'item1.txt').write_text('a.bin\nsub/b.bin\n')
+    (memory_dir / 'done_identifiers.txt').write_text('item1\nitem2\n')
+    (debug_dir / 'ia_dl_success_list.txt').write_text(
+        "Item(identifier='item3', collection=[])/c.bin\n"
+        'item4/d/e.bin\n'
+    )
+    counts = statestore.import_text_memory(store, memory_dir=str(memory_dir), debug_dir=str(debug_dir))
+    assert counts == {'files': 2, 'items': 2, 'success_list': 2}
+    assert set(store.get_files('item1', status=statestore.FILE_DOWNLOADED)) == {'a.bin', 'sub/b.bin'}
+    assert store.item_status('item2') == statestore.ITEM_DONE
+    assert list(store.get_files('item3')) == ['c.bin']
+    assert list(store.get_files('item4')) == ['d/e.bin']
+
+
+def test_import_text_memory_without_listfiles(tmp_path, store):
+    counts = statestore.import_text_memory(store, memory_dir=str(tmp_path / 'memory'), debug_dir=str(tmp_path / 'debug'))
+    assert counts == {'files': 0, 'items': 0, 'success_list': 0}
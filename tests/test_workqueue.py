@@ -0,0 +1,129 @@
+# Shared work queue leases and attempts.
+import pytest
+
+import workqueue
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(workqueue.time, 'time', clock.time)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = workqueue.WorkQueue(db_path=str(tmp_path / 'queue.sqlite3'), lease_seconds=10, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def row(queue, identifier) -> tuple:
+    return queue.conn.execute('SELECT status, owner, attempts FROM queue WHERE identifier=?', (identifier,)).fetchone()
+
+
+def test_add_keeps_order_and_skips_duplicates(queue):
+    assert queue.add(['a', 'b']) == 2
+    assert queue.add(['c', 'a']) == 1
+    assert [queue.claim('h1') for i in range(4)] == ['a', 'b', 'c', None]
+
+
+def test_claim_leases_to_owner(queue):
+    queue.add(['a'])
+    assert queue.claim('h1') == 'a'
+    assert row(queue, 'a') == (workqueue.LEASED, 'h1', 1)
+    assert queue.claim('h2') is None# Leased, not pending.
+
+
+def test_expired_lease_is_requeued(queue, clock):
+    queue.add(['a'])
+    queue.claim('h1')
+    clock.now += 11
+    assert queue.claim('h2') == 'a'
+    assert row(queue, 'a') == (workqueue.LEASED, 'h2', 2)
+
+
+def test_heartbeat_keeps_lease(queue, clock):
+    queue.add(['a'])
+    queue.claim('h1')
+    clock.now += 8
+    assert queue.heartbeat(['a'], owner='h1') == []
+    clock.now += 8
+    assert queue.claim('h2') is None
+    assert queue.heartbeat(['a'], owner='h2') == ['a']# Not h2's.
+
+
+def test_expired_lease_fails_after_max_attempts(queue, clock):
+    queue.add(['a'])
+    queue.claim('h1')
+    clock.now += 11
+    queue.claim('h2')
+    clock.now += 11
+    assert queue.claim('h3') is None
+    assert row(queue, 'a') == (workqueue.FAILED, None, 2)
+
+
+def test_finish_success(queue):
+    queue.add(['a'])
+    queue.claim('h1')
+    assert queue.finish('a', owner='h1') == workqueue.DONE
+    assert queue.counts()[workqueue.DONE] == 1
+
+
+def test_finish_error_requeues_then_fails(queue):
+    queue.add(['a'])
+    queue.claim('h1')
+    assert queue.finish('a', owner='h1', error='boom') == workqueue.PENDING
+    queue.claim('h1')
+    assert queue.finish('a', owner='h1', error='boom') == workqueue.FAILED
+    assert queue.claim('h1') is None
+
+
+def test_finish_ignored_without_lease(queue, clock):
+    queue.add(['a'])
+    queue.claim('h1')
+    clock.now += 11
+    queue.claim('h2')
+    assert queue.finish('a', owner='h1') is None# h1's late success doesn't count.
+    assert queue.finish('a', owner='h1', error='boom') is None
+    assert row(queue, 'a') == (workqueue.LEASED, 'h2', 2)
+    assert queue.finish('a', owner='h2') == workqueue.DONE
+
+
+def test_requeue_failed(queue):
+    queue.add(['a', 'b'])
+    queue.claim('h1')
+    queue.finish('a', owner='h1', error='boom')
+    queue.claim('h1')
+    queue.finish('a', owner='h1', error='boom')
+    assert queue.requeue_failed() == 1
+    assert row(queue, 'a') == (workqueue.PENDING, None, 0)
+    assert queue.counts() == {workqueue.PENDING: 2, workqueue.LEASED: 0, workqueue.DONE: 0, workqueue.FAILED: 0}
+    assert not queue.conn.in_transaction
+
+
+def test_heartbeat_thread_records_lost_leases(queue, clock):
+    queue.add(['a'])
+    queue.claim('h1')
+    heartbeat = workqueue.Heartbeat(queue=queue, owner='h1', interval=0.01)
+    try:
+        clock.now += 11
+        queue.claim('h2')
+        heartbeat.add('a')
+        for i in range(500):
+            if heartbeat.is_lost('a'):
+                break
+            heartbeat.stopping.wait(0.01)
+        assert heartbeat.is_lost('a')
+        heartbeat.remove('a')
+        assert not heartbeat.is_lost('a')
+    finally:
+        heartbeat.stop()
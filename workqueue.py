@@ -0,0 +1,299 @@
+#!python3
+#-------------------------------------------------------------------------------
+# Name:        workqueue
+# Purpose: Shared queue of identifiers that workers on any number of hosts claim with time-limited leases.
+#
+# Author:      Ctrl-S
+#
+# Created:     18-10-2026
+# Copyright:   (c) Ctrl-S 2026
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+# StdLib
+import os
+import sys
+import logging
+import argparse
+import time
+import socket
+import sqlite3
+import threading
+# Py3-specific stdlib
+# Py2-specific stdlib
+# Remote libraries
+# Local
+import common # General-purpose functions.
+
+
+
+DEFAULT_LEASE_SECONDS = 600 # A claimed item goes back in the queue if its worker is silent this long.
+DEFAULT_MAX_ATTEMPTS = 3 # Claims per item before it is given up on as failed.
+
+# Item statuses
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS queue (
+        identifier TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        owner TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        updated REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS queue_status ON queue (status, position)',
+]
+
+
+def default_owner() -> str:
+    """Name identifying this process to other workers, e.g. 'host1:1234'"""
+    return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue():
+    """Identifiers waiting to be processed, in one SQLite file that every worker opens.
+    Put it on storage all hosts can reach. WAL mode is deliberately not used, it does not work across network filesystems.
+    Workers claim() an item, which leases it to them for lease_seconds; heartbeat() extends the lease while they work.
+    A lease that runs out (The worker crashed, or its host went away) is put back in the queue for someone else,
+    until an item has been claimed max_attempts times.
+    Every change is its own short transaction, so many workers can share the file. Safe to share between threads.
+    """
+    def __init__(self, db_path:str, lease_seconds:float=DEFAULT_LEASE_SECONDS, max_attempts:int=DEFAULT_MAX_ATTEMPTS):
+        logging.debug('Opening work queue db_path=%r', db_path)
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.RLock()
+        common.ensure_parent_dir_exists(filepath=db_path)
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False, isolation_level=None)# Transactions are explicit.
+        with self.lock:
+            self._begin()
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+            self.conn.execute('COMMIT')
+
+    def _begin(self) -> None:
+        self.conn.execute('BEGIN IMMEDIATE')# Take the write lock up front so two claims can't pick the same row.
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def add(self, identifiers) -> int:
+        """Queue identifiers that aren't queued already, keeping their order.
+        Safe for every worker to call with the same list.
+        return the number added."""
+        added = 0
+        with self.lock:
+            self._begin()
+            try:
+                position = self.conn.execute('SELECT COALESCE(MAX(position), 0) FROM queue').fetchone()[0]
+                now = time.time()
+                for identifier in identifiers:
+                    position += 1
+                    cursor = self.conn.execute(
+                        'INSERT OR IGNORE INTO queue (identifier, position, status, updated) VALUES (?, ?, ?, ?)',
+                        (identifier, position, PENDING, now)
+                    )
+                    added += cursor.rowcount
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        logging.info('Added %s identifiers to the work queue', added)
+        return added
+
+    def _expire(self, now:float) -> None:
+        """Put items whose lease ran out back in the queue, or fail them if they have had enough attempts."""
+        expired = self.conn.execute('SELECT identifier, owner, attempts FROM queue WHERE status=? AND lease_until<?', (LEASED, now)).fetchall()
+        for identifier, owner, attempts in expired:
+            if attempts >= self.max_attempts:
+                logging.warning('Lease on identifier=%r held by owner=%r ran out after %s attempts, giving up on it', identifier, owner, attempts)
+                status = FAILED
+            else:
+                logging.warning('Lease on identifier=%r held by owner=%r ran out, requeueing it', identifier, owner)
+                status = PENDING
+            self.conn.execute(
+                'UPDATE queue SET status=?, owner=NULL, lease_until=NULL, error=?, updated=? WHERE identifier=?',
+                (status, 'lease expired (owner={0})'.format(owner), now, identifier)
+            )
+
+    def claim(self, owner:str):
+        """Lease the next pending item to owner.
+        return its identifier, or None if nothing is pending right now."""
+        with self.lock:
+            now = time.time()
+            self._begin()
+            try:
+                self._expire(now)
+                row = self.conn.execute('SELECT identifier FROM queue WHERE status=? ORDER BY position LIMIT 1', (PENDING,)).fetchone()
+                if row:
+                    self.conn.execute(
+                        'UPDATE queue SET status=?, owner=?, lease_until=?, attempts=attempts+1, updated=? WHERE identifier=?',
+                        (LEASED, owner, now + self.lease_seconds, now, row[0])
+                    )
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if row:
+            logging.info('Claimed identifier=%r for owner=%r', row[0], owner)
+            return row[0]
+        return None
+
+    def heartbeat(self, identifiers:list, owner:str) -> list:
+        """Extend owner's leases on identifiers.
+        return the identifiers whose lease owner no longer holds."""
+        lost = []
+        with self.lock:
+            now = time.time()
+            self._begin()
+            try:
+                for identifier in identifiers:
+                    cursor = self.conn.execute(
+                        'UPDATE queue SET lease_until=?, updated=? WHERE identifier=? AND status=? AND owner=?',
+                        (now + self.lease_seconds, now, identifier, LEASED, owner)
+                    )
+                    if cursor.rowcount == 0:
+                        lost.append(identifier)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        for identifier in lost:
+            logging.warning('owner=%r lost its lease on identifier=%r', owner, identifier)
+        return lost
+
+    def finish(self, identifier:str, owner:str, error:str=None) -> str:
+        """Report how processing an item went.
+        Success marks it done; A failure requeues it for another attempt (Possibly on another host) until max_attempts, then marks it failed.
+        Either is ignored if owner no longer holds the lease, the item belongs to whoever claimed it since.
+        return the item's new status, or None if owner had lost the lease."""
+        with self.lock:
+            now = time.time()
+            self._begin()
+            try:
+                if error is None:
+                    cursor = self.conn.execute(
+                        'UPDATE queue SET status=?, lease_until=NULL, error=NULL, updated=? WHERE identifier=? AND status=? AND owner=?',
+                        (DONE, now, identifier, LEASED, owner)
+                    )
+                else:
+                    cursor = self.conn.execute(
+                        '''UPDATE queue SET status=(CASE WHEN attempts>=? THEN ? ELSE ? END), owner=NULL, lease_until=NULL, error=?, updated=?
+                        WHERE identifier=? AND status=? AND owner=?''',
+                        (self.max_attempts, FAILED, PENDING, error, now, identifier, LEASED, owner)
+                    )
+                row = self.conn.execute('SELECT status FROM queue WHERE identifier=?', (identifier,)).fetchone()
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if cursor.rowcount == 0:
+            logging.warning('owner=%r no longer holds the lease on identifier=%r, not recording its result (Status is %r)', owner, identifier, row[0] if row else None)
+            return None
+        return row[0]
+
+    def counts(self) -> dict:
+        """return {status: number of items}"""
+        with self.lock:
+            counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+            for status, n in self.conn.execute('SELECT status, COUNT(*) FROM queue GROUP BY status'):
+                counts[status] = n
+            return counts
+
+    def requeue_failed(self) -> int:
+        """Give failed items another max_attempts.
+        return the number requeued."""
+        with self.lock:
+            self._begin()
+            try:
+                cursor = self.conn.execute('UPDATE queue SET status=?, attempts=0, error=NULL, updated=? WHERE status=?', (PENDING, time.time(), FAILED))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        logging.info('Requeued %s failed identifiers', cursor.rowcount)
+        return cursor.rowcount
+
+
+class Heartbeat():
+    """Background thread keeping an owner's leases alive while their items are being worked on."""
+    def __init__(self, queue:WorkQueue, owner:str, interval:float=None):
+        self.queue = queue
+        self.owner = owner
+        self.interval = interval or max(1.0, queue.lease_seconds / 3)# A couple of missed beats are survivable.
+        self.held = set()
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='ia2rc-heartbeat', daemon=True)
+        self.thread.start()
+
+    def add(self, identifier:str) -> None:
+        with self.lock:
+            self.held.add(identifier)
+
+    def remove(self, identifier:str) -> None:
+        with self.lock:
+            self.held.discard(identifier)
+            self.lost.discard(identifier)
+
+    def is_lost(self, identifier:str) -> bool:
+        """Whether the lease on identifier has been found to belong to someone else now."""
+        with self.lock:
+            return identifier in self.lost
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            with self.lock:
+                held = list(self.held - self.lost)
+            if not held:
+                continue
+            try:
+                lost = self.queue.heartbeat(held, owner=self.owner)
+            except sqlite3.Error as err:# Shared storage hiccup; The lease has slack for a few of these.
+                logging.exception(err)
+                continue
+            with self.lock:
+                self.lost.update(lost)
+
+
+def command_line():
+    # Handle command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queue_db', help='Work queue database, as given to multi_by_identifier.py --queue_db',
+        type=str)
+    parser.add_argument('--requeue_failed', help='Put failed identifiers back in the queue.',
+        default=False, action='store_true')
+    common.add_logging_args(parser)# Consumed by setup_logging_from_argv()
+    args = parser.parse_args()
+    logging.debug('args={args!r}'.format(args=args))# Record CLI arguments
+    queue = WorkQueue(db_path=args.queue_db)
+    if args.requeue_failed:
+        queue.requeue_failed()
+    logging.info('Work queue %r: %r', args.queue_db, queue.counts())
+    logging.info('Finished command-line invocation')
+    return
+
+
+def main():
+    command_line()
+
+if __name__ == '__main__':
+    logger = common.setup_logging_from_argv(os.path.join("debug", "workqueue.log.ts{ts}.txt"))# Setup logging, --log_mode etc.
+    try:
+        main()
+    except Exception as e:# Log unhandled exceptions.
+        logging.critical("Unhandled exception!")
+        logging.exception(e)
+    logging.info('Finshed. sys.argv={0}'.format(sys.argv))